@@ -0,0 +1,209 @@
+import pandas as pd
+import numpy as np
+import argparse
+import os
+
+from storage import CUBE_SCHEMA, DAYS_ORDER, FORMATS, MERGED_SCHEMA, load_table, save_table, table_path
+
+DIMENSIONS = ['hour', 'day_of_week', 'month', 'weather_description']
+
+class AggregationCube:
+    """Count, sum and sum of squares of every activity measure per
+    (hour x weekday x month x weather condition) cell of the merged data.
+
+    Any mean or standard deviation over a group of these dimensions is a sum
+    over cells, so statistics and plots are answered from the cube without
+    scanning the hourly rows again. The last weather slot collects hours whose
+    weather code has no description; it is left out of slices by weather.
+    """
+
+    def __init__(self, weather_conditions, measures, count, sums, sum_squares):
+        self.labels = {
+            'hour': np.arange(24),
+            'day_of_week': np.array(DAYS_ORDER, dtype=object),
+            'month': np.arange(1, 13),
+            'weather_description': np.array(list(weather_conditions) + [None], dtype=object)
+        }
+        self.measures = list(measures)
+        # count has the dimension shape, sums and sum_squares one more axis for the measure
+        self.count = count
+        self.sums = sums
+        self.sum_squares = sum_squares
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build the cube from merged data in one bincount pass per statistic."""
+        measures = [col for col in df.columns if col.endswith('_count')] + ['total_activity']
+        weather = df['weather_description'].astype('category')
+        conditions = list(weather.cat.categories)
+        codes = weather.cat.codes.to_numpy().astype(np.int64)
+        codes[codes < 0] = len(conditions)
+
+        timestamps = df['timestamp'].dt
+        shape = (24, 7, 12, len(conditions) + 1)
+        cells = np.ravel_multi_index((timestamps.hour.to_numpy(), timestamps.dayofweek.to_numpy(),
+                                      timestamps.month.to_numpy() - 1, codes), shape)
+        values = df[measures].to_numpy(dtype=np.float64)
+        size = int(np.prod(shape))
+
+        count = np.bincount(cells, minlength=size).reshape(shape)
+        sums = np.stack([np.bincount(cells, weights=values[:, i], minlength=size)
+                         for i in range(len(measures))], axis=-1).reshape(shape + (len(measures),))
+        sum_squares = np.stack([np.bincount(cells, weights=values[:, i] ** 2, minlength=size)
+                                for i in range(len(measures))], axis=-1).reshape(shape + (len(measures),))
+        return cls(conditions, measures, count, sums, sum_squares)
+
+    def to_frame(self):
+        """Long table of the non-empty cells, one row per (cell, activity measure)."""
+        occupied = np.nonzero(self.count)
+        columns = {dimension: self.labels[dimension][index] for dimension, index in zip(DIMENSIONS, occupied)}
+        cells = pd.DataFrame(columns)
+        frames = []
+        for i, measure in enumerate(self.measures):
+            frames.append(cells.assign(activity=measure,
+                                       count=self.count[occupied],
+                                       sum=self.sums[occupied + (i,)],
+                                       sum_sq=self.sum_squares[occupied + (i,)]))
+        return pd.concat(frames, ignore_index=True)
+
+    @classmethod
+    def from_table(cls, table):
+        """Rebuild a cube from the long table written by `to_frame`."""
+        conditions = sorted(pd.unique(table['weather_description'].dropna()))
+        measures = list(pd.unique(table['activity']))
+        shape = (24, 7, 12, len(conditions) + 1)
+
+        weather = pd.Categorical(table['weather_description'], categories=conditions).codes.astype(np.int64)
+        weather[weather < 0] = len(conditions)
+        index = (table['hour'].to_numpy(dtype=np.int64),
+                 pd.Categorical(table['day_of_week'], categories=DAYS_ORDER).codes.astype(np.int64),
+                 table['month'].to_numpy(dtype=np.int64) - 1,
+                 weather)
+        measure_index = pd.Categorical(table['activity'], categories=measures).codes.astype(np.int64)
+
+        count = np.zeros(shape, dtype=np.int64)
+        sums = np.zeros(shape + (len(measures),))
+        sum_squares = np.zeros(shape + (len(measures),))
+        count[index] = table['count'].to_numpy()
+        sums[index + (measure_index,)] = table['sum'].to_numpy()
+        sum_squares[index + (measure_index,)] = table['sum_sq'].to_numpy()
+        return cls(conditions, measures, count, sums, sum_squares)
+
+    def save(self, path, fmt='csv'):
+        return save_table(self.to_frame(), path, fmt, CUBE_SCHEMA)
+
+    @classmethod
+    def load(cls, path, fmt='csv'):
+        return cls.from_table(load_table(path, fmt, CUBE_SCHEMA))
+
+    def expand(self, weather_conditions, measures):
+        """The same cube over a superset of weather conditions and measures; new cells and measures are zero."""
+        conditions = list(weather_conditions)
+        shape = (24, 7, 12, len(conditions) + 1)
+        slots = [conditions.index(condition) for condition in self.labels['weather_description'][:-1]]
+        slots = np.array(slots + [len(conditions)], dtype=np.int64)
+        columns = np.array([list(measures).index(measure) for measure in self.measures], dtype=np.int64)
+
+        count = np.zeros(shape, dtype=self.count.dtype)
+        sums = np.zeros(shape + (len(measures),))
+        sum_squares = np.zeros(shape + (len(measures),))
+        count[..., slots] = self.count
+        sums[..., slots[:, None], columns] = self.sums
+        sum_squares[..., slots[:, None], columns] = self.sum_squares
+        return AggregationCube(conditions, measures, count, sums, sum_squares)
+
+    def merge(self, other):
+        """Cube of the hours of both cubes, e.g. of two partitions of the merged data."""
+        conditions = sorted(set(self.labels['weather_description'][:-1])
+                            | set(other.labels['weather_description'][:-1]))
+        measures = self.measures + [measure for measure in other.measures if measure not in self.measures]
+        left, right = self.expand(conditions, measures), other.expand(conditions, measures)
+        return AggregationCube(conditions, measures, left.count + right.count, left.sums + right.sums,
+                               left.sum_squares + right.sum_squares)
+
+    def subtract(self, other):
+        """Cube without the hours of `other`, which must have been merged into this one."""
+        right = other.expand(self.labels['weather_description'][:-1], self.measures)
+        return AggregationCube(self.labels['weather_description'][:-1], self.measures, self.count - right.count,
+                               self.sums - right.sums, self.sum_squares - right.sum_squares)
+
+    def aggregate(self, by=(), measures=None):
+        """Count, sum, mean and sample standard deviation per group of the `by` dimensions.
+
+        Returns a DataFrame indexed by `by` (one row if `by` is empty) with
+        `count` plus `<measure>_sum`, `<measure>_mean` and `<measure>_std`
+        columns; groups without any hours are left out.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        measures = self.measures if measures is None else list(measures)
+        count, sums, sum_squares = self.count, self.sums, self.sum_squares
+        if 'weather_description' in by:
+            # Hours without a weather description are not a weather group
+            count, sums, sum_squares = count[..., :-1], sums[..., :-1, :], sum_squares[..., :-1, :]
+
+        axes = tuple(i for i, dimension in enumerate(DIMENSIONS) if dimension not in by)
+        count = count.sum(axis=axes)
+        sums = sums.sum(axis=axes)
+        sum_squares = sum_squares.sum(axis=axes)
+
+        # Remaining axes are in DIMENSIONS order; move them into the order of `by`
+        kept = [dimension for dimension in DIMENSIONS if dimension in by]
+        order = [kept.index(dimension) for dimension in by]
+        count = np.transpose(count, order).reshape(-1)
+        sums = np.transpose(sums, order + [len(order)]).reshape(-1, len(self.measures))
+        sum_squares = np.transpose(sum_squares, order + [len(order)]).reshape(-1, len(self.measures))
+
+        if by:
+            labels = [self.labels[dimension][:-1] if dimension == 'weather_description'
+                      else self.labels[dimension] for dimension in by]
+            index = pd.MultiIndex.from_product(labels, names=by)
+            if len(by) == 1:
+                index = index.get_level_values(0)
+        else:
+            index = pd.RangeIndex(1)
+
+        columns = {'count': count}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for measure in measures:
+                i = self.measures.index(measure)
+                mean = sums[:, i] / count
+                variance = (sum_squares[:, i] - sums[:, i] * mean) / (count - 1)
+                columns[f'{measure}_sum'] = sums[:, i]
+                columns[f'{measure}_mean'] = mean
+                columns[f'{measure}_std'] = np.where(count > 1, np.sqrt(np.clip(variance, 0, None)), np.nan)
+        result = pd.DataFrame(columns, index=index)
+        return result[result['count'] > 0]
+
+def cube_path(data_path):
+    """Location of the cube persisted next to a merged data table."""
+    return os.path.join(os.path.dirname(data_path), 'aggregation_cube')
+
+def load_cube(data_path, fmt='csv'):
+    """Load the persisted cube, or None when it is missing or older than the data."""
+    path = table_path(cube_path(data_path), fmt)
+    data_file = table_path(data_path, fmt)
+    if os.path.exists(path) and (not os.path.exists(data_file)
+                                 or os.path.getmtime(path) >= os.path.getmtime(data_file)):
+        return AggregationCube.load(path, fmt)
+    return None
+
+def load_or_build_cube(df, data_path, fmt='csv'):
+    """Load the persisted cube, or rebuild it from `df` when it is missing or older than the data."""
+    cube = load_cube(data_path, fmt)
+    return cube if cube is not None else AggregationCube.from_frame(df)
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the aggregation cube of the merged data.')
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='Storage format of the merged data and the cube')
+    args = parser.parse_args()
+
+    data_path = 'data/merged_data/merged_data'
+    df = load_table(data_path, args.format, MERGED_SCHEMA)
+    cube = AggregationCube.from_frame(df)
+    output_path = cube.save(cube_path(data_path), args.format)
+    print(f"Aggregation cube with {int((cube.count > 0).sum())} non-empty cells "
+          f"and {len(cube.measures)} measures saved to {output_path}")
+
+if __name__ == "__main__":
+    main()
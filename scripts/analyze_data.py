@@ -1,41 +1,123 @@
 import pandas as pd
 import numpy as np
 from scipy import stats
+import argparse
 import os
 
+from aggregation_cube import AggregationCube, load_cube
+from cross_correlation import cross_correlations
+from resampling import (ResamplingEngine, correlation, group_means, mean_difference, percentile_interval,
+                        permutation_p_values)
+from running_stats import RunningStatistics, load_running_stats
+from sessions import load_sessions
+from storage import FORMATS, MERGED_SCHEMA, WEATHER_SCHEMA, load_table
+
 class TikTokWeatherAnalyzer:
-    def __init__(self, data_path='data/merged_data/merged_data.csv'):
-        self.df = pd.read_csv(data_path)
-        self.df['timestamp'] = pd.to_datetime(self.df['timestamp'])
+    def __init__(self, data_path='data/merged_data/merged_data.csv', data_format='csv', df=None, cube=None,
+                 stats=None, sessions=None):
+        # A DataFrame (and cube or running statistics) passed in memory, e.g. by pipeline.py,
+        # replaces loading from disk
+        self.data_path = data_path
+        self.data_format = data_format
+        self._df = df
+        if stats is None and df is None:
+            stats = load_running_stats(data_path, data_format)
+        self._stats = stats
+        # Sessions are optional: without a session table the session metrics are skipped
+        if sessions is None and df is None:
+            sessions = load_sessions(data_path, data_format)
+        self.sessions = sessions
+        if cube is None and stats is not None:
+            cube = stats.cube
+        elif cube is None and df is None:
+            cube = load_cube(data_path, data_format)
+        self.cube = cube if cube is not None else AggregationCube.from_frame(self.df)
+
+    @property
+    def df(self):
+        """Merged data, loaded on first use: statistics answered from the running statistics do not need it."""
+        if self._df is None:
+            self._df = load_table(self.data_path, self.data_format, MERGED_SCHEMA)
+        return self._df
+
+    @property
+    def stats(self):
+        if self._stats is None:
+            self._stats = RunningStatistics.from_frame(self.df, self.cube)
+        return self._stats
         
     def calculate_basic_stats(self):
         """Calculate basic statistics about TikTok usage."""
+        total_days = self.stats.total_days
+        total_activities = self.cube.aggregate(measures=['total_activity'])['total_activity_sum'].iloc[0]
+        weekly = self.cube.aggregate('day_of_week', ['total_activity'])
+        weekend = weekly.index.isin(['Saturday', 'Sunday'])
         stats_dict = {
-            'total_days': len(self.df['timestamp'].dt.date.unique()),
-            'total_activities': self.df['total_activity'].sum(),
-            'avg_daily_activities': self.df.groupby(self.df['timestamp'].dt.date)['total_activity'].sum().mean(),
-            'peak_activity_hour': self.df.groupby(self.df['timestamp'].dt.hour)['total_activity'].mean().idxmax(),
+            'total_days': total_days,
+            'total_activities': int(total_activities),
+            'avg_daily_activities': total_activities / total_days,
+            'median_hourly_activity': self.stats.quantile('total_activity', 0.5),
+            'peak_activity_hour': self.cube.aggregate('hour', ['total_activity'])['total_activity_mean'].idxmax(),
             'weekend_vs_weekday': {
-                'weekend_avg': self.df[self.df['is_weekend']]['total_activity'].mean(),
-                'weekday_avg': self.df[~self.df['is_weekend']]['total_activity'].mean()
+                'weekend_avg': weekly['total_activity_sum'][weekend].sum() / weekly['count'][weekend].sum(),
+                'weekday_avg': weekly['total_activity_sum'][~weekend].sum() / weekly['count'][~weekend].sum()
             }
         }
         return stats_dict
     
+    def correlation_matrix(self, activity_cols=None, feature_cols=None):
+        """Pearson and Spearman correlation of every (activity x weather/time feature) pair.
+
+        Activities default to the `_count` columns plus `total_activity`,
+        features to every other numeric or boolean column. Returns one row per
+        pair with `n`, `<method>_r`, `<method>_p` and Benjamini-Hochberg
+        `<method>_q` across all pairs.
+        """
+        if activity_cols is None:
+            activity_cols = [col for col in self.df.columns if col.endswith('_count')] + ['total_activity']
+        if feature_cols is None:
+            feature_cols = [col for col in self.df.columns if col not in activity_cols and
+                            (pd.api.types.is_numeric_dtype(self.df[col]) or pd.api.types.is_bool_dtype(self.df[col]))]
+        activities = self.df[activity_cols].to_numpy(dtype=np.float64)
+        features = self.df[feature_cols].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(features)
+
+        pearson_r, n = pairwise_pearson(activities, features, valid)
+        # Ranks depend on which rows a feature has, so activities are ranked once per missing-value pattern
+        spearman_r = np.full_like(pearson_r, np.nan)
+        patterns, groups = np.unique(valid, axis=1, return_inverse=True)
+        for i, rows in enumerate(patterns.T):
+            columns = np.flatnonzero(groups.reshape(-1) == i)
+            if rows.sum() < 3:
+                continue
+            ranked_features = stats.rankdata(features[rows][:, columns], axis=0)
+            spearman_r[:, columns] = pairwise_pearson(stats.rankdata(activities[rows], axis=0), ranked_features,
+                                                      np.ones(ranked_features.shape, dtype=bool))[0]
+
+        table = pd.DataFrame({
+            'activity': np.repeat(activity_cols, len(feature_cols)),
+            'feature': np.tile(feature_cols, len(activity_cols)),
+            'n': n.reshape(-1).astype(np.int64)
+        })
+        for method, r in [('pearson', pearson_r), ('spearman', spearman_r)]:
+            r = r.reshape(-1)
+            p_values = correlation_p_values(r, table['n'].to_numpy())
+            table[f'{method}_r'] = r
+            table[f'{method}_p'] = p_values
+            table[f'{method}_q'] = benjamini_hochberg(p_values)
+        return table
+
     def analyze_weather_correlation(self):
         """Analyze correlation between weather conditions and TikTok activity."""
-        weather_correlations = {
-            'temperature': stats.pearsonr(self.df['temperature'], self.df['total_activity']),
-            'precipitation': stats.pearsonr(self.df['precipitation'], self.df['total_activity'])
-        }
+        features = ['temperature', 'precipitation']
+        r, n = self.stats.correlation('total_activity', features)
+        weather_correlations = dict(zip(features, zip(r, correlation_p_values(r, n))))
         
         # Average activity by weather description
-        weather_activity = (self.df.groupby('weather_description')
-                          .agg({
-                              'total_activity': 'mean',
-                              'timestamp': 'count'
-                          })
-                          .rename(columns={'timestamp': 'occurrence_count'})
+        weather_activity = (self.cube.aggregate('weather_description', ['total_activity'])
+                          [['total_activity_mean', 'count']]
+                          .rename(columns={'total_activity_mean': 'total_activity',
+                                           'count': 'occurrence_count'})
                           .sort_values('total_activity', ascending=False))
         
         return {
@@ -43,22 +125,192 @@ class TikTokWeatherAnalyzer:
             'activity_by_weather': weather_activity
         }
     
+    def resample_statistics(self, replicates=10000, block_length=24, seed=0, workers=1, confidence=0.95):
+        """Block-bootstrap confidence intervals and block-permutation p-values of the main statistics.
+
+        Covers the correlation of total activity with every weather variable,
+        the mean activity per weather condition and the weekend minus weekday
+        gap. Rows are resampled in blocks of `block_length` hours, which keeps
+        the autocorrelation of the hourly series that the analytic p-values
+        ignore. Returns one row per statistic and group.
+        """
+        df = self.df.sort_values('timestamp', kind='stable')
+        activity = df['total_activity'].to_numpy(dtype=np.float64)
+        features = [col for col in WEATHER_SCHEMA if col != 'timestamp' and col in df.columns]
+        weather = df['weather_description'].astype('category')
+        conditions = list(weather.cat.categories)
+
+        statistics = {f'correlation:{feature}': correlation(activity, df[feature].to_numpy(dtype=np.float64))
+                      for feature in features}
+        statistics['mean_by_weather'] = group_means(activity, weather.cat.codes.to_numpy(), len(conditions))
+        statistics['weekend_gap'] = mean_difference(activity, df['is_weekend'].to_numpy(dtype=bool))
+        groups = {name: [name.split(':')[1]] for name in statistics if name.startswith('correlation:')}
+        groups.update({'mean_by_weather': conditions, 'weekend_gap': ['weekend - weekday']})
+
+        engines = {method: ResamplingEngine(replicates, block_length, method, seed, workers)
+                   for method in ('bootstrap', 'permutation')}
+        bootstrap = engines['bootstrap'].evaluate(statistics)
+        permutation = engines['permutation'].evaluate(statistics)
+
+        frames = []
+        for name in statistics:
+            observed, replicated = bootstrap[name]
+            low, high = percentile_interval(replicated, confidence)
+            frames.append(pd.DataFrame({
+                'statistic': name.split(':')[0],
+                'group': groups[name],
+                'observed': observed,
+                'ci_low': low,
+                'ci_high': high,
+                'p_value': permutation_p_values(*permutation[name])
+            }))
+        return pd.concat(frames, ignore_index=True)
+
+    def evenly_spaced(self):
+        """Rows on a complete timeline at the data's resolution; missing buckets have no activity and no weather."""
+        df = self.df.sort_values('timestamp', kind='stable').drop_duplicates('timestamp')
+        step = df['timestamp'].diff().min()
+        timeline = pd.date_range(df['timestamp'].iloc[0], df['timestamp'].iloc[-1], freq=step)
+        series = df.set_index('timestamp').reindex(timeline)
+        activity_cols = [col for col in df.columns if col.endswith('_count')] + ['total_activity']
+        series[activity_cols] = series[activity_cols].fillna(0)
+        return series
+
+    def lagged_correlations(self, max_lag=48, confidence=0.95):
+        """Correlation of every weather variable now with every activity type `lag` buckets later.
+
+        Lags run from 0 to `max_lag` buckets (hours for hourly data) and are
+        computed for all pairs at once with FFTs over the complete timeline.
+        Returns the full cross-correlation table, with the half-width of the
+        `confidence` null band per lag, and the peak lag (1..max_lag) of every
+        pair with whether it leaves the band.
+        """
+        series = self.evenly_spaced()
+        activity_cols = [col for col in series.columns if col.endswith('_count')] + ['total_activity']
+        weather_cols = [col for col in WEATHER_SCHEMA if col != 'timestamp' and col in series.columns]
+        r, band = cross_correlations(series[weather_cols].to_numpy(dtype=np.float64),
+                                     series[activity_cols].to_numpy(dtype=np.float64), max_lag, confidence)
+
+        lag, weather, activity = np.meshgrid(np.arange(max_lag + 1), weather_cols, activity_cols, indexing='ij')
+        table = pd.DataFrame({'weather': weather.ravel(), 'activity': activity.ravel(), 'lag': lag.ravel(),
+                              'r': r.ravel(), 'band': band.ravel()})
+
+        later = table[table['lag'] > 0]
+        peaks = later.loc[later['r'].abs().groupby([later['weather'], later['activity']], sort=False).idxmax()]
+        peaks = peaks.assign(significant=peaks['r'].abs() > peaks['band']).reset_index(drop=True)
+        return {'correlations': table, 'peaks': peaks}
+
+    def session_metrics(self, evening_start=18):
+        """Session length and depth per weather condition at the session start, and rainy vs dry evenings.
+
+        Evening sessions start at or after `evening_start` o'clock; they are
+        rainy when precipitation was recorded in the hour they start in. The
+        p-value is a two-sided Mann-Whitney U test of the durations.
+        """
+        sessions = self.sessions
+        aggregations = {'sessions': ('duration_minutes', 'size'),
+                        'mean_duration_minutes': ('duration_minutes', 'mean'),
+                        'median_duration_minutes': ('duration_minutes', 'median')}
+        # Session tables built before every count column was written may lack some of them
+        aggregations.update({f'mean_{column}': (column, 'mean') for column in ['videos_viewed', 'likes', 'shares']
+                             if column in sessions.columns})
+        by_weather = (sessions.groupby('weather_description', observed=True)
+                      .agg(**aggregations)
+                      .sort_values('mean_duration_minutes', ascending=False))
+
+        evenings = sessions[sessions['hour'] >= evening_start]
+        rainy = (evenings['precipitation'] > 0).map({True: 'rainy', False: 'dry'}).rename('evening')
+        evening = evenings.groupby(rainy).agg(**aggregations).reindex(['rainy', 'dry'])
+        durations = [evenings.loc[rainy == label, 'duration_minutes'] for label in ('rainy', 'dry')]
+        p_value = (stats.mannwhitneyu(*durations).pvalue if all(len(values) for values in durations)
+                   else np.nan)
+        return {
+            'summary': {
+                'sessions': len(sessions),
+                'median_duration_minutes': round(float(sessions['duration_minutes'].median()), 2),
+                'median_videos_viewed': (sessions['videos_viewed'].median() if 'videos_viewed' in sessions.columns
+                                         else np.nan),
+                'rainy_evening_p_value': p_value
+            },
+            'by_weather': by_weather,
+            'evening': evening
+        }
+
+    def run_all(self, replicates=2000, block_length=24, seed=0, workers=1):
+        """Compute every analysis result that `save_results` writes."""
+        resampling = self.resample_statistics(replicates, block_length, seed, workers)
+        weather_analysis = self.analyze_weather_correlation()
+        means = resampling[resampling['statistic'] == 'mean_by_weather'].set_index('group')
+        weather_analysis['activity_by_weather'] = weather_analysis['activity_by_weather'].join(
+            means[['ci_low', 'ci_high']])
+        return {
+            'basic_stats': self.calculate_basic_stats(),
+            'weather_analysis': weather_analysis,
+            'hourly_patterns': self.get_hourly_patterns(),
+            'correlation_matrix': self.correlation_matrix(),
+            'resampling': resampling,
+            'lagged_correlations': self.lagged_correlations(),
+            'sessions': self.session_metrics() if self.sessions is not None else None
+        }
+
+    def run_from_stats(self):
+        """Compute the results answered from the running statistics alone, without reading the hourly rows."""
+        return {
+            'basic_stats': self.calculate_basic_stats(),
+            'weather_analysis': self.analyze_weather_correlation(),
+            'hourly_patterns': self.get_hourly_patterns()
+        }
+
     def get_hourly_patterns(self):
         """Analyze hourly patterns in TikTok usage."""
-        return (self.df.groupby('hour')['total_activity']
-                .agg(['mean', 'count', 'sum'])
+        hourly = self.cube.aggregate('hour', ['total_activity'])
+        return (hourly[['total_activity_mean', 'count', 'total_activity_sum']]
+                .set_axis(['mean', 'count', 'sum'], axis=1)
+                .astype({'sum': 'int64'})
                 .round(2))
 
-def main():
-    analyzer = TikTokWeatherAnalyzer()
-    
-    # Calculate and save basic stats
-    basic_stats = analyzer.calculate_basic_stats()
-    weather_analysis = analyzer.analyze_weather_correlation()
-    hourly_patterns = analyzer.get_hourly_patterns()
-    
-    # Create output directory if it doesn't exist
-    output_dir = 'data/analysis_results'
+def pairwise_pearson(x, y, valid):
+    """Pearson r between every column of `x` and every column of `y`, and the pair sizes.
+
+    `valid` marks the usable rows of each `y` column (`x` has no missing
+    values); every pair uses the rows where its `y` column is valid. All
+    sums are matrix products, so there is no loop over pairs.
+    """
+    mask = valid.astype(np.float64)
+    x = x - x.mean(axis=0)
+    y = np.where(valid, y - np.nanmean(np.where(valid, y, np.nan), axis=0), 0.0)
+    n = np.broadcast_to(mask.sum(axis=0), (x.shape[1], y.shape[1]))
+    sum_x, sum_xx = x.T @ mask, (x ** 2).T @ mask
+    sum_y, sum_yy = y.sum(axis=0), (y ** 2).sum(axis=0)
+    sum_xy = x.T @ y
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = sum_xy - sum_x * sum_y / n
+        variance_x = sum_xx - sum_x ** 2 / n
+        variance_y = sum_yy - sum_y ** 2 / n
+        r = covariance / np.sqrt(variance_x * variance_y)
+    return np.clip(r, -1, 1), n
+
+def correlation_p_values(r, n):
+    """Two-sided p-values of correlation coefficients from the t distribution with n - 2 degrees of freedom."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = r * np.sqrt((n - 2) / (1 - r ** 2))
+    return np.where(np.isnan(r), np.nan, 2 * stats.t.sf(np.abs(t), n - 2))
+
+def benjamini_hochberg(p_values):
+    """Benjamini-Hochberg adjusted p-values (q-values); missing p-values stay missing."""
+    q_values = np.full(len(p_values), np.nan)
+    tested = np.flatnonzero(~np.isnan(p_values))
+    order = tested[np.argsort(p_values[tested])]
+    scaled = p_values[order] * len(order) / np.arange(1, len(order) + 1)
+    q_values[order] = np.minimum(np.minimum.accumulate(scaled[::-1])[::-1], 1)
+    return q_values
+
+# Detailed results that need the hourly rows
+DETAIL_FILES = ['correlations.csv', 'resampling.csv', 'lagged_correlations.csv', 'lag_peaks.csv',
+                'sessions_by_weather.csv', 'rainy_evening_sessions.csv']
+
+def save_results(results, output_dir='data/analysis_results'):
+    """Write the summary text and the detailed CSVs of `TikTokWeatherAnalyzer.run_all`."""
     os.makedirs(output_dir, exist_ok=True)
     
     # Save results
@@ -66,16 +318,78 @@ def main():
         f.write("=== TikTok Weather Analysis Results ===\n\n")
         
         f.write("Basic Statistics:\n")
-        for key, value in basic_stats.items():
+        for key, value in results['basic_stats'].items():
             f.write(f"{key}: {value}\n")
         
         f.write("\nWeather Correlations:\n")
-        for weather_type, (corr, p_value) in weather_analysis['correlations'].items():
+        for weather_type, (corr, p_value) in results['weather_analysis']['correlations'].items():
             f.write(f"{weather_type}: correlation={corr:.3f}, p-value={p_value:.3f}\n")
+        
+        if 'resampling' in results:
+            f.write("\nResampled (95% block-bootstrap CI, block-permutation p-value):\n")
+            for row in results['resampling'].itertuples(index=False):
+                if row.statistic != 'mean_by_weather':
+                    f.write(f"{row.statistic} {row.group}: {row.observed:.3f} "
+                            f"[{row.ci_low:.3f}, {row.ci_high:.3f}], p-value={row.p_value:.4f}\n")
+        
+        if 'lagged_correlations' in results:
+            f.write("\nStrongest lagged correlation with total activity (weather first):\n")
+            peaks = results['lagged_correlations']['peaks']
+            for row in peaks[peaks['activity'] == 'total_activity'].itertuples(index=False):
+                f.write(f"{row.weather}: r={row.r:.3f} at lag {row.lag}, band=±{row.band:.3f}"
+                        f"{' (significant)' if row.significant else ''}\n")
+        
+        if results.get('sessions') is not None:
+            f.write("\nSessions:\n")
+            for key, value in results['sessions']['summary'].items():
+                f.write(f"{key}: {value}\n")
+            for label, row in results['sessions']['evening'].iterrows():
+                f.write(f"{label} evenings: {row['sessions']:.0f} sessions, "
+                        f"median {row['median_duration_minutes']:.1f} minutes\n")
     
     # Save detailed results as CSV
-    weather_analysis['activity_by_weather'].to_csv(f"{output_dir}/weather_activity_patterns.csv")
-    hourly_patterns.to_csv(f"{output_dir}/hourly_patterns.csv")
+    results['weather_analysis']['activity_by_weather'].to_csv(f"{output_dir}/weather_activity_patterns.csv")
+    results['hourly_patterns'].to_csv(f"{output_dir}/hourly_patterns.csv")
+    # Results of a --chunked run stop here; the rest need the hourly rows, so the detail
+    # files of an earlier full run are removed rather than left next to the new summary
+    if 'correlation_matrix' not in results:
+        for filename in DETAIL_FILES:
+            if os.path.exists(f"{output_dir}/{filename}"):
+                os.remove(f"{output_dir}/{filename}")
+        return
+    results['correlation_matrix'].to_csv(f"{output_dir}/correlations.csv", index=False)
+    results['resampling'].to_csv(f"{output_dir}/resampling.csv", index=False)
+    results['lagged_correlations']['correlations'].to_csv(f"{output_dir}/lagged_correlations.csv", index=False)
+    results['lagged_correlations']['peaks'].to_csv(f"{output_dir}/lag_peaks.csv", index=False)
+    if results['sessions'] is not None:
+        results['sessions']['by_weather'].to_csv(f"{output_dir}/sessions_by_weather.csv")
+        results['sessions']['evening'].to_csv(f"{output_dir}/rainy_evening_sessions.csv")
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze the merged TikTok and weather data.')
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='Storage format of the merged data')
+    parser.add_argument('--replicates', type=int, default=2000,
+                        help='Bootstrap and permutation replicates')
+    parser.add_argument('--block-length', type=int, default=24,
+                        help='Hours per resampled block')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes for the resampling')
+    parser.add_argument('--chunked', action='store_true',
+                        help='Only compute the results answered from the running statistics of a chunked merge')
+    args = parser.parse_args()
+
+    if args.chunked:
+        stats = load_running_stats('data/merged_data/merged_data', args.format)
+        if stats is None:
+            print("Please run merge_data.py --chunk-size first to build the running statistics")
+            return
+        save_results(TikTokWeatherAnalyzer(data_format=args.format, stats=stats).run_from_stats())
+        return
+
+    analyzer = TikTokWeatherAnalyzer(data_format=args.format)
+    save_results(analyzer.run_all(args.replicates, args.block_length, args.seed, args.workers))
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,250 @@
+import pandas as pd
+import numpy as np
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial, reduce
+
+from aggregation_cube import AggregationCube, cube_path
+from analyze_data import TikTokWeatherAnalyzer, save_results
+from fetch_weather_data import (DEFAULT_VARIABLES, WeatherDataFetcher, coalesce_days, expand_days,
+                                fetch_location_weather, plan_location_ranges, save_location_weather)
+from locations import (LOCATIONS_DIR, assign_locations, build_location_timeline, load_ip_networks,
+                       load_location_timeline, load_locations)
+from merge_data import build_merged_dataset, load_tiktok_data, load_weather_data, save_merged_dataset
+from parse_tiktok_data import (ACTIVITY_TYPES, get_date_range, parse_activity, parse_all, parse_json_export,
+                               parse_records)
+from running_stats import RunningStatistics, stats_path
+from sessions import add_session_weather, build_sessions, sessions_path
+from storage import ACTIVITY_SCHEMA, FORMATS, SESSION_SCHEMA, save_table
+
+# Every user gets the directory layout of a single-user run below <output>/user=<name>/:
+# processed/, merged_data/ and analysis_results/. Weather is shared in <output>/weather/
+# and the cohort aggregate goes to <output>/cohort/.
+
+def user_dir(output_dir, user):
+    return os.path.join(output_dir, f'user={user}')
+
+def find_users(exports_dir):
+    """Names of the per-user export directories: every subdirectory with .txt exports or a user_data.json."""
+    users = []
+    for name in sorted(os.listdir(exports_dir)):
+        path = os.path.join(exports_dir, name)
+        if os.path.isdir(path) and any(filename.endswith('.txt') or filename == 'user_data.json'
+                                       for filename in os.listdir(path)):
+            users.append(name)
+    return users
+
+def run_users(function, users, workers=1):
+    """Run `function(user, **arguments)` for every user, in worker processes if `workers` > 1.
+
+    `users` is a list of names or {user: arguments of that user}. A failing
+    user is reported and left out of the results instead of stopping the batch.
+    """
+    users = users if isinstance(users, dict) else {user: {} for user in users}
+    results = {}
+
+    def collect(user, call):
+        try:
+            results[user] = call()
+        except Exception as error:
+            print(f"{user} failed: {error!r}")
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {user: executor.submit(function, user, **arguments) for user, arguments in users.items()}
+            for user, future in futures.items():
+                collect(user, future.result)
+    else:
+        for user, arguments in users.items():
+            collect(user, partial(function, user, **arguments))
+    return results
+
+def user_timeline(export_dir, ip_map):
+    """A user's location timeline: location_timeline.csv in the export, else derived from the login IPs."""
+    path = os.path.join(export_dir, 'location_timeline.csv')
+    if os.path.exists(path):
+        return load_location_timeline(path)
+    login_path = os.path.join(export_dir, ACTIVITY_TYPES['login_history']['txt_file'])
+    if ip_map and os.path.exists(ip_map) and os.path.exists(login_path):
+        return build_location_timeline(parse_records(login_path, 'IP', 'ip'), load_ip_networks(ip_map))
+    return None
+
+def parse_user(user, exports_dir, output_dir, fmt='csv', locations=None, ip_map=None, sparse=False,
+               padding_days=1):
+    """Parse one user's export and return the weather date ranges it needs per location."""
+    export_dir = os.path.join(exports_dir, user)
+    json_export = os.path.join(export_dir, 'user_data.json')
+    if os.path.exists(json_export):
+        parsed = parse_json_export(json_export)
+    else:
+        parsed = parse_all({spec['txt_file']: partial(parse_activity, name) for name, spec in ACTIVITY_TYPES.items()},
+                           export_dir)
+
+    tiktok_data = {os.path.splitext(filename)[0]: df for filename, df in parsed.items()}
+    start_date, end_date = get_date_range(tiktok_data)
+    if start_date is None:
+        raise ValueError(f"no activity records in {export_dir}")
+
+    processed_dir = os.path.join(user_dir(output_dir, user), 'processed')
+    os.makedirs(processed_dir, exist_ok=True)
+    for filename, df in parsed.items():
+        save_table(df, os.path.join(processed_dir, filename), fmt, ACTIVITY_SCHEMA)
+    pd.DataFrame({'start_date': [start_date], 'end_date': [end_date]}).to_csv(
+        os.path.join(processed_dir, 'date_range.csv'), index=False)
+
+    timeline = user_timeline(export_dir, ip_map)
+    if timeline is not None:
+        timeline.to_csv(os.path.join(user_dir(output_dir, user), 'location_timeline.csv'), index=False)
+    # Only the locations the user was in are planned, also when the whole span is fetched
+    timestamps = pd.concat([df['timestamp'] for df in tiktok_data.values()], ignore_index=True)
+    visited = set(assign_locations(timestamps, timeline, next(iter(locations))))
+    locations = {name: coordinates for name, coordinates in locations.items() if name in visited}
+    return plan_location_ranges(start_date, end_date, locations, tiktok_data if sparse else None, timeline,
+                                padding_days)
+
+def shared_location_ranges(user_ranges):
+    """Union of the date ranges all users need per location, so every location-day is fetched once."""
+    days = {}
+    for location_ranges in user_ranges.values():
+        for location, date_ranges in location_ranges.items():
+            days.setdefault(location, set()).update(expand_days(date_ranges))
+    return {location: coalesce_days(sorted(location_days)) for location, location_days in days.items()}
+
+def user_weather(weather_data, location_ranges):
+    """Rows of the shared weather on the days planned for one user's locations.
+
+    Other users' days are left out, so a user's merge keeps the same hours as
+    a run over that user's export alone.
+    """
+    days = weather_data['timestamp'].to_numpy(dtype='datetime64[D]')
+    keep = np.zeros(len(weather_data), dtype=bool)
+    for location, date_ranges in location_ranges.items():
+        planned = np.array([np.datetime64(day, 'D') for day in expand_days(date_ranges)], dtype='datetime64[D]')
+        keep |= (weather_data['location'] == location).to_numpy() & np.isin(days, planned)
+    return weather_data[keep].reset_index(drop=True)
+
+def analyze_user(user, location_ranges, output_dir, fmt='csv', default_location=None, resolution='h',
+                 tolerance='1h', lookback='', session_gap='30min', replicates=2000, block_length=24, seed=0):
+    """Merge and analyze one user against their planned part of the shared weather.
+
+    Returns the user's running statistics.
+    """
+    directory = user_dir(output_dir, user)
+    tiktok_data = load_tiktok_data(os.path.join(directory, 'processed'), fmt)
+    weather_data = user_weather(load_weather_data(os.path.join(output_dir, 'weather'), fmt), location_ranges)
+    timeline = load_location_timeline(os.path.join(directory, 'location_timeline.csv'))
+
+    merged = build_merged_dataset(tiktok_data, weather_data, resolution, tolerance, lookback, timeline,
+                                  default_location)
+    cube = AggregationCube.from_frame(merged)
+    stats = RunningStatistics.from_frame(merged, cube)
+    save_merged_dataset(merged, os.path.join(directory, 'merged_data'), fmt, cube=cube, stats=stats)
+    sessions = add_session_weather(build_sessions(tiktok_data, session_gap), weather_data, tolerance, timeline,
+                                   default_location)
+    save_table(sessions, sessions_path(os.path.join(directory, 'merged_data', 'merged_data')), fmt,
+               SESSION_SCHEMA)
+
+    analyzer = TikTokWeatherAnalyzer(df=merged, cube=cube, stats=stats, sessions=sessions)
+    save_results(analyzer.run_all(replicates, block_length, seed), os.path.join(directory, 'analysis_results'))
+    return stats
+
+def user_summary(user_stats):
+    """One row per user: hours, days, total activity and the weather correlations of total activity."""
+    rows = []
+    for user, stats in user_stats.items():
+        features = [feature for feature in ['temperature', 'precipitation'] if feature in stats.features]
+        r, _ = stats.correlation('total_activity', features)
+        totals = stats.cube.aggregate(measures=['total_activity'])
+        rows.append({'user': user, 'hours': int(stats.cube.count.sum()), 'days': stats.total_days,
+                     'total_activity': int(totals['total_activity_sum'].iloc[0]),
+                     **{f'{feature}_r': value for feature, value in zip(features, r)}})
+    return pd.DataFrame(rows)
+
+def write_cohort(user_stats, output_dir, fmt='csv'):
+    """Merge the per-user running statistics into the cohort aggregate and analyze it."""
+    cohort_dir = os.path.join(output_dir, 'cohort')
+    data_path = os.path.join(cohort_dir, 'merged_data', 'merged_data')
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+    cohort = reduce(lambda left, right: left.merge(right), user_stats.values())
+    cohort.save(stats_path(data_path), fmt)
+    cohort.cube.save(cube_path(data_path), fmt)
+
+    results = TikTokWeatherAnalyzer(data_path, fmt, stats=cohort).run_from_stats()
+    save_results(results, os.path.join(cohort_dir, 'analysis_results'))
+    user_summary(user_stats).to_csv(os.path.join(cohort_dir, 'users.csv'), index=False)
+    return cohort
+
+def main():
+    parser = argparse.ArgumentParser(description='Run parse, weather, merge and analysis for a cohort of exports.')
+    parser.add_argument('--exports', default='data/exports',
+                        help='Directory with one subdirectory of TikTok export files per user')
+    parser.add_argument('--output', default='data/users',
+                        help='Directory for the per-user, shared weather and cohort outputs')
+    parser.add_argument('--workers', type=int, default=1, help='Users processed in parallel worker processes')
+    parser.add_argument('--format', choices=FORMATS, default='csv', help='Storage format of written tables')
+    parser.add_argument('--base-url', default="https://archive-api.open-meteo.com/v1/archive")
+    parser.add_argument('--variables', default=','.join(DEFAULT_VARIABLES))
+    parser.add_argument('--fetch-workers', type=int, default=4, help='Concurrent weather requests')
+    parser.add_argument('--locations', default=f'{LOCATIONS_DIR}/locations.csv')
+    parser.add_argument('--ip-map', default=f'{LOCATIONS_DIR}/ip_locations.csv',
+                        help='IP networks used to place every user from their login history')
+    parser.add_argument('--sparse', action='store_true')
+    parser.add_argument('--padding-days', type=int, default=1)
+    parser.add_argument('--resolution', default='h')
+    parser.add_argument('--tolerance', default='1h')
+    parser.add_argument('--lookback', default='')
+    parser.add_argument('--session-gap', default='30min')
+    parser.add_argument('--replicates', type=int, default=2000)
+    parser.add_argument('--block-length', type=int, default=24)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    users = find_users(args.exports) if os.path.isdir(args.exports) else []
+    if not users:
+        print(f"Please put one directory of TikTok export files per user under {args.exports}")
+        return
+    begin = time.perf_counter()
+    locations = load_locations(args.locations)
+    default_location = next(iter(locations))
+    if os.path.exists(args.ip_map):
+        # Users placed by their login IPs may be in locations the list does not have yet;
+        # only the ones some user was in are fetched
+        networks = load_ip_networks(args.ip_map).drop_duplicates('location')
+        locations.update({row.location: (row.latitude, row.longitude) for row in networks.itertuples(index=False)
+                          if row.location not in locations})
+
+    print(f"Parsing {len(users)} exports...")
+    user_ranges = run_users(partial(parse_user, exports_dir=args.exports, output_dir=args.output, fmt=args.format,
+                                    locations=locations, ip_map=args.ip_map, sparse=args.sparse,
+                                    padding_days=args.padding_days),
+                            users, args.workers)
+
+    location_ranges = shared_location_ranges(user_ranges)
+    locations = {name: coordinates for name, coordinates in locations.items() if name in location_ranges}
+    requested = sum(len(expand_days(ranges)) for user in user_ranges.values() for ranges in user.values())
+    shared = sum(len(expand_days(ranges)) for ranges in location_ranges.values())
+    print(f"Fetching weather for {len(location_ranges)} location(s): {shared} location-days "
+          f"shared by users needing {requested}...")
+    fetcher = WeatherDataFetcher(base_url=args.base_url, max_workers=args.fetch_workers,
+                                 variables=args.variables.split(','), locations=locations)
+    save_location_weather(fetch_location_weather(fetcher, location_ranges), os.path.join(args.output, 'weather'),
+                          args.format)
+
+    print("Merging and analyzing users...")
+    user_stats = run_users(partial(analyze_user, output_dir=args.output, fmt=args.format,
+                                   default_location=default_location, resolution=args.resolution,
+                                   tolerance=args.tolerance, lookback=args.lookback,
+                                   session_gap=args.session_gap, replicates=args.replicates,
+                                   block_length=args.block_length, seed=args.seed),
+                           {user: {'location_ranges': ranges} for user, ranges in user_ranges.items()},
+                           args.workers)
+    if user_stats:
+        cohort = write_cohort(user_stats, args.output, args.format)
+        print(f"Cohort of {len(user_stats)} users: {int(cohort.cube.count.sum())} user-hours "
+              f"saved to {os.path.join(args.output, 'cohort')}")
+    print(f"Finished in {time.perf_counter() - begin:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import pandas as pd
+import numpy as np
+import argparse
+import time
+
+from merge_data import create_hourly_activity_counts
+
+def legacy_hourly_counts(tiktok_data):
+    """Original groupby per type plus chained outer merges, kept as the baseline."""
+    base_df = pd.DataFrame()
+    for data_type, df in tiktok_data.items():
+        counts = df.groupby('timestamp').size().reset_index(name=f'{data_type}_count')
+        base_df = counts if base_df.empty else pd.merge(base_df, counts, on='timestamp', how='outer')
+    return base_df.fillna(0)
+
+def make_synthetic_activity(types, years, events_per_type, seed=0):
+    """Hour-floored event timestamps for `types` activity types spread over `years` years."""
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2015-01-01T00:00:00', 'ns')
+    span = int(np.timedelta64(365 * years, 'D') / np.timedelta64(1, 'h'))
+    return {
+        f'type_{i}': pd.DataFrame({'timestamp': start + rng.integers(0, span, events_per_type)
+                                   * np.timedelta64(1, 'h')})
+        for i in range(types)
+    }
+
+def best_time(func, *args, repeats=3):
+    best = float('inf')
+    for _ in range(repeats):
+        begin = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - begin)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare hourly activity count builders.')
+    parser.add_argument('--events', type=int, default=20000,
+                        help='Events per activity type')
+    args = parser.parse_args()
+
+    for types, years in [(6, 3), (12, 3), (24, 3), (6, 10), (24, 10)]:
+        tiktok_data = make_synthetic_activity(types, years, args.events)
+        legacy_time, legacy = best_time(legacy_hourly_counts, tiktok_data)
+        grid_time, grid = best_time(create_hourly_activity_counts, tiktok_data)
+
+        # The grid also holds every empty hour; its non-empty rows must match the baseline
+        active = grid[grid.drop(columns='timestamp').sum(axis=1) > 0].reset_index(drop=True)
+        legacy = legacy.sort_values('timestamp').reset_index(drop=True)
+        if not np.array_equal(active.drop(columns='timestamp').to_numpy(),
+                              legacy[active.columns.drop('timestamp')].to_numpy()):
+            raise ValueError(f"Count mismatch for {types} types over {years} years")
+
+        print(f"{types:2d} types, {years:2d} years: chained merges {legacy_time:6.3f}s, "
+              f"dense grid {grid_time:6.3f}s ({len(grid):,} hours, {len(legacy):,} active)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import pandas as pd
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from parse_tiktok_data import ACTIVITY_TYPES, parse_json_export, parse_records
+
+def legacy_parse(file_path, field, column):
+    """Original line-by-line parser, kept as the throughput baseline."""
+    data = []
+    prefix = f'{field}:'
+    with open(file_path, 'r', encoding='utf-8') as file:
+        current_date = None
+        for line in file:
+            line = line.strip()
+            if line.startswith('Date:'):
+                current_date = line.split('Date:')[1].strip()
+            elif line.startswith(prefix) and current_date:
+                value = line.split(prefix)[1].strip()
+                data.append({
+                    'timestamp': datetime.strptime(current_date, '%Y-%m-%d %H:%M:%S'),
+                    column: value
+                })
+    return pd.DataFrame(data)
+
+def make_synthetic_export(source_path, copies, output_path):
+    """Build a large export by repeating a real one."""
+    with open(source_path, 'rb') as source:
+        content = source.read().rstrip(b'\n') + b'\n\n'
+    with open(output_path, 'wb') as output:
+        for _ in range(copies):
+            output.write(content)
+
+def time_parser(parser, file_path, field, column, repeats=3):
+    """Return the best wall time and the row count of a parser run."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        df = parser(file_path, field, column)
+        best = min(best, time.perf_counter() - start)
+    return best, len(df)
+
+def compare(file_path, field, column):
+    """Time both parsers on one file and check that they agree."""
+    legacy_time, rows = time_parser(legacy_parse, file_path, field, column)
+    bulk_time, bulk_rows = time_parser(parse_records, file_path, field, column)
+    if bulk_rows != rows:
+        raise ValueError(f"Row count mismatch: {rows} vs {bulk_rows}")
+
+    size_mb = os.path.getsize(file_path) / 1e6
+    print(f"{os.path.basename(file_path)}: {rows:,} rows, {size_mb:.1f} MB")
+    print(f"  line loop : {legacy_time:.3f}s ({rows / legacy_time:,.0f} rows/s)")
+    print(f"  bulk scan : {bulk_time:.3f}s ({rows / bulk_time:,.0f} rows/s)")
+    print(f"  speedup   : {legacy_time / bulk_time:.1f}x")
+
+def make_synthetic_json_export(output_path, records):
+    """Write a user_data.json-style export with `records` entries per activity type."""
+    start = datetime(2021, 1, 1)
+    with open(output_path, 'w', encoding='utf-8') as output:
+        output.write('{"Profile": {"Profile Information": {"ProfileMap": {"userName": "synthetic"}}}, "Activity": {')
+        for i, spec in enumerate(ACTIVITY_TYPES.values()):
+            section, list_name = spec['json_path'][1:]
+            output.write(f'{"," if i else ""}{json.dumps(section)}: {{{json.dumps(list_name)}: [')
+            for n in range(records):
+                date = (start + timedelta(seconds=37 * n)).strftime('%Y-%m-%d %H:%M:%S')
+                record = {'Date': date, spec['json_field']: f'https://www.tiktokv.com/share/video/{7 * 10**18 + n}/'}
+                output.write(('' if n == 0 else ',') + json.dumps(record))
+            output.write(']}')
+        output.write('}}')
+
+def load_json_export(file_path):
+    """Naive baseline: load the whole document, then build the DataFrames."""
+    with open(file_path, encoding='utf-8') as file:
+        document = json.load(file)
+    data = {}
+    for spec in ACTIVITY_TYPES.values():
+        records = document
+        for key in spec['json_path']:
+            records = records.get(key, {})
+        data[spec['txt_file']] = pd.DataFrame({
+            'timestamp': pd.to_datetime([record['Date'] for record in records]),
+            spec['column']: [record[spec['json_field']] for record in records]
+        })
+    return data
+
+def measure(func, *args):
+    """Return the wall time and the peak traced memory in MB of a call.
+
+    Memory is traced in a second run because tracemalloc slows allocations down.
+    """
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return elapsed, peak
+
+def compare_json(records):
+    """Time and profile the streaming JSON backend against json.load on a synthetic export."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_path = os.path.join(tmp_dir, 'user_data.json')
+        make_synthetic_json_export(json_path, records)
+        size_mb = os.path.getsize(json_path) / 1e6
+        rows = records * len(ACTIVITY_TYPES)
+        # The output DataFrames alone need this much; the rest is parser overhead
+        output_mb = sum(df.memory_usage(deep=True).sum() for df in parse_json_export(json_path).values()) / 1e6
+
+        print(f"user_data.json: {rows:,} records, {size_mb:.1f} MB, output frames {output_mb:.1f} MB")
+        for label, func in [('json.load', load_json_export), ('streaming', parse_json_export)]:
+            elapsed, peak = measure(func, json_path)
+            print(f"  {label:<10}: {elapsed:.2f}s ({rows / elapsed:,.0f} records/s), peak {peak:.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare TikTok export parsing throughput.')
+    parser.add_argument('--input', default='data/tiktok_data/browsing_history.txt')
+    parser.add_argument('--field', default='Link')
+    parser.add_argument('--column', default='link')
+    parser.add_argument('--copies', type=int, default=50,
+                        help='Repeat the input this many times for the large-file run')
+    parser.add_argument('--json-records', type=int, default=0,
+                        help='Also benchmark a synthetic user_data.json with this many records per type')
+    args = parser.parse_args()
+
+    compare(args.input, args.field, args.column)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        synthetic_path = os.path.join(tmp_dir, os.path.basename(args.input))
+        make_synthetic_export(args.input, args.copies, synthetic_path)
+        compare(synthetic_path, args.field, args.column)
+
+    if args.json_records:
+        compare_json(args.json_records)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from datetime import date
+
+import pandas as pd
+
+from fake_open_meteo import start_server, synthetic_hourly
+from fetch_weather_data import WeatherDataFetcher
+
+DECODE_VARIABLES = ['temperature_2m', 'precipitation', 'weathercode', 'relative_humidity_2m',
+                    'cloud_cover', 'wind_speed_10m', 'is_day']
+
+def legacy_process(raw_data):
+    """Original per-hour decoding loop, kept as the decoding baseline."""
+    hourly_data = []
+    timestamps = raw_data['hourly']['time']
+    for i in range(len(timestamps)):
+        row = {'timestamp': pd.to_datetime(timestamps[i])}
+        for variable in DECODE_VARIABLES:
+            row[variable] = raw_data['hourly'][variable][i]
+        hourly_data.append(row)
+    return pd.DataFrame(hourly_data)
+
+def compare_decoding(years):
+    """Time the legacy loop and the column-wise decoder on a multi-year, multi-variable response."""
+    start = date(2015, 1, 1)
+    end = date(2015 + years, 1, 1)
+    raw_data = {'hourly': synthetic_hourly(41.0, 29.0, start, end, DECODE_VARIABLES)}
+    fetcher = WeatherDataFetcher(variables=DECODE_VARIABLES, cache_dir=tempfile.mkdtemp())
+
+    begin = time.perf_counter()
+    legacy_process(raw_data)
+    legacy_time = time.perf_counter() - begin
+    begin = time.perf_counter()
+    df = fetcher.process_weather_data(raw_data)
+    vector_time = time.perf_counter() - begin
+    shutil.rmtree(fetcher.cache_dir)
+
+    print(f"decode {years} years x {len(DECODE_VARIABLES)} variables ({len(df):,} hours): "
+          f"loop {legacy_time:.2f}s, column-wise {vector_time * 1000:.0f}ms")
+
+def timed_fetch(url, cache_dir, start, end, workers, use_cache=True):
+    """Run one fetch and return the fetcher (with its stats) and the wall time."""
+    fetcher = WeatherDataFetcher(base_url=url, cache_dir=cache_dir, max_workers=workers,
+                                 use_cache=use_cache)
+    begin = time.perf_counter()
+    raw_data = fetcher.fetch_weather_data(start, end)
+    elapsed = time.perf_counter() - begin
+    return fetcher, elapsed, len(raw_data['hourly']['time']) if raw_data else 0
+
+def timed_locations(base_url, start, end, workers, count, batch_size):
+    """Cold-fetch `count` synthetic locations with the given number of locations per request."""
+    locations = {f'city{i}': (f'{36 + i * 0.5:.4f}', f'{26 + i * 0.7:.4f}') for i in range(count)}
+    cache_dir = tempfile.mkdtemp()
+    fetcher = WeatherDataFetcher(base_url=base_url, cache_dir=cache_dir, max_workers=workers,
+                                 locations=locations, batch_size=batch_size)
+    begin = time.perf_counter()
+    raw_data = fetcher.fetch_locations({name: [(start, end)] for name in locations})
+    elapsed = time.perf_counter() - begin
+    shutil.rmtree(cache_dir)
+    return fetcher, elapsed, sum(len(data['hourly']['time']) for data in raw_data.values() if data)
+
+def report(label, fetcher, elapsed, hours):
+    stats = fetcher.stats
+    print(f"{label:<28}: {elapsed:6.2f}s, {stats['requests']:3d} requests, "
+          f"{stats['bytes'] / 1e6:5.1f} MB, {stats['cached_days']:4d} cached days, {hours:,} hours")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the cached weather fetcher against a local fake API.')
+    parser.add_argument('--start', default='2021-09-04')
+    parser.add_argument('--end', default='2024-12-23')
+    parser.add_argument('--latency', type=float, default=0.2,
+                        help='Simulated server latency per request in seconds')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--locations', type=int, default=8,
+                        help='Number of locations in the multi-location comparison')
+    parser.add_argument('--decode-years', type=int, default=10,
+                        help='Years of hourly data used for the decoding comparison')
+    args = parser.parse_args()
+
+    compare_decoding(args.decode_years)
+
+    start, end = date.fromisoformat(args.start), date.fromisoformat(args.end)
+    server = start_server(latency=args.latency)
+    cache_dir = tempfile.mkdtemp()
+    try:
+        report('cold, 1 worker', *timed_fetch(server.url, cache_dir, start, end, 1, use_cache=False))
+        shutil.rmtree(cache_dir)
+        report(f'cold, {args.workers} workers', *timed_fetch(server.url, cache_dir, start, end, args.workers))
+        report('warm (all cached)', *timed_fetch(server.url, cache_dir, start, end, args.workers))
+
+        # Punch holes into the cache and let the fetcher fill only those gaps
+        directory = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+        cached = sorted(os.listdir(directory))
+        for name in cached[100:130] + cached[500:503] + cached[-7:]:
+            os.remove(os.path.join(directory, name))
+        report('gap filling (40 days)', *timed_fetch(server.url, cache_dir, start, end, args.workers))
+
+        for batch_size in (1, args.locations):
+            report(f'{args.locations} locations, {batch_size} per call',
+                   *timed_locations(server.url, start, end, args.workers, args.locations, batch_size))
+    finally:
+        server.shutdown()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
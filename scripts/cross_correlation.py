@@ -0,0 +1,68 @@
+import numpy as np
+from scipy import stats
+
+def lagged_sums(left, right, max_lag):
+    """sum over t of left[t, i] * right[t + k, j] for k = 0..max_lag and every column pair (i, j).
+
+    Computed for all pairs and lags at once from one zero-padded FFT per
+    column; returns an array of shape (max_lag + 1, left columns, right columns).
+    """
+    size = len(left) + max_lag + 1
+    size = 1 << (size - 1).bit_length()
+    left_spectrum = np.fft.rfft(left, n=size, axis=0)
+    right_spectrum = np.fft.rfft(right, n=size, axis=0)
+    cross = np.fft.irfft(np.conj(left_spectrum)[:, :, None] * right_spectrum[:, None, :], n=size, axis=0)
+    return cross[:max_lag + 1]
+
+def _autocorrelation(values, mask, max_lag):
+    """Autocorrelation of every column at lags 1..max_lag, over pairs of valid rows."""
+    centered = np.where(mask, values - np.nanmean(np.where(mask, values, np.nan), axis=0), 0.0)
+    size = 1 << (len(values) + max_lag).bit_length()
+    spectrum = np.fft.rfft(centered, n=size, axis=0)
+    covariance = np.fft.irfft(spectrum * np.conj(spectrum), n=size, axis=0)[:max_lag + 1]
+    return covariance[1:] / covariance[0]
+
+def cross_correlations(weather, activity, max_lag=48, confidence=0.95):
+    """Pearson correlation of weather[t] with activity[t + k] for every lag k = 0..max_lag.
+
+    `weather` (n x w, may contain NaN) and `activity` (n x a) are rows of
+    one evenly spaced series. Every lag uses exactly the overlapping pairs
+    with a valid weather value, as a per-lag `pearsonr` would. Returns the
+    correlations and the half-widths of the null confidence band, both of
+    shape (max_lag + 1, w, a). The band follows Bartlett's formula, so
+    autocorrelation in both series widens it.
+    """
+    weather = np.asarray(weather, dtype=np.float64)
+    activity = np.asarray(activity, dtype=np.float64)
+    n = len(weather)
+    mask = ~np.isnan(weather)
+    # Centering does not change the correlation but keeps the FFT sums well conditioned
+    weather = np.where(mask, weather - np.nanmean(np.where(mask, weather, np.nan), axis=0), 0.0)
+    activity = activity - activity.mean(axis=0)
+    valid = mask.astype(np.float64)
+
+    sums = lagged_sums(np.hstack([weather, valid]), np.hstack([activity, activity ** 2]), max_lag)
+    width, count = weather.shape[1], activity.shape[1]
+    sum_wa = sums[:, :width, :count]
+    sum_a = sums[:, width:, :count]
+    sum_aa = sums[:, width:, count:]
+
+    # Weather sums over the first n - k rows, the ones that still have a partner k rows later
+    ends = n - np.arange(max_lag + 1)
+    def prefix(values):
+        return np.vstack([np.zeros((1, width)), np.cumsum(values, axis=0)])[ends][:, :, None]
+    pairs = prefix(valid)
+    sum_w = prefix(weather)
+    sum_ww = prefix(weather ** 2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = (pairs * sum_wa - sum_w * sum_a) / np.sqrt((pairs * sum_ww - sum_w ** 2)
+                                                       * (pairs * sum_aa - sum_a ** 2))
+        # Bartlett: var(r_k) ~ (1 + 2 sum_j rho_w(j) rho_a(j)) / pairs, truncated at twice the largest lag
+        horizon = min(2 * max_lag, n - 2)
+        rho_w = _autocorrelation(weather, mask, horizon)
+        rho_a = _autocorrelation(activity, np.ones(activity.shape, dtype=bool), horizon)
+        # Never narrower than the band for uncorrelated series
+        inflation = np.clip(1 + 2 * np.einsum('jw,ja->wa', rho_w, rho_a), 1, None)
+        band = stats.norm.ppf(0.5 + confidence / 2) * np.sqrt(inflation[None] / pairs)
+    return np.clip(r, -1, 1), band
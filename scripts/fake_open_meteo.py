@@ -0,0 +1,118 @@
+import numpy as np
+import argparse
+import json
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Deterministic stand-ins for the Open-Meteo hourly variables
+WEATHER_CODES = np.array([0, 1, 2, 3, 45, 51, 53, 61, 63, 80])
+
+def synthetic_hourly(latitude, longitude, start, end, variables):
+    """Generate deterministic hourly weather for an inclusive date range."""
+    days = (end - start).days + 1
+    hours = np.arange(days * 24)
+    seed = int(abs(latitude * 1000) + abs(longitude * 1000))
+    day_of_year = (start.timetuple().tm_yday + hours // 24) % 365
+    # Seed per day so a day's values do not depend on how the range was chunked
+    noise = np.concatenate([np.random.default_rng([seed, start.toordinal() + d]).standard_normal(24)
+                            for d in range(days)])
+
+    values = {
+        'temperature_2m': 15 - latitude / 10 + 8 * np.sin(2 * np.pi * (day_of_year - 100) / 365)
+                          + 4 * np.sin(2 * np.pi * (hours % 24 - 9) / 24) + noise,
+        'precipitation': np.clip(noise - 1.0, 0, None) * 2,
+        'weathercode': WEATHER_CODES[(np.abs(noise) * 4).astype(int) % len(WEATHER_CODES)],
+        'relative_humidity_2m': np.clip(65 + 15 * noise, 0, 100),
+        'cloud_cover': np.clip(50 + 30 * noise, 0, 100),
+        'wind_speed_10m': np.abs(10 + 5 * noise),
+        'is_day': ((hours % 24 >= 7) & (hours % 24 < 19)).astype(int)
+    }
+    times = [(start + timedelta(days=int(h // 24))).strftime('%Y-%m-%d') + f'T{h % 24:02d}:00'
+             for h in hours]
+    hourly = {'time': times}
+    for variable in variables:
+        series = values.get(variable, noise)
+        if series.dtype.kind in 'iu':
+            hourly[variable] = series.tolist()
+        else:
+            hourly[variable] = np.round(series, 1).tolist()
+    return hourly
+
+class FakeOpenMeteoHandler(BaseHTTPRequestHandler):
+    """Answers /v1/archive requests the way the Open-Meteo archive API does."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        try:
+            start = date.fromisoformat(query['start_date'][0])
+            end = date.fromisoformat(query['end_date'][0])
+            latitudes = [float(value) for value in query['latitude'][0].split(',')]
+            longitudes = [float(value) for value in query['longitude'][0].split(',')]
+            variables = ','.join(query.get('hourly', [])).split(',')
+            if len(latitudes) != len(longitudes):
+                raise ValueError('Parameter latitude and longitude must have the same number of elements')
+        except (KeyError, ValueError) as e:
+            self._send(400, {'error': True, 'reason': str(e)})
+            return
+
+        # Several coordinates are answered with a list of responses in request order
+        bodies = [{
+            'latitude': latitude,
+            'longitude': longitude,
+            'timezone': query.get('timezone', ['GMT'])[0],
+            'hourly': synthetic_hourly(latitude, longitude, start, end, variables)
+        } for latitude, longitude in zip(latitudes, longitudes)]
+        self._send(200, bodies if len(bodies) > 1 else bodies[0])
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(port=0, latency=0.0):
+    """Start a fake Open-Meteo server in a background thread and return it.
+
+    The archive endpoint is at `server.url`; `server.request_count` counts requests.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeOpenMeteoHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.request_count = 0
+    server.lock = threading.Lock()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/v1/archive"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the Open-Meteo archive API.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds to wait before answering each request')
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.latency)
+    print(f"Serving fake Open-Meteo archive at {server.url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
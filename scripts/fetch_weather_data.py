@@ -1,57 +1,333 @@
 # example script just a placeholder for now:
 
 import pandas as pd
+import numpy as np
 import requests
-from datetime import datetime, timedelta
+import argparse
+import hashlib
+import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from locations import (DEFAULT_LOCATIONS, assign_locations, load_location_timeline,
+                       load_locations)
+from merge_data import load_tiktok_data
+from storage import FORMATS, WEATHER_SCHEMA, export_csv, save_table
+
+DEFAULT_VARIABLES = ['temperature_2m', 'precipitation', 'weathercode']
+
+# Output column names of Open-Meteo variables; other variables keep their API name
+VARIABLE_COLUMNS = {
+    'temperature_2m': 'temperature',
+    'weathercode': 'weather_code'
+}
+
+# Variables holding category codes or flags rather than measurements
+CODE_VARIABLES = {'weathercode', 'weather_code', 'is_day'}
+
+# The archive fills in recent days over this many days, so younger days are not final yet
+ARCHIVE_LAG_DAYS = 7
+
+class WeatherCache:
+    """On-disk cache of hourly weather, one JSON file per (lat, lon, variables, day).
+
+    Days within `ARCHIVE_LAG_DAYS` of today may still be incomplete or
+    revised, so they are neither stored nor served and are fetched again.
+    """
+
+    def __init__(self, cache_dir, lat, lon, variables, timezone):
+        key = json.dumps([str(lat), str(lon), sorted(variables), timezone])
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        self.directory = os.path.join(cache_dir, digest)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _day_path(self, day):
+        return os.path.join(self.directory, f"{day.strftime('%Y-%m-%d')}.json")
+
+    @staticmethod
+    def is_final(day):
+        return day < date.today() - timedelta(days=ARCHIVE_LAG_DAYS)
+
+    def has(self, day):
+        return self.is_final(day) and os.path.exists(self._day_path(day))
+
+    def load(self, day):
+        with open(self._day_path(day)) as file:
+            return json.load(file)
+
+    def store(self, day, hourly):
+        if not self.is_final(day):
+            return
+        # Write to a temporary file first so concurrent readers never see partial days
+        path = self._day_path(day)
+        with open(f"{path}.tmp", 'w') as file:
+            json.dump(hourly, file)
+        os.replace(f"{path}.tmp", path)
+
+def coalesce_days(days):
+    """Group sorted dates into (first, last) runs of consecutive days."""
+    ranges = []
+    for day in days:
+        if ranges and day - ranges[-1][1] == timedelta(days=1):
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [tuple(day_range) for day_range in ranges]
+
+def split_by_month(start, end):
+    """Split an inclusive date range into chunks that never cross a month boundary."""
+    chunks = []
+    while start <= end:
+        next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        chunk_end = min(end, next_month - timedelta(days=1))
+        chunks.append((start, chunk_end))
+        start = chunk_end + timedelta(days=1)
+    return chunks
+
+def expand_days(date_ranges):
+    """Sorted unique dates covered by a set of inclusive date ranges."""
+    return sorted({
+        pd.Timestamp(start).date() + timedelta(days=i)
+        for start, end in date_ranges
+        for i in range((pd.Timestamp(end).date() - pd.Timestamp(start).date()).days + 1)
+    })
 
 class WeatherDataFetcher:
-    def __init__(self):
-        self.base_url = "https://archive-api.open-meteo.com/v1/archive"
-        self.lat = "41.0082"  # Istanbul coordinates
-        self.lon = "28.9784"
-        
-    def fetch_weather_data(self, start_date, end_date):
-        """Fetch historical weather data for a date range."""
+    def __init__(self, base_url="https://archive-api.open-meteo.com/v1/archive",
+                 cache_dir='data/weather_data/cache', max_workers=4, use_cache=True,
+                 variables=None, locations=None, batch_size=10):
+        self.base_url = base_url
+        # {name: (latitude, longitude)}; Istanbul unless other locations are given
+        self.locations = dict(locations or DEFAULT_LOCATIONS)
+        self.batch_size = batch_size
+        self.variables = list(variables or DEFAULT_VARIABLES)
+        self.timezone = 'Europe/Istanbul'
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.use_cache = use_cache
+        self.stats = {'requests': 0, 'bytes': 0, 'cached_days': 0, 'fetched_days': 0}
+        self._stats_lock = threading.Lock()
+
+        # One pooled session shared by all worker threads, with retries on transient errors;
+        # the last response is returned after the retries instead of raising
+        self.session = requests.Session()
+        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                        raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _fetch_chunk(self, start_date, end_date, names):
+        """Fetch one date range for a batch of locations in a single request.
+
+        Returns one raw JSON response per location, or None on errors.
+        """
         params = {
-            'latitude': self.lat,
-            'longitude': self.lon,
+            'latitude': ','.join(str(self.locations[name][0]) for name in names),
+            'longitude': ','.join(str(self.locations[name][1]) for name in names),
             'start_date': start_date.strftime('%Y-%m-%d'),
             'end_date': end_date.strftime('%Y-%m-%d'),
-            'hourly': ['temperature_2m', 'precipitation', 'weathercode'],
-            'timezone': 'Europe/Istanbul'
+            'hourly': ','.join(self.variables),
+            'timezone': self.timezone
         }
         
-        response = requests.get(self.base_url, params=params)
+        try:
+            response = self.session.get(self.base_url, params=params, timeout=60)
+        except requests.RequestException as error:
+            print(f"Error fetching data for {start_date} to {end_date}: {error}")
+            return None
+        with self._stats_lock:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += len(response.content)
         
         if response.status_code == 200:
-            return response.json()
+            # Open-Meteo answers several coordinates with a list of responses
+            raw_data = response.json()
+            return raw_data if isinstance(raw_data, list) else [raw_data]
         else:
-            print(f"Error fetching data: {response.status_code}")
+            print(f"Error fetching data for {start_date} to {end_date}: {response.status_code}")
             return None
 
+    def _split_days(self, raw_data):
+        """Split a raw response into per-day hourly dictionaries."""
+        hourly = raw_data['hourly']
+        day_keys = np.array(hourly['time'], dtype='U10')
+        if not len(day_keys):
+            return {}
+        # Hours arrive in order, so every day is one contiguous slice
+        starts = np.concatenate([[0], np.flatnonzero(day_keys[1:] != day_keys[:-1]) + 1])
+        ends = np.append(starts[1:], len(day_keys))
+        return {
+            str(day_keys[start]): {key: values[start:end] for key, values in hourly.items()}
+            for start, end in zip(starts, ends)
+        }
+
+    def _plan_requests(self, missing):
+        """Requests for {location: sorted missing days}, as (month-sized chunk, batch of locations) pairs."""
+        batches = {}
+        for name, days in missing.items():
+            for first, last in coalesce_days(days):
+                for chunk in split_by_month(first, last):
+                    batches.setdefault(chunk, []).append(name)
+        return [(chunk, names[i:i + self.batch_size])
+                for chunk, names in batches.items()
+                for i in range(0, len(names), self.batch_size)]
+
+    def count_requests(self, location_ranges):
+        """Number of requests fetching {location: date ranges} takes with an empty cache."""
+        return len(self._plan_requests({name: expand_days(date_ranges)
+                                         for name, date_ranges in location_ranges.items()}))
+
+    def fetch_weather_data(self, start_date, end_date):
+        """Fetch historical weather data for a date range."""
+        return self.fetch_weather_ranges([(start_date, end_date)])
+
+    def fetch_weather_ranges(self, date_ranges, location=None):
+        """Fetch historical weather data of one location (the first by default) for a set of date ranges."""
+        location = location or next(iter(self.locations))
+        return self.fetch_locations({location: date_ranges})[location]
+
+    def fetch_locations(self, location_ranges):
+        """Fetch historical weather data for {location: date ranges} in batched requests.
+
+        Days already in a location's cache are reused. The missing days are
+        coalesced into ranges and split into month-sized chunks; locations
+        missing the same chunk share one request with comma-separated
+        coordinates, and the requests run concurrently. Returns
+        {location: raw data} in the shape of a single API response.
+        """
+        caches, days, missing = {}, {}, {}
+        for name, date_ranges in location_ranges.items():
+            lat, lon = self.locations[name]
+            caches[name] = WeatherCache(self.cache_dir, lat, lon, self.variables, self.timezone)
+            days[name] = expand_days(date_ranges)
+            missing[name] = [day for day in days[name] if not (self.use_cache and caches[name].has(day))]
+            self.stats['cached_days'] += len(days[name]) - len(missing[name])
+
+        tasks = self._plan_requests(missing)
+        fetched = {name: {} for name in location_ranges}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            responses = executor.map(lambda task: self._fetch_chunk(*task[0], task[1]), tasks)
+            for (chunk, names), raw_batch in zip(tasks, responses):
+                for name, raw_data in zip(names, raw_batch or []):
+                    days_data = self._split_days(raw_data)
+                    # Cache every chunk as it arrives, so a later failure does not lose it
+                    for day_key, hourly in days_data.items():
+                        caches[name].store(datetime.strptime(day_key, '%Y-%m-%d').date(), hourly)
+                    fetched[name].update(days_data)
+
+        results = {}
+        for name, cache in caches.items():
+            self.stats['fetched_days'] += len(fetched[name])
+
+            # Assemble the requested days in the shape of a single API response
+            combined = {}
+            for day in days[name]:
+                day_key = day.strftime('%Y-%m-%d')
+                hourly = fetched[name].get(day_key) or (cache.load(day) if cache.has(day) else None)
+                if hourly is None:
+                    continue
+                for key, values in hourly.items():
+                    combined.setdefault(key, []).extend(values)
+            results[name] = {'hourly': combined} if combined else None
+        return results
+
     def process_weather_data(self, raw_data):
-        """Process raw weather data into structured format."""
+        """Decode the hourly arrays of a raw response column by column into a typed DataFrame."""
         if not raw_data:
             return None
         
-        hourly_data = []
-        timestamps = raw_data['hourly']['time']
-        temps = raw_data['hourly']['temperature_2m']
-        precip = raw_data['hourly']['precipitation']
-        weather_codes = raw_data['hourly']['weathercode']
-        
-        for i in range(len(timestamps)):
-            hourly_data.append({
-                'timestamp': pd.to_datetime(timestamps[i]),
-                'temperature': temps[i],
-                'precipitation': precip[i],
-                'weather_code': weather_codes[i]
-            })
+        hourly = raw_data['hourly']
+        columns = {'timestamp': np.array(hourly['time'], dtype='datetime64[m]').astype('datetime64[ns]')}
+        for variable in self.variables:
+            # None marks missing hours and becomes NaN in the float conversion
+            values = np.array(hourly[variable], dtype=np.float64)
+            column = VARIABLE_COLUMNS.get(variable, variable)
+            if variable in CODE_VARIABLES:
+                columns[column] = pd.array(values, dtype='Float64').round().astype('UInt8')
+            else:
+                columns[column] = values.astype(np.float32)
             
-        return pd.DataFrame(hourly_data)
+        return pd.DataFrame(columns)
+
+def active_day_ranges(tiktok_data, padding_days=1):
+    """Coalesce the days with any TikTok activity into padded contiguous date ranges.
+
+    Two active days end up in the same range when their padded windows touch,
+    so the result is the minimal set of ranges covering every active day.
+    """
+    timestamps = [df['timestamp'].to_numpy() for df in tiktok_data.values() if not df.empty]
+    if not timestamps:
+        return []
+    days = np.unique(np.concatenate(timestamps).astype('datetime64[D]').astype(np.int64))
+
+    # A new range starts wherever the gap between active days exceeds both paddings
+    breaks = np.flatnonzero(np.diff(days) > 2 * padding_days + 1) + 1
+    starts = days[np.concatenate([[0], breaks])] - padding_days
+    ends = days[np.concatenate([breaks - 1, [len(days) - 1]])] + padding_days
+    to_date = lambda day: pd.Timestamp(np.datetime64(int(day), 'D')).date()
+    return [(to_date(start), to_date(end)) for start, end in zip(starts, ends)]
+
+def location_day_ranges(tiktok_data, locations, timeline, padding_days=1):
+    """Padded active day ranges per location, assigning activity via the location timeline."""
+    default = next(iter(locations))
+    timestamps = pd.concat([df['timestamp'] for df in tiktok_data.values()], ignore_index=True)
+    assigned = assign_locations(timestamps, timeline, default)
+    return {name: active_day_ranges({name: timestamps[assigned == name].to_frame()}, padding_days)
+            for name in locations if (assigned == name).any()}
+
+def plan_location_ranges(start_date, end_date, locations, tiktok_data=None, timeline=None, padding_days=1):
+    """Date ranges to fetch per location: the whole span, or only around activity if `tiktok_data` is given."""
+    if tiktok_data is not None:
+        return location_day_ranges(tiktok_data, locations, timeline, padding_days)
+    return {name: [(pd.Timestamp(start_date).date(), pd.Timestamp(end_date).date())] for name in locations}
+
+def fetch_location_weather(fetcher, location_ranges):
+    """Fetch and decode the weather of every location into {location: DataFrame}."""
+    raw_data = fetcher.fetch_locations(location_ranges)
+    frames = {name: fetcher.process_weather_data(location_data) for name, location_data in raw_data.items()}
+    return {name: df for name, df in frames.items() if df is not None}
+
+def save_location_weather(frames, output_dir='data/weather_data', fmt='csv', export=False):
+    """Write one partition per location, e.g. data/weather_data/location=istanbul/."""
+    for name, df in frames.items():
+        location_dir = os.path.join(output_dir, f'location={name}')
+        os.makedirs(location_dir, exist_ok=True)
+        output_path = save_table(df, f"{location_dir}/hourly_weather", fmt, WEATHER_SCHEMA)
+        if export and fmt != 'csv':
+            export_csv(df, output_path)
+        print(f"Weather data for {name} saved successfully!")
 
 def main():
+    parser = argparse.ArgumentParser(description='Fetch hourly weather for the TikTok date range.')
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='Storage format of the hourly weather table')
+    parser.add_argument('--export-csv', action='store_true',
+                        help='Also write hourly_weather.csv when using a columnar format')
+    parser.add_argument('--base-url', default="https://archive-api.open-meteo.com/v1/archive",
+                        help='Open-Meteo archive endpoint, e.g. a local fake_open_meteo.py server')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Number of month-sized chunks fetched concurrently')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Ignore the on-disk weather cache and download every day')
+    parser.add_argument('--sparse', action='store_true',
+                        help='Only fetch days with TikTok activity instead of the whole date range')
+    parser.add_argument('--padding-days', type=int, default=1,
+                        help='Days of weather kept around each active day in sparse mode')
+    parser.add_argument('--variables', default=','.join(DEFAULT_VARIABLES),
+                        help='Comma-separated Open-Meteo hourly variables, e.g. '
+                             'temperature_2m,precipitation,weathercode,relative_humidity_2m,'
+                             'cloud_cover,wind_speed_10m,is_day')
+    parser.add_argument('--locations', default='data/locations/locations.csv',
+                        help='CSV of location,latitude,longitude (see locations.py); Istanbul if missing')
+    parser.add_argument('--batch-size', type=int, default=10,
+                        help='Locations requested together in one API call')
+    args = parser.parse_args()
+
     # Read date range from processed TikTok data
     date_range_path = 'data/processed/date_range.csv'
     if not os.path.exists(date_range_path):
@@ -65,15 +341,36 @@ def main():
     output_dir = 'data/weather_data'
     os.makedirs(output_dir, exist_ok=True)
     
-    fetcher = WeatherDataFetcher()
-    print(f"Fetching weather data from {start_date} to {end_date}...")
+    locations = load_locations(args.locations)
+    fetcher = WeatherDataFetcher(base_url=args.base_url, max_workers=args.workers,
+                                 use_cache=not args.no_cache, variables=args.variables.split(','),
+                                 locations=locations, batch_size=args.batch_size)
+    location_ranges = plan_location_ranges(start_date, end_date, locations,
+                                           load_tiktok_data(fmt=args.format) if args.sparse else None,
+                                           load_location_timeline(), args.padding_days)
+    print(f"Fetching weather data from {start_date} to {end_date} for {len(location_ranges)} location(s) "
+          f"in {sum(len(ranges) for ranges in location_ranges.values())} range(s)...")
     
-    raw_data = fetcher.fetch_weather_data(start_date, end_date)
-    if raw_data:
-        df = fetcher.process_weather_data(raw_data)
-        if df is not None:
-            df.to_csv(f"{output_dir}/hourly_weather.csv", index=False)
-            print("Weather data saved successfully!")
+    frames = fetch_location_weather(fetcher, location_ranges)
+    print(f"{fetcher.stats['cached_days']} days from cache, {fetcher.stats['fetched_days']} days "
+          f"fetched in {fetcher.stats['requests']} requests ({fetcher.stats['bytes'] / 1e6:.1f} MB)")
+    save_location_weather(frames, output_dir, args.format, args.export_csv)
+
+    if args.sparse:
+        # Compare against downloading the whole span of every location from scratch
+        dense_plan = {name: [(start_date.date(), end_date.date())] for name in location_ranges}
+        dense_days = ((end_date.date() - start_date.date()).days + 1) * len(location_ranges)
+        sparse_days = sum((end - start).days + 1
+                          for date_ranges in location_ranges.values() for start, end in date_ranges)
+        print(f"Sparse fetch: {sparse_days} of {dense_days} location-days ({1 - sparse_days / dense_days:.0%} saved); "
+              f"{fetcher.count_requests(location_ranges)} vs {fetcher.count_requests(dense_plan)} requests "
+              f"without a cache")
+        if fetcher.stats['fetched_days']:
+            # Only the sparse download is measured; the dense one is scaled from its bytes per day
+            bytes_per_day = fetcher.stats['bytes'] / fetcher.stats['fetched_days']
+            print(f"Measured: {fetcher.stats['requests']} requests, {fetcher.stats['bytes'] / 1e6:.2f} MB for "
+                  f"{fetcher.stats['fetched_days']} days; estimated dense download without a cache: "
+                  f"{dense_days * bytes_per_day / 1e6:.2f} MB")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,106 @@
+import pandas as pd
+import numpy as np
+import argparse
+import ipaddress
+import os
+
+from parse_tiktok_data import parse_records
+
+LOCATIONS_DIR = 'data/locations'
+
+# Used when no locations table exists; the first location is the default
+DEFAULT_LOCATIONS = {'istanbul': ('41.0082', '28.9784')}
+
+def load_locations(path=f'{LOCATIONS_DIR}/locations.csv'):
+    """Load the known locations as {name: (latitude, longitude)}, in file order."""
+    if not os.path.exists(path):
+        return dict(DEFAULT_LOCATIONS)
+    df = pd.read_csv(path, dtype={'location': str, 'latitude': str, 'longitude': str})
+    return {row.location: (row.latitude, row.longitude) for row in df.itertuples(index=False)}
+
+def load_ip_networks(path):
+    """Load the user-maintained IP network -> location mapping.
+
+    The CSV has `network` (an address or CIDR block such as 81.8.0.0/16),
+    `location`, `latitude` and `longitude` columns.
+    """
+    df = pd.read_csv(path, dtype=str)
+    df['network'] = [ipaddress.ip_network(network.strip(), strict=False) for network in df['network']]
+    return df
+
+def locate_ips(ips, networks):
+    """Map each IP address to the location of the most specific matching network, or None."""
+    located = {}
+    for ip in pd.unique(ips):
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            located[ip] = None
+            continue
+        matches = [row for row in networks.itertuples(index=False)
+                   if address.version == row.network.version and address in row.network]
+        # The most specific network wins, e.g. a /24 over the /16 containing it
+        located[ip] = max(matches, key=lambda row: row.network.prefixlen).location if matches else None
+    return np.array([located[ip] for ip in ips], dtype=object)
+
+def build_location_timeline(logins, networks):
+    """Turn login events into a timeline of (timestamp, location) changes.
+
+    Logins from unmapped IPs are ignored, so the last known location carries
+    forward until a login from a mapped network is seen.
+    """
+    logins = logins.sort_values('timestamp', kind='stable')
+    timeline = pd.DataFrame({'timestamp': logins['timestamp'].to_numpy(),
+                             'location': locate_ips(logins['ip'].to_numpy(), networks)})
+    timeline = timeline.dropna(subset=['location']).reset_index(drop=True)
+    changed = timeline['location'].ne(timeline['location'].shift())
+    return timeline[changed].reset_index(drop=True)
+
+def load_location_timeline(path=f'{LOCATIONS_DIR}/location_timeline.csv'):
+    """Load a location timeline, either derived from logins or written by hand per period."""
+    if not os.path.exists(path):
+        return None
+    timeline = pd.read_csv(path, parse_dates=['timestamp'])
+    return timeline.sort_values('timestamp', kind='stable').reset_index(drop=True)
+
+def assign_locations(timestamps, timeline, default):
+    """Location of each timestamp: the latest timeline entry at or before it.
+
+    Timestamps before the first entry take the first known location; without
+    a timeline every timestamp gets `default`.
+    """
+    timestamps = np.asarray(timestamps, dtype='datetime64[ns]')
+    if timeline is None or timeline.empty:
+        return np.full(len(timestamps), default, dtype=object)
+    starts = timeline['timestamp'].to_numpy(dtype='datetime64[ns]')
+    positions = np.searchsorted(starts, timestamps, side='right') - 1
+    return timeline['location'].to_numpy(dtype=object)[np.clip(positions, 0, None)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Derive a location timeline from the login history IPs.')
+    parser.add_argument('--login-history', default='data/tiktok_data/login_history.txt')
+    parser.add_argument('--ip-map', default=f'{LOCATIONS_DIR}/ip_locations.csv',
+                        help='CSV mapping IP networks to location, latitude and longitude')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.ip_map):
+        print(f"Please create {args.ip_map} with network,location,latitude,longitude columns")
+        return
+
+    networks = load_ip_networks(args.ip_map)
+    logins = parse_records(args.login_history, 'IP', 'ip')
+    timeline = build_location_timeline(logins, networks)
+
+    os.makedirs(LOCATIONS_DIR, exist_ok=True)
+    timeline.to_csv(f'{LOCATIONS_DIR}/location_timeline.csv', index=False)
+    networks.drop_duplicates('location')[['location', 'latitude', 'longitude']].to_csv(
+        f'{LOCATIONS_DIR}/locations.csv', index=False)
+
+    mapped = pd.notna(locate_ips(logins['ip'].to_numpy(), networks)).sum()
+    print(f"{len(logins)} logins, {mapped} from mapped networks")
+    print(f"Location timeline: {len(timeline)} changes across {timeline['location'].nunique()} location(s)")
+    for name, group in timeline.groupby('location', sort=False):
+        print(f"  {name}: {len(group)} period(s) starting {group['timestamp'].min()}")
+
+if __name__ == "__main__":
+    main()
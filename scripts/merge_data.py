@@ -1,8 +1,19 @@
 # example script just a placeholder for now:
 
 import pandas as pd
+import numpy as np
+import argparse
 import os
-from datetime import datetime
+import tempfile
+from pandas.tseries.frequencies import to_offset
+
+from aggregation_cube import AggregationCube, cube_path
+from locations import assign_locations, load_location_timeline, load_locations
+from running_stats import RunningStatistics, load_running_stats, stats_path
+from weather_join import add_rolling_features, asof_join, parse_windows
+from storage import (ACTIVITY_SCHEMA, FORMATS, MERGED_SCHEMA, WEATHER_SCHEMA,
+                     append_table, apply_schema, drop_last_row, export_csv, iter_table, load_table, month_partitions,
+                     read_last_row, save_table, table_path)
 
 # Weather code mapping for better readability
 WEATHER_CODE_MAPPING = {
@@ -24,101 +35,424 @@ WEATHER_CODE_MAPPING = {
     86: "Snow showers"
 }
 
-def load_tiktok_data():
-    """Load and combine all processed TikTok data."""
-    tiktok_data = {}
-    processed_dir = 'data/processed'
-    
-    for filename in os.listdir(processed_dir):
-        if filename.endswith('.csv') and not filename.startswith(('merged_', 'date_range', 'processed')):
-            name = filename.replace('.csv', '')
-            file_path = os.path.join(processed_dir, filename)
-            df = pd.read_csv(file_path)
-            
-            if 'timestamp' in df.columns:
-                df['timestamp'] = pd.to_datetime(df['timestamp'])
-                # Round timestamps to the nearest hour for better matching
-                df['timestamp'] = df['timestamp'].dt.floor('H')
-                tiktok_data[name] = df
-    
-    return tiktok_data
+def tiktok_tables(processed_dir='data/processed', fmt='csv'):
+    """{activity type: path} of the processed tables loaded by `load_tiktok_data`."""
+    return {os.path.splitext(filename)[0]: os.path.join(processed_dir, filename)
+            for filename in sorted(os.listdir(processed_dir))
+            if filename.endswith(f'.{fmt}') and not filename.startswith(('merged_', 'date_range', 'processed'))}
 
-def load_weather_data():
-    """Load weather data and add weather descriptions."""
-    weather_dir = 'data/weather_data'
-    weather_data = pd.read_csv(os.path.join(weather_dir, 'hourly_weather.csv'))
-    weather_data['timestamp'] = pd.to_datetime(weather_data['timestamp'])
-    
-    # Add weather description
-    weather_data['weather_description'] = weather_data['weather_code'].map(WEATHER_CODE_MAPPING)
-    
+def weather_tables(weather_dir='data/weather_data', fmt='csv'):
+    """{location: path} of the weather partitions, or {None: path} for unpartitioned weather."""
+    partitions = sorted(name for name in os.listdir(weather_dir)
+                        if name.startswith('location=')
+                        and os.path.exists(table_path(os.path.join(weather_dir, name, 'hourly_weather'), fmt)))
+    if partitions:
+        return {name.split('=', 1)[1]: os.path.join(weather_dir, name, 'hourly_weather') for name in partitions}
+    return {None: os.path.join(weather_dir, 'hourly_weather')}
+
+def load_tiktok_data(processed_dir='data/processed', fmt='csv'):
+    """Load and combine all processed TikTok data.
+
+    Pass `data/processed/delta` to load only the rows added by the last
+    incremental parse. Only the timestamps are needed for the activity counts;
+    they are bucketed at the merge resolution later.
+    """
+    return {name: load_table(path, fmt, ACTIVITY_SCHEMA, columns=['timestamp'])
+            for name, path in tiktok_tables(processed_dir, fmt).items()}
+
+def load_weather_data(weather_dir='data/weather_data', fmt='csv'):
+    """Load weather data and add weather descriptions.
+
+    Weather partitioned by location (`location=<name>/` directories) is
+    combined into one table with a `location` column.
+    """
+    tables = weather_tables(weather_dir, fmt)
+    if None in tables:
+        return add_weather_description(load_table(tables[None], fmt, WEATHER_SCHEMA))
+    return combine_weather({location: load_table(path, fmt, WEATHER_SCHEMA) for location, path in tables.items()})
+
+def combine_weather(frames):
+    """Combine {location: hourly weather} into one table with a `location` column."""
+    weather_data = pd.concat([df.assign(location=name) for name, df in frames.items()], ignore_index=True)
+    weather_data['location'] = weather_data['location'].astype('category')
+    return add_weather_description(weather_data)
+
+def add_weather_description(weather_data):
+    """Add a readable weather_description category for every weather code."""
+    weather_data['weather_description'] = (weather_data['weather_code']
+                                           .map(WEATHER_CODE_MAPPING)
+                                           .astype('category'))
     return weather_data
 
-def create_hourly_activity_counts(tiktok_data):
-    """Create hourly activity counts for each type of interaction."""
-    hourly_counts = {}
+def bucket_width(freq):
+    """Width of a fixed-size time bucket such as 'h', '3h' or 'D' as a Timedelta."""
+    return pd.Timedelta(to_offset(freq))
+
+def build_activity_grid(tiktok_data, freq='h', span=None):
+    """Count every activity type per time bucket in one pass over all events.
+
+    Each event is mapped to the integer offset of its bucket from the start of
+    the covered range, and all types are counted together with a single
+    bincount into a dense (buckets x types) matrix. Returns the start of the
+    first bucket, the bucket width and the count matrix, whose rows cover
+    every bucket from the first to the last event including empty ones, or
+    from the first to the last time of `span` if given.
+    """
+    names = list(tiktok_data)
+    timestamps = [df['timestamp'].to_numpy(dtype='datetime64[ns]') for df in tiktok_data.values()]
+    step = bucket_width(freq).to_timedelta64()
+    non_empty = [values for values in timestamps if len(values)]
+    if span is not None:
+        start = pd.Timestamp(span[0]).floor(freq).to_datetime64().astype('datetime64[ns]')
+        end = pd.Timestamp(span[1]).to_datetime64().astype('datetime64[ns]')
+    elif not non_empty:
+        return None, step, np.zeros((0, len(names)), dtype=np.int64)
+    else:
+        start = pd.Timestamp(min(values.min() for values in non_empty)).floor(freq).to_datetime64()
+        end = max(values.max() for values in non_empty)
+    n_buckets = int((end - start) // step) + 1
+
+    offsets = np.concatenate([(values - start) // step for values in timestamps]).astype(np.int64)
+    types = np.repeat(np.arange(len(names)), [len(values) for values in timestamps])
+    counts = np.bincount(offsets * len(names) + types, minlength=n_buckets * len(names))
+    return start, step, counts.reshape(n_buckets, len(names))
+
+def create_hourly_activity_counts(tiktok_data, freq='h', span=None):
+    """Create a complete timeline of activity counts per type, including buckets without activity."""
+    start, step, counts = build_activity_grid(tiktok_data, freq, span)
+    timeline = pd.DataFrame(counts, columns=[f'{data_type}_count' for data_type in tiktok_data])
+    timeline.insert(0, 'timestamp', start + step * np.arange(len(counts)) if len(counts)
+                    else np.array([], dtype='datetime64[ns]'))
+    return timeline
+
+def resample_weather(weather_data, freq):
+    """Aggregate hourly weather to a coarser resolution.
+
+    Precipitation is summed, weather codes take the most severe (highest) code
+    as in Open-Meteo's daily data, and all other measurements are averaged.
+    """
+    aggregations = {}
+    for column in weather_data.columns:
+        if column in ('timestamp', 'location', 'weather_description'):
+            continue
+        if column == 'precipitation':
+            aggregations[column] = 'sum'
+        elif column in ('weather_code', 'is_day'):
+            aggregations[column] = 'max'
+        else:
+            aggregations[column] = 'mean'
+    # Bucket edges counted from the epoch, as `build_activity_grid` floors them
+    keys = [pd.Grouper(key='timestamp', freq=freq, origin='epoch')]
+    if 'location' in weather_data.columns:
+        keys.insert(0, 'location')
+    return add_weather_description(weather_data.groupby(keys, observed=True).agg(aggregations).reset_index())
+
+def join_weather(activity, weather_data, tolerance='1h', timeline=None, default_location=None):
+    """As-of join rows keyed by `timestamp` to the weather and add the time features of that timestamp.
+
+    With weather partitioned by location, every row is joined to the weather
+    where the user was at the time. Returns the joined rows and the number of
+    rows dropped for lack of recent weather.
+    """
+    by = None
+    if 'location' in weather_data.columns:
+        activity = activity.assign(location=pd.Categorical(
+            assign_locations(activity['timestamp'], timeline, default_location),
+            categories=weather_data['location'].cat.categories))
+        by = 'location'
+    joined, dropped = asof_join(activity, weather_data, tolerance, by)
     
-    for data_type, df in tiktok_data.items():
-        # Count activities per hour
-        hourly_counts[data_type] = (
-            df.groupby('timestamp')
-            .size()
-            .reset_index(name=f'{data_type}_count')
-        )
+    # Add time-based features
+    joined['hour'] = joined['timestamp'].dt.hour
+    joined['day_of_week'] = joined['timestamp'].dt.day_name()
+    joined['is_weekend'] = joined['timestamp'].dt.dayofweek.isin([5, 6])
+    return joined, dropped
+
+def build_merged_dataset(tiktok_data, weather_data, resolution='h', tolerance='1h', lookback='',
+                         timeline=None, default_location=None, span=None):
+    """Join the activity timeline with the weather and add the time features of the merged table.
+
+    `span` limits the timeline to (first, last) time, e.g. one month of a chunked merge.
+    """
+    hourly_activity = create_hourly_activity_counts(tiktok_data, resolution, span)
+    if bucket_width(resolution) > pd.Timedelta('1h'):
+        weather_data = resample_weather(weather_data, resolution)
+    weather_data = add_rolling_features(weather_data, parse_windows(lookback), tolerance)
     
-    # Merge all hourly counts
-    base_df = pd.DataFrame()
-    for data_type, counts in hourly_counts.items():
-        if base_df.empty:
-            base_df = counts
-        else:
-            base_df = pd.merge(base_df, counts, on='timestamp', how='outer')
+    # Buckets without activity stay in the timeline; only buckets without recent weather are dropped
+    final_dataset, dropped = join_weather(hourly_activity, weather_data, tolerance, timeline, default_location)
+    if dropped:
+        print(f"{dropped} buckets without weather within {tolerance} were dropped")
     
-    # Fill NaN values with 0 (hours with no activity)
-    base_df = base_df.fillna(0)
-    return base_df
+    # Calculate total activity per hour
+    activity_columns = [col for col in final_dataset.columns if col.endswith('_count')]
+    final_dataset['total_activity'] = final_dataset[activity_columns].sum(axis=1)
+    return apply_schema(final_dataset, MERGED_SCHEMA)
+
+def save_merged_dataset(final_dataset, output_dir='data/merged_data', fmt='csv', export=False, cube=None,
+                        stats=None):
+    """Write the merged table with its aggregation cube and running statistics; returns the table path."""
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = save_table(final_dataset, os.path.join(output_dir, 'merged_data'), fmt)
+    if export and fmt != 'csv':
+        export_csv(final_dataset, output_path)
+    print(f"Final dataset saved to {output_path}")
+
+    # Aggregates shared by the analyzer and the visualizer
+    cube = cube if cube is not None else AggregationCube.from_frame(final_dataset)
+    cube_output = cube.save(cube_path(os.path.join(output_dir, 'merged_data')), fmt)
+    print(f"Aggregation cube saved to {cube_output}")
+    stats = stats if stats is not None else RunningStatistics.from_frame(final_dataset, cube)
+    stats_output = stats.save(stats_path(os.path.join(output_dir, 'merged_data')), fmt)
+    print(f"Running statistics saved to {stats_output}")
+    return output_path
+
+class MonthSpill:
+    """Rows streamed in any order, spilled to one directory per calendar month.
+
+    Reading the months back in order turns unsorted inputs into time-ordered
+    chunks while holding only one input chunk or one month in memory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.pieces = 0
+
+    def add(self, name, frame):
+        months = frame['timestamp'].to_numpy(dtype='datetime64[M]')
+        for month in np.unique(months):
+            month_dir = os.path.join(self.directory, str(month))
+            os.makedirs(month_dir, exist_ok=True)
+            frame[months == month].to_pickle(os.path.join(month_dir, f'{name}-{self.pieces}.pkl'))
+            self.pieces += 1
+
+    def months(self):
+        """Every month from the first to the last one spilled, including months without rows."""
+        spilled = sorted(os.listdir(self.directory))
+        if not spilled:
+            return []
+        return [str(month) for month in pd.period_range(spilled[0], spilled[-1], freq='M')]
+
+    def read(self, month, name):
+        """Rows of one name and month, or None if there are none."""
+        month_dir = os.path.join(self.directory, month)
+        pieces = sorted((filename for filename in os.listdir(month_dir) if filename.rsplit('-', 1)[0] == name),
+                        key=lambda filename: int(filename.rsplit('-', 1)[1].split('.')[0])) \
+            if os.path.isdir(month_dir) else []
+        return pd.concat([pd.read_pickle(os.path.join(month_dir, piece)) for piece in pieces],
+                         ignore_index=True) if pieces else None
+
+def month_path(output_dir, month):
+    """Location of one month of the merged data written by `merge_in_chunks`."""
+    return os.path.join(output_dir, f'month={month}', 'merged_data')
+
+def merge_in_chunks(processed_dir='data/processed', weather_dir='data/weather_data', output_dir='data/merged_data',
+                    fmt='csv', chunk_size=1000000, resolution='h', tolerance='1h', lookback='',
+                    timeline=None, default_location=None):
+    """Merge with bounded memory, writing the merged data partitioned by month.
+
+    Events and weather are read in chunks of `chunk_size` rows and spilled
+    to per-month files, then every month is merged on its own in time order.
+    The weather tail of the previous month is carried over for the as-of
+    join and the look-back features, and the running statistics (with the
+    aggregation cube) are updated month by month. Peak memory is set by the
+    chunk size and the largest month, not by the length of the history.
+    Returns the running statistics of all months.
+    """
+    # Only tables of this format are replaced; those of other formats are separate copies of the data
+    data_path = os.path.join(output_dir, 'merged_data')
+    for partition in month_partitions(data_path, fmt):
+        os.remove(partition)
+        if not os.listdir(os.path.dirname(partition)):
+            os.rmdir(os.path.dirname(partition))
+    # A merged table of an earlier full merge would shadow the partitions when loading
+    if os.path.exists(table_path(data_path, fmt)):
+        os.remove(table_path(data_path, fmt))
+    os.makedirs(output_dir, exist_ok=True)
+    windows = parse_windows(lookback)
+    carry_span = max(windows.values(), default=pd.Timedelta(0)) + pd.Timedelta(tolerance) + bucket_width(resolution)
+
+    with tempfile.TemporaryDirectory(dir=output_dir) as spill_dir:
+        spill = MonthSpill(spill_dir)
+        tables = tiktok_tables(processed_dir, fmt)
+        firsts, lasts = [], []
+        for name, path in tables.items():
+            for chunk in iter_table(path, fmt, ACTIVITY_SCHEMA, ['timestamp'], chunk_size):
+                chunk = chunk.dropna(subset=['timestamp'])
+                if len(chunk):
+                    firsts.append(chunk['timestamp'].min())
+                    lasts.append(chunk['timestamp'].max())
+                    spill.add(name, chunk)
+        locations = weather_tables(weather_dir, fmt)
+        for location, path in locations.items():
+            for chunk in iter_table(path, fmt, WEATHER_SCHEMA, None, chunk_size):
+                spill.add('weather', chunk if location is None else chunk.assign(location=location))
+
+        stats, carry = None, None
+        for month in spill.months():
+            frames = [frame for frame in (carry, spill.read(month, 'weather')) if frame is not None]
+            if not frames:
+                continue
+            weather = pd.concat(frames, ignore_index=True)
+            if None not in locations:
+                weather['location'] = pd.Categorical(weather['location'], categories=list(locations))
+            month_start = pd.Timestamp(month)
+            month_end = month_start + pd.offsets.MonthBegin()
+            # The last hours of a month are the as-of matches and look-back window of the next one
+            carry = weather[weather['timestamp'] >= month_end - carry_span]
+            if not firsts or month_end <= min(firsts) or month_start > max(lasts):
+                continue
+
+            empty = pd.DataFrame({'timestamp': pd.Series(dtype='datetime64[ns]')})
+            tiktok_data = {name: spill.read(month, name) for name in tables}
+            tiktok_data = {name: df if df is not None else empty for name, df in tiktok_data.items()}
+            span = (max(month_start, min(firsts)), min(month_end - pd.Timedelta(1, 'ns'), max(lasts)))
+            merged = build_merged_dataset(tiktok_data, add_weather_description(weather), resolution, tolerance,
+                                          lookback, timeline, default_location, span)
+            os.makedirs(os.path.dirname(month_path(output_dir, month)), exist_ok=True)
+            save_table(merged, month_path(output_dir, month), fmt, MERGED_SCHEMA)
+            if len(merged):
+                month_stats = RunningStatistics.from_frame(merged)
+                stats = month_stats if stats is None else stats.merge(month_stats)
+            print(f"{month}: {len(merged)} buckets merged")
+
+    if stats is not None:
+        stats.cube.save(cube_path(data_path), fmt)
+        stats.save(stats_path(data_path), fmt)
+    return stats
+
+def _write_delta_rows(rows, path, fmt, replace_last=False):
+    """Append merged rows to a table or month partition, replacing its last row when `replace_last`, or create it."""
+    if not os.path.exists(table_path(path, fmt)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return save_table(rows, path, fmt, MERGED_SCHEMA)
+    if replace_last:
+        drop_last_row(path, fmt, MERGED_SCHEMA)
+    return append_table(rows, path, fmt, MERGED_SCHEMA)
+
+def merge_delta(delta_dir='data/processed/delta', weather_dir='data/weather_data', output_dir='data/merged_data',
+                fmt='csv', resolution='h', tolerance='1h', lookback='', timeline=None, default_location=None):
+    """Merge only the events of the last incremental parse into the merged data and its running statistics.
+
+    The new buckets run from the last merged bucket to the newest event. An
+    export usually ends mid-bucket, so the last merged bucket is merged again:
+    its row gets the new events added to its counts and replaces the old row,
+    in the table and in the statistics. Events before that bucket are left out
+    and counted (a full merge includes them). The new rows are written to
+    `<output_dir>/delta/` and appended to the merged table, or to its month
+    partitions after `merge_in_chunks`. Returns the new rows, the updated
+    statistics and the number of left-out events, or None without statistics
+    to update.
+    """
+    data_path = os.path.join(output_dir, 'merged_data')
+    stats = load_running_stats(data_path, fmt)
+    if stats is None:
+        return None
+    partitioned = not os.path.exists(table_path(data_path, fmt))
+    last_path = month_partitions(data_path, fmt)[-1] if partitioned else data_path
+    # The table is in time order, so its last row is the last merged bucket
+    last_row = read_last_row(last_path, fmt, MERGED_SCHEMA)
+    start = last_row['timestamp'].iloc[0]
+    tiktok_data = load_tiktok_data(delta_dir, fmt)
+    late = sum(int((df['timestamp'] < start).sum()) for df in tiktok_data.values())
+    tiktok_data = {name: df[df['timestamp'] >= start] for name, df in tiktok_data.items()}
+    ends = [df['timestamp'].max() for df in tiktok_data.values() if len(df)]
+    if not ends:
+        return pd.DataFrame({'timestamp': pd.Series(dtype='datetime64[ns]')}), stats, late
+
+    merged = build_merged_dataset(tiktok_data, load_weather_data(weather_dir, fmt), resolution, tolerance, lookback,
+                                  timeline, default_location, (start, max(ends)))
+    # New rows follow the columns of the table; activity types without new events count zero
+    merged = merged.reindex(columns=last_row.columns)
+    counts = [col for col in last_row.columns if col.endswith('_count')] + ['total_activity']
+    merged[counts] = merged[counts].fillna(0)
+    replace_last = len(merged) > 0 and merged['timestamp'].iloc[0] == start
+    if replace_last:
+        # The merged row holds the earlier events of the bucket, the delta only the new ones
+        merged.loc[merged.index[0], counts] += last_row[counts].iloc[0]
+    merged = apply_schema(merged, MERGED_SCHEMA)
+    os.makedirs(os.path.join(output_dir, 'delta'), exist_ok=True)
+    save_table(merged, os.path.join(output_dir, 'delta', 'merged_data'), fmt, MERGED_SCHEMA)
+
+    if partitioned:
+        months = merged['timestamp'].dt.strftime('%Y-%m')
+        for month, rows in merged.groupby(months, sort=True):
+            path = month_path(output_dir, month)
+            _write_delta_rows(rows, path, fmt, replace_last and table_path(path, fmt) == last_path)
+    else:
+        _write_delta_rows(merged, data_path, fmt, replace_last)
+
+    # Saved after the table, so the statistics are not older than the table they describe
+    if replace_last:
+        stats = stats.subtract(RunningStatistics.from_frame(last_row))
+    if len(merged):
+        stats = stats.update(merged)
+    stats.cube.save(cube_path(data_path), fmt)
+    stats.save(stats_path(data_path), fmt)
+    return merged, stats, late
 
 def main():
+    parser = argparse.ArgumentParser(description='Merge hourly TikTok activity with weather data.')
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='Storage format of the input and output tables')
+    parser.add_argument('--export-csv', action='store_true',
+                        help='Also write merged_data.csv when using a columnar format')
+    parser.add_argument('--resolution', default='h',
+                        help='Width of the time buckets, e.g. 15min, h, 3h or D')
+    parser.add_argument('--tolerance', default='1h',
+                        help='How old the latest weather may be at the start of a bucket')
+    parser.add_argument('--lookback', default='',
+                        help='Comma-separated look-back windows for rolling weather features, e.g. 3h,24h')
+    parser.add_argument('--chunk-size', type=int, default=0,
+                        help='Stream the inputs in chunks of this many rows and write the output by month')
+    parser.add_argument('--delta', action='store_true',
+                        help='Only merge the rows of the last incremental parse and update the running statistics')
+    args = parser.parse_args()
+
     output_dir = 'data/merged_data'
-    os.makedirs(output_dir, exist_ok=True)
+    if args.delta:
+        result = merge_delta(output_dir=output_dir, fmt=args.format, resolution=args.resolution,
+                             tolerance=args.tolerance, lookback=args.lookback, timeline=load_location_timeline(),
+                             default_location=next(iter(load_locations())))
+        if result is None:
+            print("Please run a full merge first to build the merged data and its running statistics")
+            return
+        merged, stats, late = result
+        if late:
+            print(f"{late} new events fall before the last merged bucket and were skipped "
+                  f"(a full merge counts every event)")
+        print(f"{len(merged)} buckets merged or updated; running statistics now cover "
+              f"{int(stats.cube.count.sum())} buckets over {stats.total_days} days")
+        return
+    if args.chunk_size:
+        print(f"Merging by month in chunks of {args.chunk_size:,} rows...")
+        stats = merge_in_chunks(output_dir=output_dir, fmt=args.format, chunk_size=args.chunk_size,
+                                resolution=args.resolution, tolerance=args.tolerance, lookback=args.lookback,
+                                timeline=load_location_timeline(), default_location=next(iter(load_locations())))
+        totals = stats.cube.aggregate(measures=stats.cube.measures)
+        print(f"\nTotal Hours: {int(stats.cube.count.sum())} over {stats.total_days} days")
+        print("\nActivity Totals:")
+        for col in [col for col in stats.cube.measures if col.endswith('_count')]:
+            print(f"{col}: {totals[f'{col}_sum'].iloc[0]:,.0f}")
+        return
     
     print("Loading TikTok data...")
-    tiktok_data = load_tiktok_data()
+    tiktok_data = load_tiktok_data(fmt=args.format)
     
     print("Loading weather data...")
-    weather_data = load_weather_data()
-    
-    print("Creating hourly activity summary...")
-    hourly_activity = create_hourly_activity_counts(tiktok_data)
-    
-    print("Merging with weather data...")
-    final_dataset = pd.merge(
-        hourly_activity,
-        weather_data,
-        on='timestamp',
-        how='inner'
-    )
+    weather_data = load_weather_data(fmt=args.format)
     
-    # Add time-based features
-    final_dataset['hour'] = final_dataset['timestamp'].dt.hour
-    final_dataset['day_of_week'] = final_dataset['timestamp'].dt.day_name()
-    final_dataset['is_weekend'] = final_dataset['timestamp'].dt.dayofweek.isin([5, 6])
-    
-    # Calculate total activity per hour
-    activity_columns = [col for col in final_dataset.columns if col.endswith('_count')]
-    final_dataset['total_activity'] = final_dataset[activity_columns].sum(axis=1)
-    
-    # Save the final dataset
-    output_path = os.path.join(output_dir, 'merged_data.csv')
-    final_dataset.to_csv(output_path, index=False)
-    print(f"Final dataset saved to {output_path}")
+    print("Creating hourly activity summary and merging with weather data...")
+    final_dataset = build_merged_dataset(tiktok_data, weather_data, args.resolution, args.tolerance,
+                                         args.lookback, load_location_timeline(), next(iter(load_locations())))
+    save_merged_dataset(final_dataset, output_dir, args.format, args.export_csv)
     
     # Print summary statistics
     print("\nDataset Summary:")
     print(f"Date Range: {final_dataset['timestamp'].min()} to {final_dataset['timestamp'].max()}")
     print(f"Total Hours: {len(final_dataset)}")
     print("\nActivity Totals:")
-    for col in activity_columns:
+    for col in [col for col in final_dataset.columns if col.endswith('_count')]:
         total = final_dataset[col].sum()
         print(f"{col}: {total:,.0f}")
 
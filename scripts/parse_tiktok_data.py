@@ -1,110 +1,258 @@
 # example script just a placeholder for now:
 
 import pandas as pd
+import numpy as np
+import argparse
+import hashlib
+import json
 import os
-from datetime import datetime
-
-def parse_browsing_history(file_path):
-    """Parse TikTok browsing history from txt file."""
-    data = []
-    with open(file_path, 'r', encoding='utf-8') as file:
-        current_date = None
-        for line in file:
-            line = line.strip()
-            if line.startswith('Date:'):
-                current_date = line.split('Date:')[1].strip()
-            elif line.startswith('Link:') and current_date:
-                link = line.split('Link:')[1].strip()
-                data.append({
-                    'timestamp': datetime.strptime(current_date, '%Y-%m-%d %H:%M:%S'),
-                    'link': link
-                })
-    return pd.DataFrame(data)
-
-def parse_favorite_sounds(file_path):
-    """Parse TikTok favorite sounds from txt file."""
-    data = []
-    with open(file_path, 'r', encoding='utf-8') as file:
-        current_date = None
-        for line in file:
-            line = line.strip()
-            if line.startswith('Date:'):
-                current_date = line.split('Date:')[1].strip()
-            elif line.startswith('Sound Link:') and current_date:
-                link = line.split('Sound Link:')[1].strip()
-                data.append({
-                    'timestamp': datetime.strptime(current_date, '%Y-%m-%d %H:%M:%S'),
-                    'link': link
-                })
-    return pd.DataFrame(data)
-
-def parse_favorite_videos(file_path):
-    """Parse TikTok favorite videos from txt file."""
-    data = []
-    with open(file_path, 'r', encoding='utf-8') as file:
-        current_date = None
-        for line in file:
-            line = line.strip()
-            if line.startswith('Date:'):
-                current_date = line.split('Date:')[1].strip()
-            elif line.startswith('Link:') and current_date:
-                link = line.split('Link:')[1].strip()
-                data.append({
-                    'timestamp': datetime.strptime(current_date, '%Y-%m-%d %H:%M:%S'),
-                    'link': link
-                })
-    return pd.DataFrame(data)
-
-def parse_like_list(file_path):
-    """Parse TikTok liked videos from txt file."""
-    data = []
-    with open(file_path, 'r', encoding='utf-8') as file:
-        current_date = None
-        for line in file:
-            line = line.strip()
-            if line.startswith('Date:'):
-                current_date = line.split('Date:')[1].strip()
-            elif line.startswith('Link:') and current_date:
-                link = line.split('Link:')[1].strip()
-                data.append({
-                    'timestamp': datetime.strptime(current_date, '%Y-%m-%d %H:%M:%S'),
-                    'link': link
-                })
-    return pd.DataFrame(data)
-
-def parse_share_history(file_path):
-    """Parse TikTok share history from txt file."""
-    data = []
-    with open(file_path, 'r', encoding='utf-8') as file:
-        current_date = None
-        for line in file:
-            line = line.strip()
-            if line.startswith('Date:'):
-                current_date = line.split('Date:')[1].strip()
-            elif line.startswith('Link:') and current_date:
-                link = line.split('Link:')[1].strip()
-                data.append({
-                    'timestamp': datetime.strptime(current_date, '%Y-%m-%d %H:%M:%S'),
-                    'link': link
-                })
-    return pd.DataFrame(data)
-
-def parse_login_history(file_path):
-    """Parse TikTok login history from txt file."""
-    data = []
-    with open(file_path, 'r', encoding='utf-8') as file:
-        current_date = None
-        for line in file:
-            line = line.strip()
-            if line.startswith('Date:'):
-                current_date = line.split('Date:')[1].strip()
-            elif line.startswith('Device Model:') and current_date:
-                device = line.split('Device Model:')[1].strip()
-                data.append({
-                    'timestamp': datetime.strptime(current_date, '%Y-%m-%d %H:%M:%S'),
-                    'device': device
-                })
-    return pd.DataFrame(data)
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from parse_tiktok_json import CHUNK_SIZE, iter_json_arrays
+from storage import ACTIVITY_SCHEMA, FORMATS, append_table, export_csv, save_table, table_path
+
+BLOCK_SIZE = 64 * 1024 * 1024
+SPLIT_SIZE = 16 * 1024 * 1024
+WATERMARKS_FILE = 'watermarks.json'
+VIDEO_ID_PATTERN = r'/video/(\d+)'
+VIDEO_LINK_TEMPLATE = 'https://www.tiktokv.com/share/video/{}/'
+
+# Record layout of every activity type in the .txt and the user_data.json exports;
+# `video_ids` marks types whose links point at videos
+ACTIVITY_TYPES = {
+    'browsing_history': {
+        'txt_file': 'browsing_history.txt',
+        'field': 'Link',
+        'column': 'link',
+        'json_path': ('Activity', 'Video Browsing History', 'VideoList'),
+        'json_field': 'Link',
+        'video_ids': True
+    },
+    'favorite_sounds': {
+        'txt_file': 'favorite_sounds.txt',
+        'field': 'Sound Link',
+        'column': 'link',
+        'json_path': ('Activity', 'Favorite Sounds', 'FavoriteSoundList'),
+        'json_field': 'Link',
+        'video_ids': False
+    },
+    'favorite_videos': {
+        'txt_file': 'favorite_videos.txt',
+        'field': 'Link',
+        'column': 'link',
+        'json_path': ('Activity', 'Favorite Videos', 'FavoriteVideoList'),
+        'json_field': 'Link',
+        'video_ids': True
+    },
+    'like_list': {
+        'txt_file': 'like_list.txt',
+        'field': 'Link',
+        'column': 'link',
+        'json_path': ('Activity', 'Like List', 'ItemFavoriteList'),
+        'json_field': 'Link',
+        'video_ids': True
+    },
+    'share_history': {
+        'txt_file': 'share_history.txt',
+        'field': 'Link',
+        'column': 'link',
+        'json_path': ('Activity', 'Share History', 'ShareHistoryList'),
+        'json_field': 'Link',
+        'video_ids': True
+    },
+    'login_history': {
+        'txt_file': 'login_history.txt',
+        'field': 'Device Model',
+        'column': 'device',
+        'json_path': ('Activity', 'Login History', 'LoginHistoryList'),
+        'json_field': 'DeviceModel',
+        'video_ids': False
+    }
+}
+
+def _iter_blocks(file_path, start=0, end=None, block_size=BLOCK_SIZE):
+    """Read a byte range of a file in large blocks that always end on a line boundary."""
+    with open(file_path, 'rb') as file:
+        file.seek(start)
+        remaining = float('inf') if end is None else end - start
+        remainder = b''
+        while remaining > 0:
+            chunk = file.read(int(min(block_size, remaining)))
+            remaining -= len(chunk)
+            if not chunk:
+                break
+            chunk = remainder + chunk
+            cut = chunk.rfind(b'\n') + 1
+            if cut == 0:
+                remainder = chunk
+                continue
+            remainder = chunk[cut:]
+            yield chunk[:cut]
+        if remainder:
+            yield remainder
+
+def _strip_prefix(values, length):
+    """Drop the first `length` bytes of every fixed-width bytes value."""
+    width = values.dtype.itemsize
+    if width <= length:
+        return np.zeros(len(values), dtype='S1')
+    matrix = values.view(np.uint8).reshape(len(values), width)[:, length:]
+    return np.ascontiguousarray(matrix).view(f'S{width - length}').ravel()
+
+def _decode(values):
+    """Decode bytes values to str, using the fast path for plain ASCII."""
+    try:
+        return values.astype('U').astype(object)
+    except UnicodeDecodeError:
+        return np.char.decode(values, 'utf-8').astype(object)
+
+def _scan_block(block, prefix, carried_date):
+    """Pair every field line of a block with the closest preceding `Date:` line."""
+    lines = np.char.strip(np.array(block.split(b'\n')))
+    is_date = np.char.startswith(lines, b'Date:')
+    is_field = np.char.startswith(lines, prefix)
+
+    # Forward-fill the position of the last seen date onto every line
+    positions = np.arange(len(lines))
+    last_date = np.maximum.accumulate(np.where(is_date, positions, -1))
+
+    date_lines = lines[last_date[is_field & (last_date >= 0)]]
+    if carried_date is not None:
+        # Field lines before the first date of this block belong to the previous one
+        leading = np.count_nonzero(is_field & (last_date < 0))
+        date_lines = np.concatenate([np.full(leading, carried_date), date_lines])
+        field_lines = lines[is_field]
+    else:
+        field_lines = lines[is_field & (last_date >= 0)]
+
+    if is_date.any():
+        carried_date = lines[positions[is_date][-1]]
+    return date_lines, field_lines, carried_date
+
+def parse_records(file_path, field, column, start=0, end=None):
+    """Bulk-parse every `Date:`/`<field>:` pair of a TikTok export into a DataFrame.
+
+    `start` and `end` restrict parsing to a byte range, which must begin on a
+    record boundary (see `split_byte_ranges`).
+    """
+    prefix = f'{field}:'.encode()
+    date_parts, field_parts = [], []
+    carried_date = None
+    for block in _iter_blocks(file_path, start, end):
+        date_lines, field_lines, carried_date = _scan_block(block, prefix, carried_date)
+        date_parts.append(date_lines)
+        field_parts.append(field_lines)
+
+    if not date_parts or not sum(len(part) for part in date_parts):
+        return _records_frame(np.array([], dtype='S19'), np.array([], dtype=object), column)
+
+    dates = np.char.strip(_strip_prefix(np.concatenate(date_parts), len(b'Date:')))
+    values = np.char.strip(_strip_prefix(np.concatenate(field_parts), len(prefix)))
+    return _records_frame(dates, _decode(values), column)
+
+def _records_frame(dates, values, column):
+    """Build a records DataFrame, converting all timestamps in a single vectorized pass."""
+    timestamps = np.asarray(dates).astype('datetime64[s]').astype('datetime64[ns]')
+    return pd.DataFrame({'timestamp': timestamps, column: np.asarray(values, dtype=object)})
+
+def _next_record_start(file, offset, window_size=1024 * 1024):
+    """Return the offset of the first `Date:` line starting after `offset`."""
+    marker = b'\nDate:'
+    file.seek(offset)
+    window = b''
+    window_start = offset
+    while True:
+        chunk = file.read(window_size)
+        if not chunk:
+            return None
+        window += chunk
+        found = window.find(marker)
+        if found >= 0:
+            return window_start + found + 1
+        # Keep a short tail so a marker spanning two reads is still found
+        keep = len(marker) - 1
+        window_start += len(window) - keep
+        window = window[-keep:]
+
+def split_byte_ranges(file_path, part_size):
+    """Split a file into byte ranges of roughly `part_size` aligned on `Date:` records."""
+    file_size = os.path.getsize(file_path)
+    boundaries = [0]
+    with open(file_path, 'rb') as file:
+        offset = part_size
+        while offset < file_size:
+            record_start = _next_record_start(file, offset)
+            if record_start is None:
+                break
+            boundaries.append(record_start)
+            offset = record_start + part_size
+    boundaries.append(file_size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def add_video_ids(df, spec):
+    """Replace the video links with their numeric video IDs, a nullable int64 column.
+
+    The links only differ in the ID, so keeping them would store every ID
+    twice, once as a long string; `add_video_links` rebuilds them.
+    """
+    if spec['video_ids']:
+        ids = df[spec['column']].str.extract(VIDEO_ID_PATTERN, expand=False)
+        df['video_id'] = pd.to_numeric(ids, errors='coerce').astype('Int64')
+        df = df.drop(columns=spec['column'])
+    return df
+
+def add_video_links(df):
+    """Add the share link of every video ID back, e.g. for a CSV export meant to be read by people."""
+    if 'video_id' not in df.columns or 'link' in df.columns:
+        return df
+    links = df['video_id'].map(VIDEO_LINK_TEMPLATE.format, na_action='ignore')
+    return df.assign(link=links.astype('string'))
+
+def parse_activity(activity_type, file_path, start=0, end=None):
+    """Parse one activity type from its .txt export using the registry layout."""
+    spec = ACTIVITY_TYPES[activity_type]
+    return add_video_ids(parse_records(file_path, spec['field'], spec['column'], start, end), spec)
+
+parse_browsing_history = partial(parse_activity, 'browsing_history')
+parse_favorite_sounds = partial(parse_activity, 'favorite_sounds')
+parse_favorite_videos = partial(parse_activity, 'favorite_videos')
+parse_like_list = partial(parse_activity, 'like_list')
+parse_share_history = partial(parse_activity, 'share_history')
+parse_login_history = partial(parse_activity, 'login_history')
+
+def _json_values(records, key):
+    """Read one field from a batch of JSON records; newer exports use lower-case keys."""
+    lower = key.lower()
+    return [record.get(key, record.get(lower)) for record in records]
+
+def parse_json_export(file_path, chunk_size=CHUNK_SIZE):
+    """Stream every registered activity type out of a user_data.json export.
+
+    Returns DataFrames keyed by the matching .txt file name, identical in
+    layout to the .txt parsers, without loading the whole document.
+    """
+    by_path = {spec['json_path']: name for name, spec in ACTIVITY_TYPES.items()}
+    columns = {name: ([], []) for name in ACTIVITY_TYPES}
+    for path, records in iter_json_arrays(file_path, by_path, chunk_size):
+        name = by_path[path]
+        date_parts, values = columns[name]
+        batch_dates, batch_values = [], []
+        for date, value in zip(_json_values(records, 'Date'),
+                               _json_values(records, ACTIVITY_TYPES[name]['json_field'])):
+            if date is not None:
+                batch_dates.append(date.strip())
+                batch_values.append('' if value is None else str(value).strip())
+        # Keep timestamps as compact datetime64 blocks instead of Python strings
+        date_parts.append(np.array(batch_dates, dtype='U19').astype('datetime64[s]'))
+        values.extend(batch_values)
+
+    data = {}
+    for name, spec in ACTIVITY_TYPES.items():
+        dates = np.concatenate(columns[name][0] or [np.array([], dtype='datetime64[s]')])
+        df = _records_frame(dates, columns[name][1], spec['column'])
+        data[spec['txt_file']] = add_video_ids(df, spec)
+    return data
 
 def get_date_range(data_frames):
     """Get the earliest and latest dates from all TikTok data."""
@@ -118,35 +266,179 @@ def get_date_range(data_frames):
         return min(all_dates), max(all_dates)
     return None, None
 
+def _run_parse_task(task):
+    """Parse one byte range of one export (runs inside a worker process)."""
+    parser, input_path, start, end = task
+    return parser(input_path, start, end)
+
+def parse_all(data_types, input_dir='data/tiktok_data', workers=1, split_size=SPLIT_SIZE):
+    """Parse every available export, optionally across a pool of worker processes.
+
+    Files larger than `split_size` bytes are cut into record-aligned byte
+    ranges so a single large export is spread over several workers. Partial
+    results are concatenated in file order, so the output matches a serial run.
+    """
+    tasks, task_files = [], []
+    for filename, parser in data_types.items():
+        input_path = os.path.join(input_dir, filename)
+        if not os.path.exists(input_path):
+            print(f"File not found: {input_path}")
+            continue
+        ranges = split_byte_ranges(input_path, split_size) if workers > 1 else [(0, None)]
+        for start, end in ranges:
+            tasks.append((parser, input_path, start, end))
+            task_files.append(filename)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_run_parse_task, tasks))
+    else:
+        results = [_run_parse_task(task) for task in tasks]
+
+    parts = {}
+    for filename, df in zip(task_files, results):
+        parts.setdefault(filename, []).append(df)
+    return {filename: pd.concat(dfs, ignore_index=True) if len(dfs) > 1 else dfs[0]
+            for filename, dfs in parts.items()}
+
+def _fingerprint(df):
+    """Hash the content of a set of records, independent of their order."""
+    row_hashes = np.sort(pd.util.hash_pandas_object(df, index=False).to_numpy())
+    return hashlib.sha256(row_hashes.tobytes()).hexdigest()
+
+def record_watermark(df, previous=None):
+    """Describe the newest records of a parsed export so the next run can resume after them."""
+    if df.empty:
+        return previous
+    watermark = df['timestamp'].max()
+    at_watermark = df[df['timestamp'] == watermark]
+    first = df['timestamp'].min()
+    if previous is not None:
+        first = min(first, pd.Timestamp(previous['first']))
+    return {
+        'first': str(first),
+        'watermark': str(watermark),
+        'fingerprint': _fingerprint(at_watermark),
+        'previous_watermark': previous['watermark'] if previous else None,
+        'new_rows': len(df)
+    }
+
+def load_watermarks(output_dir):
+    """Load the per-file watermarks written by the previous run."""
+    path = os.path.join(output_dir, WATERMARKS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+def save_watermarks(output_dir, watermarks):
+    """Persist the per-file watermarks for the next incremental run."""
+    with open(os.path.join(output_dir, WATERMARKS_FILE), 'w') as file:
+        json.dump(watermarks, file, indent=2)
+
+def parse_new_records(parser, input_path, entry, chunk_size=SPLIT_SIZE):
+    """Parse only the records of an export that are newer than its stored watermark.
+
+    The file is scanned from its newest end in record-aligned chunks and the
+    scan stops at the first chunk that reaches already-ingested records.
+    Returns None when the records at the watermark no longer match the stored
+    fingerprint, i.e. the export is not a superset of the previous one.
+    """
+    ranges = split_byte_ranges(input_path, chunk_size)
+    parsed = {ranges[0]: parser(input_path, *ranges[0])}
+    if ranges[-1] not in parsed:
+        parsed[ranges[-1]] = parser(input_path, *ranges[-1])
+    first_chunk, last_chunk = parsed[ranges[0]], parsed[ranges[-1]]
+    if first_chunk.empty or last_chunk.empty:
+        return None
+
+    # Exports are either newest-first (browsing history) or oldest-first (logins)
+    newest_first = first_chunk['timestamp'].iloc[0] >= last_chunk['timestamp'].iloc[-1]
+    watermark = pd.Timestamp(entry['watermark'])
+
+    parts = []
+    for byte_range in (ranges if newest_first else ranges[::-1]):
+        df = parsed[byte_range] if byte_range in parsed else parser(input_path, *byte_range)
+        parts.append(df[df['timestamp'] >= watermark])
+        if (df['timestamp'] < watermark).any():
+            break
+    if not newest_first:
+        parts.reverse()
+
+    scanned = pd.concat(parts, ignore_index=True)
+    if _fingerprint(scanned[scanned['timestamp'] == watermark]) != entry['fingerprint']:
+        return None
+    return scanned[scanned['timestamp'] > watermark].reset_index(drop=True)
+
 def main():
-    # Output directory
+    parser = argparse.ArgumentParser(description='Parse TikTok exports into CSV files.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes (1 parses serially)')
+    parser.add_argument('--split-size', type=int, default=SPLIT_SIZE,
+                        help='Split files larger than this many bytes across workers')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only parse records newer than the previous run and append them')
+    parser.add_argument('--json-export', default=None,
+                        help='Stream a user_data.json export instead of the .txt files')
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='Storage format of the processed tables')
+    parser.add_argument('--export-csv', action='store_true',
+                        help='Also write CSV copies when using a columnar format')
+    args = parser.parse_args()
+
+    # Output directories; the delta directory only holds the rows added by this run
     output_dir = 'data/processed'
-    os.makedirs(output_dir, exist_ok=True)
+    delta_dir = os.path.join(output_dir, 'delta')
+    os.makedirs(delta_dir, exist_ok=True)
     
     # Parse each data file
-    data_types = {
-        'browsing_history.txt': parse_browsing_history,
-        'favorite_sounds.txt': parse_favorite_sounds,
-        'favorite_videos.txt': parse_favorite_videos,
-        'like_list.txt': parse_like_list,
-        'share_history.txt': parse_share_history,
-        'login_history.txt': parse_login_history
-    }
+    data_types = {spec['txt_file']: partial(parse_activity, name)
+                  for name, spec in ACTIVITY_TYPES.items()}
     
-    all_data = {}
-    for filename, parser in data_types.items():
+    incremental = args.incremental and not args.json_export
+    watermarks = load_watermarks(output_dir) if incremental else {}
+    full_types = {}
+    new_data = {}
+    for filename, parser_func in data_types.items():
         input_path = os.path.join('data/tiktok_data', filename)
-        if os.path.exists(input_path):
-            df = parser(input_path)
-            output_path = os.path.join(output_dir, f"{filename.replace('.txt', '.csv')}")
-            df.to_csv(output_path, index=False)
-            all_data[filename] = df
-            print(f"Processed {filename} -> {output_path}")
-        else:
-            print(f"File not found: {input_path}")
+        output_path = table_path(os.path.join(output_dir, filename), args.format)
+        entry = watermarks.get(filename)
+        if entry is None or not os.path.exists(input_path) or not os.path.exists(output_path):
+            full_types[filename] = parser_func
+            continue
+        df = parse_new_records(parser_func, input_path, entry, args.split_size)
+        if df is None:
+            print(f"{filename} changed before its watermark, re-parsing in full")
+            full_types[filename] = parser_func
+            continue
+        append_table(df, output_path, args.format, ACTIVITY_SCHEMA)
+        new_data[filename] = df
+        watermarks[filename] = record_watermark(df, entry) if not df.empty else dict(entry, new_rows=0)
+        print(f"Appended {len(df):,} new rows from {filename} -> {output_path}")
+
+    if args.json_export:
+        all_data = parse_json_export(args.json_export)
+    else:
+        all_data = parse_all(full_types, workers=args.workers, split_size=args.split_size)
+    for filename, df in all_data.items():
+        output_path = save_table(df, os.path.join(output_dir, filename), args.format, ACTIVITY_SCHEMA)
+        if args.export_csv and args.format != 'csv':
+            export_csv(add_video_links(df), output_path)
+        new_data[filename] = df
+        watermarks[filename] = record_watermark(df)
+        print(f"Processed {filename} -> {output_path}")
+    save_watermarks(output_dir, watermarks)
+
+    # Later stages can pick up just the rows added by this run from the delta directory
+    for filename, df in new_data.items():
+        save_table(df, os.path.join(delta_dir, filename), args.format, ACTIVITY_SCHEMA)
+    delta_start, delta_end = get_date_range(new_data)
+    pd.DataFrame({'start_date': [delta_start], 'end_date': [delta_end]}).to_csv(
+        os.path.join(delta_dir, 'date_range.csv'), index=False)
     
     # Get and save date range
-    start_date, end_date = get_date_range(all_data)
+    start_date = min((pd.Timestamp(entry['first']) for entry in watermarks.values() if entry), default=None)
+    end_date = max((pd.Timestamp(entry['watermark']) for entry in watermarks.values() if entry), default=None)
     if start_date and end_date:
         date_range_df = pd.DataFrame({
             'start_date': [start_date],
@@ -156,4 +448,4 @@ def main():
         print(f"\nData range: {start_date} to {end_date}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main() 
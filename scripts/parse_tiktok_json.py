@@ -0,0 +1,164 @@
+import json
+import re
+
+CHUNK_SIZE = 1024 * 1024
+
+TOKEN = re.compile(r'\s*(?:([{}\[\],:])|"((?:[^"\\]|\\.)*)"|([^\s{}\[\],:"]+))')
+WHITESPACE = re.compile(r'\s*')
+
+class _TextStream:
+    """Sliding window over a text file that only keeps unconsumed characters."""
+
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Drop consumed characters and read the next chunk; False at end of file."""
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+        return bool(chunk)
+
+    def next_token(self):
+        """Return the next (punctuation, string, literal) token, or None at end of file."""
+        while True:
+            match = TOKEN.match(self.buffer, self.pos)
+            # A token touching the end of the buffer may continue in the next chunk
+            if match and (match.end() < len(self.buffer) or self.eof):
+                self.pos = match.end()
+                return match.groups()
+            if not self.fill():
+                if match:
+                    self.pos = match.end()
+                    return match.groups()
+                if self.buffer[self.pos:].strip():
+                    raise ValueError(f"Invalid JSON near: {self.buffer[self.pos:self.pos + 40]!r}")
+                return None
+
+    def peek_char(self):
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return None
+
+    def skip_value(self):
+        """Skip the rest of a container whose opening bracket was just consumed."""
+        depth = 1
+        while depth:
+            token = self.next_token()
+            if token is None:
+                raise ValueError("Unexpected end of JSON document")
+            if token[0] in ('{', '['):
+                depth += 1
+            elif token[0] in ('}', ']'):
+                depth -= 1
+
+    def decode_value(self, decoder):
+        """Decode one complete JSON value starting at the current position."""
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            self.pos = end
+            return value
+
+    def decode_batch(self):
+        """Decode a run of complete array elements in a single call, or return None.
+
+        The run ends at a `},` in the buffer. If the cut does not fall between
+        two elements of the current array (for example because the array ends
+        earlier in the buffer) the slice is not valid JSON, so the run is halved
+        until it decodes.
+        """
+        limit = len(self.buffer)
+        while True:
+            cut = self.buffer.rfind('},', self.pos, limit)
+            if cut < 0:
+                return None
+            try:
+                values = json.loads('[' + self.buffer[self.pos:cut + 1] + ']')
+            except json.JSONDecodeError:
+                limit = self.pos + (cut - self.pos) // 2
+                continue
+            self.pos = cut + 2
+            return values
+
+def iter_json_arrays(file_path, paths, chunk_size=CHUNK_SIZE):
+    """Stream the elements of the arrays found at `paths` in a JSON document.
+
+    `paths` is a collection of key tuples such as
+    ('Activity', 'Video Browsing History', 'VideoList'). Yields (path, elements)
+    batches in document order. Only about one chunk of the document is decoded
+    at a time, so memory stays bounded by the chunk size instead of the
+    document size.
+    """
+    paths = {tuple(path) for path in paths}
+    prefixes = {path[:i] for path in paths for i in range(len(path) + 1)}
+    decoder = json.JSONDecoder()
+
+    with open(file_path, 'r', encoding='utf-8') as file:
+        stream = _TextStream(file, chunk_size)
+        # Each frame holds the container type and the key path leading to it
+        stack = []
+        key_path = ()
+        pending_key = None
+        expecting_key = False
+
+        while True:
+            if stack and stack[-1] == '[' and key_path in paths:
+                # Target array: decode whole runs of elements, or one at a time near its end
+                char = stream.peek_char()
+                if char == ']':
+                    stream.next_token()
+                    stack.pop()
+                    key_path = key_path[:-1]
+                    continue
+                if char == ',':
+                    stream.next_token()
+                    continue
+                batch = stream.decode_batch()
+                yield key_path, batch if batch else [stream.decode_value(decoder)]
+                continue
+
+            token = stream.next_token()
+            if token is None:
+                break
+            punctuation, string, literal = token
+
+            if punctuation in ('{', '['):
+                child_path = key_path + (pending_key,) if stack and stack[-1] == '{' else key_path
+                if stack and child_path not in prefixes:
+                    # Nothing of interest below this value, skip it token by token
+                    stream.skip_value()
+                    pending_key = None
+                    continue
+                stack.append(punctuation)
+                key_path = child_path
+                expecting_key = punctuation == '{'
+                pending_key = None
+            elif punctuation in ('}', ']'):
+                stack.pop()
+                if stack and stack[-1] == '{':
+                    key_path = key_path[:-1]
+                expecting_key = False
+            elif punctuation == ',':
+                expecting_key = bool(stack) and stack[-1] == '{'
+            elif punctuation == ':':
+                expecting_key = False
+            elif string is not None and expecting_key:
+                pending_key = json.loads(f'"{string}"')
+            else:
+                pending_key = None
@@ -0,0 +1,282 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import time
+
+# Heavy modules (pandas, matplotlib, the stage scripts) are imported inside the
+# stages, so a run where every stage is up to date only stats files and hashes.
+
+CACHE_DIR = 'data/pipeline_cache'
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class Stage:
+    """One step of the pipeline.
+
+    `run(inputs, args)` receives the outputs of `deps` by name and returns the
+    stage output, which is kept in memory for later stages. `write(output,
+    args)` writes the stage's artifacts and only runs when requested.
+    `sources` are the scripts whose code the output depends on, `inputs` a
+    function returning the files it reads, and `params` the argument names it
+    uses; all of them are part of the stage fingerprint.
+    """
+
+    def __init__(self, name, run, deps=(), sources=(), inputs=None, params=(), write=None):
+        self.name = name
+        self.run = run
+        self.deps = list(deps)
+        self.sources = list(sources)
+        self.inputs = inputs or (lambda args: [])
+        self.params = list(params)
+        self.write = write
+
+def _file_signature(path):
+    """Size and modification time of a file, or of every file below a directory."""
+    if os.path.isdir(path):
+        return {os.path.relpath(os.path.join(root, name), path): _file_signature(os.path.join(root, name))
+                for root, _, names in sorted(os.walk(path)) for name in sorted(names)}
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def _source_hash(sources):
+    digest = hashlib.sha256()
+    for source in sources:
+        with open(os.path.join(SCRIPTS_DIR, source), 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+class Pipeline:
+    """Runs stages in dependency order and skips the ones whose fingerprint did not change.
+
+    Outputs are handed to later stages in memory. Each stage output is also
+    pickled to the cache directory, so a later run can skip the stage and load
+    the output only if a downstream stage needs it.
+    """
+
+    def __init__(self, stages, cache_dir=CACHE_DIR):
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache_dir = cache_dir
+        self.state_path = os.path.join(cache_dir, 'state.json')
+        self.outputs = {}
+
+    def order(self, targets):
+        """Stages needed for `targets`, each after its dependencies."""
+        ordered = []
+        def visit(name):
+            if name not in ordered:
+                for dep in self.stages[name].deps:
+                    visit(dep)
+                ordered.append(name)
+        for target in targets:
+            visit(target)
+        return ordered
+
+    def fingerprint(self, stage, args, keys):
+        description = {
+            'stage': stage.name,
+            'code': _source_hash(stage.sources),
+            'params': {param: getattr(args, param) for param in stage.params},
+            'inputs': {path: _file_signature(path) for path in stage.inputs(args)},
+            'deps': {dep: keys[dep] for dep in stage.deps}
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _output_path(self, name):
+        return os.path.join(self.cache_dir, f'{name}.pkl')
+
+    def output(self, name):
+        """Output of a stage, loaded from the cache if it was skipped in this run."""
+        if name not in self.outputs:
+            with open(self._output_path(name), 'rb') as file:
+                self.outputs[name] = pickle.load(file)
+        return self.outputs[name]
+
+    def run(self, targets, args, write=(), force=False):
+        """Run the stages needed for `targets`; returns {stage: 'ran' | 'skipped'}."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as file:
+                state = json.load(file)
+
+        keys, report = {}, {}
+        for name in self.order(targets):
+            stage = self.stages[name]
+            keys[name] = self.fingerprint(stage, args, keys)
+            begin = time.perf_counter()
+            if not force and state.get(name) == keys[name] and os.path.exists(self._output_path(name)):
+                report[name] = 'skipped'
+            else:
+                output = stage.run({dep: self.output(dep) for dep in stage.deps}, args)
+                self.outputs[name] = output
+                with open(self._output_path(name), 'wb') as file:
+                    pickle.dump(output, file, protocol=pickle.HIGHEST_PROTOCOL)
+                state[name] = keys[name]
+                # Save after every stage so an interrupted run keeps its finished stages
+                with open(self.state_path, 'w') as file:
+                    json.dump(state, file, indent=2)
+                report[name] = 'ran'
+
+            if stage.write and (name in write or 'all' in write):
+                stage.write(self.output(name), args)
+            print(f"{name:<10} {report[name]:<8} {time.perf_counter() - begin:6.2f}s")
+        return report
+
+def run_parse(inputs, args):
+    from functools import partial
+    from parse_tiktok_data import ACTIVITY_TYPES, parse_activity, parse_all
+    data_types = {spec['txt_file']: partial(parse_activity, name) for name, spec in ACTIVITY_TYPES.items()}
+    parsed = parse_all(data_types, args.input_dir, workers=args.workers)
+    return {os.path.splitext(filename)[0]: df for filename, df in parsed.items()}
+
+def write_parse(tiktok_data, args):
+    import pandas as pd
+    from parse_tiktok_data import get_date_range, record_watermark, save_watermarks
+    from storage import ACTIVITY_SCHEMA, save_table
+    output_dir = 'data/processed'
+    os.makedirs(output_dir, exist_ok=True)
+    for name, df in tiktok_data.items():
+        save_table(df, os.path.join(output_dir, name), args.format, ACTIVITY_SCHEMA)
+    save_watermarks(output_dir, {f'{name}.txt': record_watermark(df) for name, df in tiktok_data.items()})
+    start_date, end_date = get_date_range(tiktok_data)
+    pd.DataFrame({'start_date': [start_date], 'end_date': [end_date]}).to_csv(
+        os.path.join(output_dir, 'date_range.csv'), index=False)
+
+def run_weather(inputs, args):
+    from fetch_weather_data import WeatherDataFetcher, fetch_location_weather, plan_location_ranges
+    from locations import load_location_timeline, load_locations
+    from parse_tiktok_data import get_date_range
+    tiktok_data = inputs['parse']
+    start_date, end_date = get_date_range(tiktok_data)
+    locations = load_locations()
+    fetcher = WeatherDataFetcher(base_url=args.base_url, max_workers=args.fetch_workers,
+                                 variables=args.variables.split(','), locations=locations)
+    location_ranges = plan_location_ranges(start_date, end_date, locations,
+                                           tiktok_data if args.sparse else None,
+                                           load_location_timeline(), args.padding_days)
+    return fetch_location_weather(fetcher, location_ranges)
+
+def write_weather(frames, args):
+    from fetch_weather_data import save_location_weather
+    save_location_weather(frames, 'data/weather_data', args.format)
+
+def run_merge(inputs, args):
+    from aggregation_cube import AggregationCube
+    from locations import load_location_timeline, load_locations
+    from merge_data import build_merged_dataset, combine_weather
+    from running_stats import RunningStatistics
+    merged = build_merged_dataset(inputs['parse'], combine_weather(inputs['weather']), args.resolution,
+                                  args.tolerance, args.lookback, load_location_timeline(),
+                                  next(iter(load_locations())))
+    cube = AggregationCube.from_frame(merged)
+    return {'merged': merged, 'cube': cube, 'stats': RunningStatistics.from_frame(merged, cube)}
+
+def write_merge(output, args):
+    from merge_data import save_merged_dataset
+    save_merged_dataset(output['merged'], 'data/merged_data', args.format, cube=output['cube'],
+                        stats=output['stats'])
+
+def run_sessions(inputs, args):
+    from locations import load_location_timeline, load_locations
+    from merge_data import combine_weather
+    from sessions import add_session_weather, build_sessions
+    sessions = build_sessions(inputs['parse'], args.session_gap)
+    return add_session_weather(sessions, combine_weather(inputs['weather']), args.tolerance,
+                               load_location_timeline(), next(iter(load_locations())))
+
+def write_sessions(sessions, args):
+    from sessions import sessions_path
+    from storage import SESSION_SCHEMA, save_table
+    os.makedirs('data/merged_data', exist_ok=True)
+    save_table(sessions, sessions_path('data/merged_data/merged_data'), args.format, SESSION_SCHEMA)
+
+def run_analyze(inputs, args):
+    from analyze_data import TikTokWeatherAnalyzer
+    merge = inputs['merge']
+    return TikTokWeatherAnalyzer(df=merge['merged'], cube=merge['cube'], stats=merge['stats'],
+                                 sessions=inputs['sessions']).run_all()
+
+def write_analyze(results, args):
+    from analyze_data import save_results
+    save_results(results)
+
+def run_visualize(inputs, args):
+    # The plots are files, so they are rendered by the write step
+    return inputs['merge']
+
+def write_visualize(merge, args):
+    from visualize_data import TikTokWeatherVisualizer
+    # The render manifest skips plots whose inputs did not change and whose files still exist
+    visualizer = TikTokWeatherVisualizer(df=merge['merged'], cube=merge['cube'])
+    visualizer.create_all_visualizations(args.plot_workers)
+
+# Sources list every script a stage imports, directly or through other scripts
+STAGES = [
+    Stage('parse', run_parse,
+          sources=['parse_tiktok_data.py', 'parse_tiktok_json.py', 'storage.py'],
+          inputs=lambda args: [args.input_dir], params=['input_dir'], write=write_parse),
+    Stage('weather', run_weather, deps=['parse'],
+          sources=['fetch_weather_data.py', 'locations.py', 'merge_data.py', 'weather_join.py', 'aggregation_cube.py',
+                   'running_stats.py', 'parse_tiktok_data.py', 'parse_tiktok_json.py', 'storage.py'],
+          inputs=lambda args: ['data/locations'],
+          params=['base_url', 'variables', 'sparse', 'padding_days'], write=write_weather),
+    Stage('merge', run_merge, deps=['parse', 'weather'],
+          sources=['merge_data.py', 'weather_join.py', 'aggregation_cube.py', 'running_stats.py', 'locations.py',
+                   'parse_tiktok_data.py', 'parse_tiktok_json.py', 'storage.py'],
+          inputs=lambda args: ['data/locations'],
+          params=['resolution', 'tolerance', 'lookback'], write=write_merge),
+    Stage('sessions', run_sessions, deps=['parse', 'weather'],
+          sources=['sessions.py', 'merge_data.py', 'weather_join.py', 'aggregation_cube.py', 'running_stats.py',
+                   'locations.py', 'parse_tiktok_data.py', 'parse_tiktok_json.py', 'storage.py'],
+          inputs=lambda args: ['data/locations'],
+          params=['session_gap', 'tolerance'], write=write_sessions),
+    Stage('analyze', run_analyze, deps=['merge', 'sessions'],
+          sources=['analyze_data.py', 'aggregation_cube.py', 'running_stats.py', 'resampling.py',
+                   'cross_correlation.py', 'sessions.py', 'merge_data.py', 'weather_join.py', 'locations.py',
+                   'parse_tiktok_data.py', 'parse_tiktok_json.py', 'storage.py'],
+          write=write_analyze),
+    # Plots are the visualize stage's only output, so it runs only when targeted
+    Stage('visualize', run_visualize, deps=['merge'],
+          sources=['visualize_data.py', 'analyze_data.py', 'aggregation_cube.py', 'running_stats.py',
+                   'resampling.py', 'cross_correlation.py', 'sessions.py', 'merge_data.py', 'weather_join.py',
+                   'locations.py', 'parse_tiktok_data.py', 'parse_tiktok_json.py', 'storage.py'],
+          write=write_visualize)
+]
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the pipeline stages in memory, skipping unchanged ones.')
+    parser.add_argument('--targets', default='analyze',
+                        help='Comma-separated stages to bring up to date: parse, weather, merge, sessions, analyze, '
+                             'visualize')
+    parser.add_argument('--write', default='',
+                        help='Comma-separated stages whose artifacts to write (or "all")')
+    parser.add_argument('--force', action='store_true', help='Rerun every needed stage')
+    parser.add_argument('--format', choices=('csv', 'parquet', 'feather'), default='csv',
+                        help='Storage format of written artifacts')
+    parser.add_argument('--input-dir', default='data/tiktok_data')
+    parser.add_argument('--workers', type=int, default=1, help='Parse worker processes')
+    parser.add_argument('--fetch-workers', type=int, default=4, help='Concurrent weather requests')
+    parser.add_argument('--plot-workers', type=int, default=1, help='Plot rendering worker processes')
+    parser.add_argument('--base-url', default="https://archive-api.open-meteo.com/v1/archive")
+    parser.add_argument('--variables', default='temperature_2m,precipitation,weathercode')
+    parser.add_argument('--sparse', action='store_true')
+    parser.add_argument('--padding-days', type=int, default=1)
+    parser.add_argument('--resolution', default='h')
+    parser.add_argument('--tolerance', default='1h')
+    parser.add_argument('--lookback', default='')
+    parser.add_argument('--session-gap', default='30min', help='Inactivity that ends a session')
+    args = parser.parse_args()
+
+    begin = time.perf_counter()
+    pipeline = Pipeline(STAGES)
+    targets = [target for target in args.targets.split(',') if target]
+    write = [stage for stage in args.write.split(',') if stage]
+    report = pipeline.run(targets, args, write, args.force)
+    skipped = sum(status == 'skipped' for status in report.values())
+    print(f"Pipeline finished in {time.perf_counter() - begin:.2f}s ({skipped} of {len(report)} stages skipped)")
+
+if __name__ == "__main__":
+    main()
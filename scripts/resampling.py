@@ -0,0 +1,175 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# Every statistic is a function of sums of left[:, j] * right[:, j] over the
+# rows of a replicate. `left` holds activity-side columns and `right`
+# weather-side columns, so a permutation moves the right side against the
+# left one. The replicate sums are then window sums (bootstrap), gathered for
+# all replicates of a batch with one index matrix, or products of the permuted
+# right columns with the left ones (permutation), gathered for a chunk of
+# replicates at a time so memory stays linear in the number of rows.
+
+# Values of a permuted right column gathered at once (64 MB of float64)
+PERMUTATION_CHUNK = 2 ** 23
+
+class ResamplingEngine:
+    """Moving-block bootstrap and block-permutation replicates of additive statistics.
+
+    Hourly counts are autocorrelated, so rows are resampled in blocks of
+    `block_length` consecutive rows. Replicates are drawn in batches of
+    `batch_size`, each from its own child of the `seed` sequence, so results
+    do not depend on `workers`.
+    """
+
+    def __init__(self, replicates=10000, block_length=24, method='bootstrap', seed=None, workers=1,
+                 batch_size=200):
+        if method not in ('bootstrap', 'permutation'):
+            raise ValueError(f"Unknown resampling method: {method} (expected bootstrap or permutation)")
+        self.replicates = replicates
+        self.block_length = block_length
+        self.method = method
+        self.seed = seed
+        self.workers = workers
+        self.batch_size = batch_size
+
+    def prepare(self, left, right):
+        """Observed sums and the per-block tables the replicate sums are gathered from."""
+        n = len(left)
+        length = max(1, min(self.block_length, n))
+        if self.method == 'bootstrap':
+            products = left * right
+            cumulative = np.vstack([np.zeros((1, products.shape[1])), np.cumsum(products, axis=0)])
+            blocks = -(-n // length)
+            tail = n - (blocks - 1) * length
+            # Sums over every window of a full block and of the shorter last block
+            state = {'windows': cumulative[length:] - cumulative[:-length],
+                     'tails': cumulative[tail:] - cumulative[:-tail],
+                     'blocks': blocks}
+            return products.sum(axis=0), state
+
+        # Permutations reorder whole blocks, so the rows after the last full block are left out
+        blocks = n // length
+        left, right = left[:blocks * length], right[:blocks * length]
+        observed = (left * right).sum(axis=0)
+        constant = np.all(left == left[:1], axis=0) | np.all(right == right[:1], axis=0)
+        moved = np.flatnonzero(~constant)
+        # Statistics share right columns (e.g. the valid-row indicator), so each distinct one is permuted once
+        right, pairs = np.unique(right[:, moved], axis=1, return_inverse=True)
+        return observed, {'observed': observed, 'moved': moved, 'blocks': blocks, 'left': left[:, moved],
+                          'right': np.ascontiguousarray(right.T).reshape(-1, blocks, length),
+                          'pairs': pairs.reshape(-1)}
+
+    def draw(self, rng, size, state):
+        """Index matrix of one batch: block starts (bootstrap) or block orders (permutation), one row per replicate."""
+        if self.method == 'bootstrap':
+            return rng.integers(0, len(state['windows']), size=(size, state['blocks']))
+        return rng.permuted(np.tile(np.arange(state['blocks']), (size, 1)), axis=1)
+
+    def batch_sums(self, indices, state):
+        """Replicate sums of every column for one index matrix."""
+        if self.method == 'bootstrap':
+            return state['windows'][indices[:, :-1]].sum(axis=1) + state['tails'][indices[:, -1]]
+        sums = np.tile(state['observed'], (len(indices), 1))
+        left, moved = state['left'], state['moved']
+        chunk = max(1, PERMUTATION_CHUNK // max(len(left), 1))
+        for start in range(0, len(indices), chunk):
+            rows = indices[start:start + chunk]
+            for u, column in enumerate(state['right']):
+                # Block a of a replicate pairs the left block a with the right block rows[:, a]
+                permuted = column[rows].reshape(len(rows), -1)
+                paired = np.flatnonzero(state['pairs'] == u)
+                sums[start:start + chunk, moved[paired]] = permuted @ left[:, paired]
+        return sums
+
+    def run(self, left, right):
+        """Observed sums (m,) and replicate sums (replicates x m) of `left[:, j] * right[:, j]`."""
+        observed, state = self.prepare(np.asarray(left, dtype=np.float64), np.asarray(right, dtype=np.float64))
+        sizes = [min(self.batch_size, self.replicates - start)
+                 for start in range(0, self.replicates, self.batch_size)]
+        seeds = np.random.SeedSequence(self.seed).spawn(len(sizes))
+        if self.workers > 1 and len(sizes) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                     initargs=(self, state)) as executor:
+                batches = list(executor.map(_run_batch, seeds, sizes))
+        else:
+            batches = [self.batch_sums(self.draw(np.random.default_rng(seed), size, state), state)
+                       for seed, size in zip(seeds, sizes)]
+        return observed, np.vstack(batches) if batches else np.zeros((0, len(observed)))
+
+    def evaluate(self, statistics):
+        """Observed values and replicates of several statistics in one pass.
+
+        `statistics` maps names to `(left, right, finish)` triples as built by
+        `correlation`, `group_means` and `mean_difference`; `finish` turns
+        sums into statistic values. Returns {name: (observed, replicates)}.
+        """
+        names = list(statistics)
+        lefts = [statistics[name][0] for name in names]
+        rights = [statistics[name][1] for name in names]
+        bounds = np.cumsum([0] + [left.shape[1] for left in lefts])
+        observed, replicates = self.run(np.hstack(lefts), np.hstack(rights))
+        results = {}
+        for name, start, end in zip(names, bounds[:-1], bounds[1:]):
+            finish = statistics[name][2]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                results[name] = (finish(observed[start:end]), finish(replicates[:, start:end]))
+        return results
+
+# Engine and per-block tables of a worker process, sent once per worker
+_worker_engine = None
+_worker_state = None
+
+def _init_worker(engine, state):
+    global _worker_engine, _worker_state
+    _worker_engine, _worker_state = engine, state
+
+def _run_batch(seed, size):
+    indices = _worker_engine.draw(np.random.default_rng(seed), size, _worker_state)
+    return _worker_engine.batch_sums(indices, _worker_state)
+
+def correlation(activity, feature):
+    """Pearson r of an activity and a weather feature; rows where the feature is missing are left out."""
+    activity = np.asarray(activity, dtype=np.float64)
+    feature = np.asarray(feature, dtype=np.float64)
+    valid = (~np.isnan(feature)).astype(np.float64)
+    feature = np.nan_to_num(feature)
+    ones = np.ones(len(activity))
+    left = np.column_stack([ones, activity, ones, activity ** 2, ones, activity])
+    right = np.column_stack([valid, valid, feature, valid, feature ** 2, feature])
+
+    def finish(sums):
+        n, sum_x, sum_y, sum_xx, sum_yy, sum_xy = (sums[..., i] for i in range(6))
+        r = (n * sum_xy - sum_x * sum_y) / np.sqrt((n * sum_xx - sum_x ** 2) * (n * sum_yy - sum_y ** 2))
+        return r[..., None]
+    return left, right, finish
+
+def group_means(activity, groups, n_groups):
+    """Mean activity per group; `groups` holds codes 0..n_groups-1, negative codes belong to no group."""
+    activity = np.asarray(activity, dtype=np.float64)
+    indicators = (np.asarray(groups)[:, None] == np.arange(n_groups)).astype(np.float64)
+    left = np.hstack([np.ones((len(activity), n_groups)), np.repeat(activity[:, None], n_groups, axis=1)])
+    right = np.hstack([indicators, indicators])
+
+    def finish(sums):
+        return sums[..., n_groups:] / sums[..., :n_groups]
+    return left, right, finish
+
+def mean_difference(activity, mask):
+    """Mean activity where `mask` is true minus the mean where it is false."""
+    left, right, means = group_means(activity, np.asarray(mask).astype(np.int64), 2)
+
+    def finish(sums):
+        values = means(sums)
+        return values[..., 1:] - values[..., :1]
+    return left, right, finish
+
+def percentile_interval(replicates, confidence=0.95):
+    """Percentile bootstrap interval of every column."""
+    alpha = (1 - confidence) / 2
+    return np.nanquantile(replicates, alpha, axis=0), np.nanquantile(replicates, 1 - alpha, axis=0)
+
+def permutation_p_values(observed, replicates):
+    """Two-sided p-values: share of replicates at least as far from the null centre as the observed value."""
+    centre = np.nanmean(replicates, axis=0)
+    extreme = np.abs(replicates - centre) >= np.abs(observed - centre) - 1e-12
+    return (1 + extreme.sum(axis=0)) / (1 + len(replicates))
@@ -0,0 +1,284 @@
+import pandas as pd
+import numpy as np
+import argparse
+import os
+
+from aggregation_cube import AggregationCube
+from storage import FORMATS, MERGED_SCHEMA, load_table, save_table, table_path
+
+COMOMENT_COLUMNS = ['n', 'mean_activity', 'mean_feature', 'm2_activity', 'm2_feature', 'comoment']
+
+def histogram_width(column):
+    """Bin width of a column's histogram: tenths of a millimetre for precipitation, whole units otherwise."""
+    return 0.1 if column.startswith('precipitation') else 1.0
+
+def _merge_comoments(left, right):
+    """Chan's pairwise update of counts, means, second moments and co-moments."""
+    n_left, n_right = left['n'], right['n']
+    n = n_left + n_right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = np.where(n > 0, n_right / n, 0.0)
+        weight = np.where(n > 0, n_left * n_right / n, 0.0)
+    delta_activity = right['mean_activity'] - left['mean_activity']
+    delta_feature = right['mean_feature'] - left['mean_feature']
+    return {
+        'n': n,
+        'mean_activity': left['mean_activity'] + delta_activity * share,
+        'mean_feature': left['mean_feature'] + delta_feature * share,
+        'm2_activity': left['m2_activity'] + right['m2_activity'] + delta_activity ** 2 * weight,
+        'm2_feature': left['m2_feature'] + right['m2_feature'] + delta_feature ** 2 * weight,
+        'comoment': left['comoment'] + right['comoment'] + delta_activity * delta_feature * weight
+    }
+
+def _subtract_comoments(total, part):
+    """Inverse of `_merge_comoments`: the state of the rows of `total` that are not in `part`."""
+    n_total, n_part = total['n'], part['n']
+    n = n_total - n_part
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = np.where(n > 0, n_part / n, 0.0)
+        weight = np.where(n > 0, n * n_part / n_total, 0.0)
+    mean_activity = total['mean_activity'] - (part['mean_activity'] - total['mean_activity']) * share
+    mean_feature = total['mean_feature'] - (part['mean_feature'] - total['mean_feature']) * share
+    delta_activity = part['mean_activity'] - mean_activity
+    delta_feature = part['mean_feature'] - mean_feature
+    rest = {
+        'n': n,
+        'mean_activity': mean_activity,
+        'mean_feature': mean_feature,
+        'm2_activity': total['m2_activity'] - part['m2_activity'] - delta_activity ** 2 * weight,
+        'm2_feature': total['m2_feature'] - part['m2_feature'] - delta_feature ** 2 * weight,
+        'comoment': total['comoment'] - part['comoment'] - delta_activity * delta_feature * weight
+    }
+    # Pairs without any rows left start again from zero
+    return {name: np.where(n > 0, values, 0.0) for name, values in rest.items()}
+
+def _merge_histograms(left, right):
+    """Add two (offset, counts) histograms with the same bin width."""
+    start = min(left[0], right[0])
+    end = max(left[0] + len(left[1]), right[0] + len(right[1]))
+    counts = np.zeros(end - start, dtype=np.int64)
+    for offset, values in (left, right):
+        counts[offset - start:offset - start + len(values)] += values
+    return start, counts
+
+class RunningStatistics:
+    """Mergeable sufficient statistics of the merged hourly data.
+
+    Holds the aggregation cube (per hour, weekday, month and weather
+    condition accumulators), the co-moments of every (activity x feature)
+    pair, fixed-width histograms of every column and the set of days with
+    data. Each part of two states over different rows (other hours, or other
+    users) combines exactly, so the state is updated from a batch of new rows,
+    or built per partition and merged, without touching earlier rows. Its
+    size depends on the number of columns, conditions and days, not on the
+    number of hours.
+    """
+
+    def __init__(self, cube, activities, features, comoments, histograms, days):
+        self.cube = cube
+        self.activities = list(activities)
+        self.features = list(features)
+        # Arrays of shape (activities, features), one per entry of COMOMENT_COLUMNS
+        self.comoments = comoments
+        # column -> (index of the first bin, counts); bin i covers [i * width, (i + 1) * width)
+        self.histograms = histograms
+        # Sorted day numbers (days since 1970-01-01) with at least one row
+        self.days = days
+
+    @classmethod
+    def from_frame(cls, df, cube=None):
+        """Statistics of a batch of merged rows; `cube` reuses an aggregation cube already built from them."""
+        cube = cube if cube is not None else AggregationCube.from_frame(df)
+        activities = [col for col in df.columns if col.endswith('_count')] + ['total_activity']
+        features = [col for col in df.columns if col not in activities and
+                    (pd.api.types.is_numeric_dtype(df[col]) or pd.api.types.is_bool_dtype(df[col]))]
+        x = df[activities].to_numpy(dtype=np.float64)
+        y = df[features].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(y)
+        mask = valid.astype(np.float64)
+
+        # Center first so the sums stay well conditioned, then correct for the rows each feature has
+        n = np.broadcast_to(mask.sum(axis=0), (len(activities), len(features))).copy()
+        mean_x = x.mean(axis=0) if len(x) else np.zeros(len(activities))
+        x = x - mean_x
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_y = np.where(n[0] > 0, (np.where(valid, y, 0.0)).sum(axis=0) / n[0], 0.0)
+            y = np.where(valid, y - mean_y, 0.0)
+            shift_x = np.where(n > 0, (x.T @ mask) / n, 0.0)
+        comoments = {
+            'n': n,
+            'mean_activity': mean_x[:, None] + shift_x,
+            'mean_feature': np.broadcast_to(mean_y, n.shape).copy(),
+            'm2_activity': (x ** 2).T @ mask - n * shift_x ** 2,
+            'm2_feature': np.broadcast_to((y ** 2).sum(axis=0), n.shape).copy(),
+            # The centered feature sums to zero over its rows, so no correction term is needed
+            'comoment': x.T @ y
+        }
+
+        histograms = {}
+        for column in activities + features:
+            values = df[column].to_numpy(dtype=np.float64)
+            values = values[~np.isnan(values)]
+            if len(values) == 0:
+                continue
+            # The small offset keeps values stored with one decimal in their own bin
+            bins = np.floor(values / histogram_width(column) + 1e-6).astype(np.int64)
+            histograms[column] = (int(bins.min()), np.bincount(bins - bins.min()))
+
+        days = np.unique(df['timestamp'].to_numpy(dtype='datetime64[D]').astype(np.int64))
+        return cls(cube, activities, features, comoments, histograms, days)
+
+    def _expand_comoments(self, activities, features):
+        rows = [activities.index(activity) for activity in self.activities]
+        columns = [features.index(feature) for feature in self.features]
+        expanded = {}
+        for name in COMOMENT_COLUMNS:
+            values = np.zeros((len(activities), len(features)))
+            values[np.ix_(rows, columns)] = self.comoments[name]
+            expanded[name] = values
+        return expanded
+
+    def merge(self, other):
+        """Statistics of the rows of both states; the two must not contain the same rows."""
+        activities = self.activities + [col for col in other.activities if col not in self.activities]
+        features = self.features + [col for col in other.features if col not in self.features]
+        comoments = _merge_comoments(self._expand_comoments(activities, features),
+                                     other._expand_comoments(activities, features))
+        histograms = dict(self.histograms)
+        for column, histogram in other.histograms.items():
+            histograms[column] = (_merge_histograms(histograms[column], histogram) if column in histograms
+                                  else histogram)
+        return RunningStatistics(self.cube.merge(other.cube), activities, features, comoments, histograms,
+                                 np.union1d(self.days, other.days))
+
+    def subtract(self, other):
+        """Statistics without the rows of `other`, which must have been merged into this state.
+
+        The days are kept, so this is for replacing rows with new rows of the
+        same buckets, e.g. a bucket merged again after more of its events arrived.
+        """
+        comoments = _subtract_comoments(self.comoments, other._expand_comoments(self.activities, self.features))
+        histograms = dict(self.histograms)
+        for column, (offset, values) in other.histograms.items():
+            start, counts = histograms[column]
+            counts = counts.copy()
+            counts[offset - start:offset - start + len(values)] -= values
+            histograms[column] = (start, counts)
+        return RunningStatistics(self.cube.subtract(other.cube), self.activities, self.features, comoments,
+                                 histograms, self.days)
+
+    def update(self, df):
+        """Statistics after adding a batch of new merged rows."""
+        return self.merge(RunningStatistics.from_frame(df))
+
+    @property
+    def total_days(self):
+        return len(self.days)
+
+    def correlation(self, activity, features):
+        """Pearson r and pair sizes of one activity with each of `features`."""
+        row = self.activities.index(activity)
+        columns = [self.features.index(feature) for feature in features]
+        n = self.comoments['n'][row, columns]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = self.comoments['comoment'][row, columns] / np.sqrt(
+                self.comoments['m2_activity'][row, columns] * self.comoments['m2_feature'][row, columns])
+        return np.clip(r, -1, 1), n
+
+    def covariance(self, activity, feature):
+        """Sample covariance of an activity and a feature over the rows where the feature is present."""
+        row, column = self.activities.index(activity), self.features.index(feature)
+        n = self.comoments['n'][row, column]
+        return self.comoments['comoment'][row, column] / (n - 1) if n > 1 else np.nan
+
+    def histogram(self, column):
+        """Row counts per bin of a column, indexed by the lower edge of the bin."""
+        offset, counts = self.histograms[column]
+        edges = (offset + np.arange(len(counts))) * histogram_width(column)
+        return pd.Series(counts, index=np.round(edges, 6), name=column)
+
+    def quantile(self, column, q):
+        """Lower edge of the histogram bin holding the `q` quantile of a column (exact for counts)."""
+        offset, counts = self.histograms[column]
+        cumulative = np.cumsum(counts)
+        i = int(np.searchsorted(cumulative, q * cumulative[-1]))
+        return (offset + min(i, len(counts) - 1)) * histogram_width(column)
+
+    def save(self, path, fmt='csv'):
+        """Write the state as a directory of tables; returns the directory."""
+        os.makedirs(path, exist_ok=True)
+        self.cube.save(os.path.join(path, 'cube'), fmt)
+        activity, feature = np.meshgrid(self.activities, self.features, indexing='ij')
+        comoments = pd.DataFrame({'activity': activity.ravel(), 'feature': feature.ravel(),
+                                  **{name: self.comoments[name].ravel() for name in COMOMENT_COLUMNS}})
+        save_table(comoments, os.path.join(path, 'comoments'), fmt)
+        histograms = pd.concat([pd.DataFrame({'column': column, 'bin': offset + np.flatnonzero(counts),
+                                              'count': counts[counts > 0]})
+                                for column, (offset, counts) in self.histograms.items()], ignore_index=True)
+        save_table(histograms, os.path.join(path, 'histograms'), fmt)
+        save_table(pd.DataFrame({'date': self.days.astype('datetime64[D]').astype('datetime64[ns]')}),
+                   os.path.join(path, 'days'), fmt)
+        return path
+
+    @classmethod
+    def load(cls, path, fmt='csv'):
+        cube = AggregationCube.load(os.path.join(path, 'cube'), fmt)
+        table = load_table(os.path.join(path, 'comoments'), fmt)
+        activities = list(pd.unique(table['activity']))
+        features = list(pd.unique(table['feature']))
+        shape = (len(activities), len(features))
+        comoments = {name: table[name].to_numpy(dtype=np.float64).reshape(shape) for name in COMOMENT_COLUMNS}
+
+        histograms = {}
+        for column, rows in load_table(os.path.join(path, 'histograms'), fmt).groupby('column', sort=False):
+            bins = rows['bin'].to_numpy(dtype=np.int64)
+            counts = np.zeros(bins.max() - bins.min() + 1, dtype=np.int64)
+            counts[bins - bins.min()] = rows['count'].to_numpy()
+            histograms[column] = (int(bins.min()), counts)
+
+        dates = load_table(os.path.join(path, 'days'), fmt, {'date': 'datetime64[ns]'})['date']
+        days = dates.to_numpy(dtype='datetime64[D]').astype(np.int64)
+        return cls(cube, activities, features, comoments, histograms, days)
+
+def stats_path(data_path):
+    """Location of the running statistics persisted next to a merged data table."""
+    return os.path.join(os.path.dirname(data_path), 'running_stats')
+
+def load_running_stats(data_path, fmt='csv'):
+    """Load the persisted running statistics, or None when they are missing or older than the data."""
+    path = stats_path(data_path)
+    cube_file = table_path(os.path.join(path, 'cube'), fmt)
+    data_file = table_path(data_path, fmt)
+    if os.path.exists(cube_file) and (not os.path.exists(data_file)
+                                      or os.path.getmtime(cube_file) >= os.path.getmtime(data_file)):
+        return RunningStatistics.load(path, fmt)
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Build, update or combine the running statistics of the merged data.')
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='Storage format of the merged data and the statistics')
+    parser.add_argument('--update', metavar='TABLE',
+                        help='Add the rows of a merged table of new hours to the persisted statistics')
+    parser.add_argument('--combine', nargs='+', metavar='DIR',
+                        help='Merge the statistics of several partitions into the persisted statistics')
+    args = parser.parse_args()
+
+    data_path = 'data/merged_data/merged_data'
+    path = stats_path(data_path)
+    if args.update:
+        state = RunningStatistics.load(path, args.format)
+        state = state.update(load_table(args.update, args.format, MERGED_SCHEMA))
+    elif args.combine:
+        partitions = [RunningStatistics.load(directory, args.format) for directory in args.combine]
+        state = partitions[0]
+        for partition in partitions[1:]:
+            state = state.merge(partition)
+    else:
+        state = RunningStatistics.from_frame(load_table(data_path, args.format, MERGED_SCHEMA))
+    state.save(path, args.format)
+    print(f"Running statistics of {int(state.cube.count.sum())} hours over {state.total_days} days "
+          f"saved to {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import pandas as pd
+import numpy as np
+import argparse
+import os
+
+from locations import load_location_timeline, load_locations
+from merge_data import join_weather, load_tiktok_data, load_weather_data
+from storage import FORMATS, SESSION_SCHEMA, load_table, save_table, table_path
+
+# Events that keep a session going
+SESSION_TYPES = ['browsing_history', 'login_history']
+
+# Session table column -> activity type counted per session
+SESSION_COUNTS = {
+    'videos_viewed': 'browsing_history',
+    'logins': 'login_history',
+    'likes': 'like_list',
+    'shares': 'share_history'
+}
+
+def sorted_times(df):
+    """Event timestamps of an activity table as sorted int64 nanoseconds, without missing ones."""
+    values = df['timestamp'].to_numpy(dtype='datetime64[ns]')
+    return np.sort(values[~np.isnat(values)].astype(np.int64))
+
+def split_sessions(times, gap):
+    """Start and end of every session of sorted int64 `times`.
+
+    A new session starts wherever the time since the previous event is
+    larger than `gap`; both are found from one diff over all events.
+    """
+    if not len(times):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(times) > gap)
+    starts = times[np.concatenate([[0], breaks + 1])]
+    ends = times[np.concatenate([breaks, [len(times) - 1]])]
+    return starts, ends
+
+def count_between(times, starts, limits):
+    """Number of sorted `times` in [starts[i], limits[i]] for every session."""
+    return np.searchsorted(times, limits, side='right') - np.searchsorted(times, starts, side='left')
+
+def build_sessions(tiktok_data, gap='30min'):
+    """Session table of browsing and login events split on inactivity gaps longer than `gap`.
+
+    Likes and shares are counted in the session they fall in or follow by at
+    most `gap`, the same rule that keeps a session going. Durations are the
+    time from the first to the last browsing or login event.
+    """
+    gap = pd.Timedelta(gap).value
+    times = {name: sorted_times(df) for name, df in tiktok_data.items()}
+    session_times = np.sort(np.concatenate([times[name] for name in SESSION_TYPES if name in times]
+                                           + [np.zeros(0, dtype=np.int64)]))
+    starts, ends = split_sessions(session_times, gap)
+
+    sessions = pd.DataFrame({
+        'start': starts.astype('datetime64[ns]'),
+        'end': ends.astype('datetime64[ns]'),
+        'duration_minutes': (ends - starts) / 60e9
+    })
+    # Every count column is present, zero when the export has no events of its type
+    for column, name in SESSION_COUNTS.items():
+        limits = ends if name in SESSION_TYPES else ends + gap
+        sessions[column] = count_between(times.get(name, np.zeros(0, dtype=np.int64)), starts, limits)
+    return sessions
+
+def add_session_weather(sessions, weather_data, tolerance='1h', timeline=None, default_location=None):
+    """Join every session to the weather at its start; sessions without recent weather are dropped."""
+    joined, dropped = join_weather(sessions.rename(columns={'start': 'timestamp'}), weather_data, tolerance,
+                                   timeline, default_location)
+    if dropped:
+        print(f"{dropped} sessions without weather within {tolerance} were dropped")
+    return joined.rename(columns={'timestamp': 'start'})
+
+def sessions_path(data_path):
+    """Location of the session table written next to a merged data table."""
+    return os.path.join(os.path.dirname(data_path), 'sessions')
+
+def load_sessions(data_path, fmt='csv'):
+    """Load the session table, or None when it has not been built."""
+    path = table_path(sessions_path(data_path), fmt)
+    return load_table(path, fmt, SESSION_SCHEMA) if os.path.exists(path) else None
+
+def main():
+    parser = argparse.ArgumentParser(description='Split browsing and login events into sessions joined to the weather.')
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='Storage format of the input and output tables')
+    parser.add_argument('--gap', default='30min',
+                        help='Inactivity that ends a session, e.g. 10min or 1h')
+    parser.add_argument('--tolerance', default='1h',
+                        help='How old the latest weather may be at the start of a session')
+    args = parser.parse_args()
+
+    tiktok_data = load_tiktok_data(fmt=args.format)
+    if not any(name in tiktok_data for name in SESSION_TYPES):
+        print("Please run parse_tiktok_data.py first to generate browsing and login history")
+        return
+
+    sessions = build_sessions(tiktok_data, args.gap)
+    sessions = add_session_weather(sessions, load_weather_data(fmt=args.format), args.tolerance,
+                                   load_location_timeline(), next(iter(load_locations())))
+    os.makedirs('data/merged_data', exist_ok=True)
+    output_path = save_table(sessions, sessions_path('data/merged_data/merged_data'), args.format, SESSION_SCHEMA)
+    print(f"{len(sessions)} sessions saved to {output_path}")
+    print(f"Median duration: {sessions['duration_minutes'].median():.1f} minutes, "
+          f"median videos viewed: {sessions['videos_viewed'].median():.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import pandas as pd
+import numpy as np
+import io
+import os
+
+FORMATS = ('csv', 'parquet', 'feather')
+
+DAYS_ORDER = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Explicit column types of every table passed between stages. Columns ending
+# in `_count` are typed by suffix because the activity types vary per export,
+# rolling weather features by prefix because their windows are configurable.
+ACTIVITY_SCHEMA = {
+    'timestamp': 'datetime64[ns]',
+    'link': 'string',
+    'video_id': 'Int64',
+    'device': 'category'
+}
+
+WEATHER_SCHEMA = {
+    'timestamp': 'datetime64[ns]',
+    'temperature': 'float32',
+    'precipitation': 'float32',
+    'weather_code': 'UInt8',
+    'relative_humidity_2m': 'float32',
+    'cloud_cover': 'float32',
+    'wind_speed_10m': 'float32',
+    'is_day': 'UInt8'
+}
+
+MERGED_SCHEMA = {
+    **WEATHER_SCHEMA,
+    'location': 'category',
+    'weather_description': 'category',
+    'hour': 'uint8',
+    'day_of_week': pd.CategoricalDtype(DAYS_ORDER, ordered=True),
+    'is_weekend': 'bool',
+    'total_activity': 'uint32',
+    '*_count': 'uint32',
+    'precipitation_sum_*': 'float32',
+    'temperature_delta_*': 'float32'
+}
+
+# One row per usage session, with the weather and time features at its start
+SESSION_SCHEMA = {
+    **{column: dtype for column, dtype in MERGED_SCHEMA.items() if column != 'timestamp'},
+    'start': 'datetime64[ns]',
+    'end': 'datetime64[ns]',
+    'duration_minutes': 'float32',
+    'videos_viewed': 'uint32',
+    'logins': 'uint32',
+    'likes': 'uint32',
+    'shares': 'uint32'
+}
+
+# Long table of the aggregation cube, one row per (cell, activity measure)
+CUBE_SCHEMA = {
+    'hour': 'uint8',
+    'day_of_week': pd.CategoricalDtype(DAYS_ORDER, ordered=True),
+    'month': 'uint8',
+    'weather_description': 'category',
+    'activity': 'category',
+    'count': 'uint32',
+    'sum': 'float64',
+    'sum_sq': 'float64'
+}
+
+def table_path(path, fmt):
+    """Return `path` with the file extension of the given storage format."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown storage format: {fmt} (expected one of {', '.join(FORMATS)})")
+    return f"{os.path.splitext(path)[0]}.{fmt}"
+
+def _column_type(column, schema):
+    """Look up a column's type, falling back to patterns such as `*_count` or `precipitation_sum_*`."""
+    if column in schema:
+        return schema[column]
+    for pattern, dtype in schema.items():
+        if pattern.startswith('*') and column.endswith(pattern[1:]):
+            return dtype
+        if pattern.endswith('*') and column.startswith(pattern[:-1]):
+            return dtype
+    return None
+
+def _check_range(values, column, dtype):
+    """Raise instead of letting a plain integer cast wrap values outside the range of `dtype`."""
+    info = np.iinfo(dtype)
+    low, high = values.min(), values.max()
+    if len(values) and (low < info.min or high > info.max):
+        raise ValueError(f"Column {column} has values in [{low}, {high}], outside the range of {dtype}")
+
+def apply_schema(df, schema):
+    """Cast the columns of `df` that appear in `schema` to their declared types."""
+    if schema is None:
+        return df
+    casts = {}
+    for column in df.columns:
+        dtype = _column_type(column, schema)
+        if dtype is None or str(df[column].dtype) == str(dtype):
+            continue
+        if str(dtype).startswith('datetime64'):
+            df[column] = pd.to_datetime(df[column])
+        elif str(dtype).startswith(('uint', 'int')) and df[column].dtype.kind == 'f':
+            # Counts become floats after outer joins and fillna
+            _check_range(df[column], column, dtype)
+            casts[column] = df[column].round().astype(dtype)
+        elif str(dtype).startswith(('uint', 'int')) and df[column].dtype.kind in 'iu':
+            _check_range(df[column], column, dtype)
+            casts[column] = df[column].astype(dtype)
+        else:
+            casts[column] = df[column].astype(dtype)
+    for column, values in casts.items():
+        df[column] = values
+    return df
+
+def save_table(df, path, fmt='csv', schema=None):
+    """Write a table in the given format and return the path it was written to."""
+    path = table_path(path, fmt)
+    df = apply_schema(df.copy(), schema) if schema is not None else df
+    if fmt == 'csv':
+        df.to_csv(path, index=False)
+    elif fmt == 'parquet':
+        df.to_parquet(path, index=False)
+    else:
+        df.reset_index(drop=True).to_feather(path)
+    return path
+
+def append_table(df, path, fmt='csv', schema=None):
+    """Append rows to an existing table; columnar formats are rewritten in full."""
+    if fmt == 'csv':
+        df.to_csv(table_path(path, fmt), mode='a', header=False, index=False)
+        return table_path(path, fmt)
+    existing = load_table(path, fmt, schema)
+    return save_table(pd.concat([existing, df], ignore_index=True), path, fmt, schema)
+
+def _last_line_offset(path, block_size=65536):
+    """Byte offset of the last line of a text file, read backwards from its end."""
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        tail = b''
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+            newline = tail.rstrip(b'\n').rfind(b'\n')
+            if newline >= 0:
+                return position + newline + 1
+    return 0
+
+def read_last_row(path, fmt='csv', schema=None):
+    """Last row of a table; a CSV is read from its end, so the cost does not grow with the table."""
+    path = table_path(path, fmt)
+    if fmt != 'csv':
+        return apply_schema(_read_table(path, fmt, None).iloc[-1:].reset_index(drop=True), schema)
+    with open(path, 'rb') as f:
+        header = f.readline()
+        f.seek(_last_line_offset(path))
+        return apply_schema(pd.read_csv(io.BytesIO(header + f.read())), schema)
+
+def drop_last_row(path, fmt='csv', schema=None):
+    """Remove the last row of a table in place; columnar formats are rewritten in full."""
+    path = table_path(path, fmt)
+    if fmt == 'csv':
+        with open(path, 'rb+') as f:
+            f.truncate(_last_line_offset(path))
+        return path
+    return save_table(load_table(path, fmt, schema).iloc[:-1], path, fmt, schema)
+
+def month_partitions(path, fmt='csv'):
+    """Paths of a table's `month=YYYY-MM/` partitions next to it, in month order."""
+    directory, filename = os.path.split(table_path(path, fmt))
+    months = sorted(name for name in os.listdir(directory) if name.startswith('month=')) \
+        if os.path.isdir(directory) else []
+    return [os.path.join(directory, month, filename) for month in months
+            if os.path.exists(os.path.join(directory, month, filename))]
+
+def _read_table(path, fmt, columns):
+    if fmt == 'csv':
+        return pd.read_csv(path, usecols=columns)
+    if fmt == 'parquet':
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_feather(path, columns=columns)
+
+def load_table(path, fmt='csv', schema=None, columns=None):
+    """Read a table written by `save_table` and apply its schema.
+
+    A table written by month (see `merge_data.merge_in_chunks`) is read by
+    concatenating its partitions.
+    """
+    path = table_path(path, fmt)
+    partitions = [] if os.path.exists(path) else month_partitions(path, fmt)
+    if partitions:
+        df = pd.concat([_read_table(partition, fmt, columns) for partition in partitions], ignore_index=True)
+    else:
+        df = _read_table(path, fmt, columns)
+    return apply_schema(df, schema)
+
+def iter_table(path, fmt='csv', schema=None, columns=None, chunk_size=1000000):
+    """Read a table written by `save_table` in chunks of at most `chunk_size` rows, applying its schema to each."""
+    path = table_path(path, fmt)
+    if fmt == 'csv':
+        chunks = pd.read_csv(path, usecols=columns, chunksize=chunk_size)
+    elif fmt == 'parquet':
+        import pyarrow.parquet as pq
+        chunks = (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(chunk_size, columns=columns))
+    else:
+        import pyarrow as pa
+        # Memory-mapped, so only the record batch being converted is read
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        chunks = (reader.get_batch(i).slice(offset, chunk_size).to_pandas()
+                  for i in range(reader.num_record_batches)
+                  for offset in range(0, reader.get_batch(i).num_rows, chunk_size))
+        if columns is not None:
+            chunks = (chunk[columns] for chunk in chunks)
+    for chunk in chunks:
+        yield apply_schema(chunk, schema)
+
+def export_csv(df, path):
+    """Additionally write a table as CSV, e.g. for sharing a columnar pipeline's results."""
+    df.to_csv(table_path(path, 'csv'), index=False)
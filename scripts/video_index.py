@@ -0,0 +1,171 @@
+import pandas as pd
+import numpy as np
+import argparse
+import os
+
+from parse_tiktok_data import ACTIVITY_TYPES, add_video_ids
+from storage import ACTIVITY_SCHEMA, FORMATS, load_table, table_path
+
+VIDEO_ACTIVITY_TYPES = ['browsing_history', 'like_list', 'favorite_videos', 'share_history']
+
+class VideoIdIndex:
+    """Events of one activity type sorted by (video_id, timestamp).
+
+    Timestamps are kept as int64 seconds, so every funnel question below is
+    answered with searchsorted/merge-style passes over sorted integer arrays
+    instead of string joins.
+    """
+
+    def __init__(self, video_ids, timestamps):
+        video_ids = np.asarray(video_ids, dtype=np.int64)
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        order = np.lexsort((timestamps, video_ids))
+        self.video_ids = video_ids[order]
+        self.timestamps = timestamps[order]
+
+        # Boundaries of each video's run of events
+        self.unique_ids, self.run_starts, self.run_counts = np.unique(
+            self.video_ids, return_index=True, return_counts=True)
+
+        # (video rank, timestamp) packed into one sorted int64 key per event
+        self.time_origin = int(self.timestamps.min()) if len(timestamps) else 0
+        self.time_span = int(self.timestamps.max()) - self.time_origin + 1 if len(timestamps) else 1
+        event_ranks = np.repeat(np.arange(len(self.unique_ids), dtype=np.int64), self.run_counts)
+        self.event_keys = event_ranks * self.time_span + (self.timestamps - self.time_origin)
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build an index from a processed activity DataFrame with a `video_id` column."""
+        df = df.dropna(subset=['video_id'])
+        timestamps = pd.to_datetime(df['timestamp']).to_numpy().astype('datetime64[s]').astype(np.int64)
+        return cls(df['video_id'].to_numpy(dtype=np.int64), timestamps)
+
+    def __len__(self):
+        return len(self.video_ids)
+
+    @property
+    def first_seen(self):
+        """Earliest timestamp of every unique video."""
+        return self.timestamps[self.run_starts]
+
+    def repeat_views(self):
+        """Number of events that repeat an already seen video."""
+        return len(self.video_ids) - len(self.unique_ids)
+
+    def intersect(self, other):
+        """Video IDs present in both indexes."""
+        return np.intersect1d(self.unique_ids, other.unique_ids, assume_unique=True)
+
+    def ranks_of(self, video_ids):
+        """Position of each video ID in `unique_ids`, or -1 for unknown videos."""
+        ranks = np.searchsorted(self.unique_ids, video_ids)
+        known = ranks < len(self.unique_ids)
+        known[known] = self.unique_ids[ranks[known]] == video_ids[known]
+        return np.where(known, ranks, -1)
+
+    def latest_before(self, video_ids, timestamps):
+        """For each (video_id, timestamp) query, the latest indexed event at or before it.
+
+        Returns an int64 array of timestamps with -1 where the video has no
+        earlier event in this index.
+        """
+        video_ids = np.asarray(video_ids, dtype=np.int64)
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        result = np.full(len(video_ids), -1, dtype=np.int64)
+        if not len(self):
+            return result
+
+        ranks = self.ranks_of(video_ids)
+        queried = (ranks >= 0) & (timestamps >= self.time_origin)
+        # Later queries see the same events as a query at the end of the indexed span
+        offsets = np.minimum(timestamps[queried] - self.time_origin, self.time_span - 1)
+        keys = ranks[queried] * self.time_span + offsets
+
+        positions = np.searchsorted(self.event_keys, keys, side='right') - 1
+        same_video = (positions >= 0) & (self.event_keys[positions] // self.time_span == ranks[queried])
+        found = np.where(same_video, self.timestamps[positions], -1)
+        result[queried] = found
+        return result
+
+def acted_after(source, target):
+    """Unique videos in `target` with an event at or after their first `source` event."""
+    ranks = source.ranks_of(target.video_ids)
+    known = ranks >= 0
+    after = np.zeros(len(target), dtype=bool)
+    after[known] = target.timestamps[known] >= source.first_seen[ranks[known]]
+    return np.unique(target.video_ids[after])
+
+def acted_within(source, target, minutes):
+    """Events in `target` that follow a `source` event of the same video within `minutes`."""
+    previous = source.latest_before(target.video_ids, target.timestamps)
+    return (previous >= 0) & (target.timestamps - previous <= minutes * 60)
+
+def build_indexes(tiktok_data):
+    """Build a VideoIdIndex for every video activity type present in `tiktok_data`."""
+    return {name: VideoIdIndex.from_frame(df) for name, df in tiktok_data.items()
+            if name in VIDEO_ACTIVITY_TYPES and 'video_id' in df.columns}
+
+def funnel_metrics(indexes, share_window_minutes=10):
+    """Compute browse -> like/favorite/share funnel metrics from the video indexes.
+
+    `<type>_after_browsed` counts the unique videos acted on after browsing
+    them; `<type>_per_browsed_video` divides it by the unique videos browsed
+    (not by browsing events), i.e. the share of browsed videos that went on.
+    """
+    browsed = indexes['browsing_history']
+    metrics = {
+        'browsing_events': len(browsed),
+        'unique_videos_browsed': len(browsed.unique_ids),
+        'repeat_views': browsed.repeat_views()
+    }
+    for name in ['like_list', 'favorite_videos', 'share_history']:
+        if name not in indexes:
+            continue
+        index = indexes[name]
+        after = acted_after(browsed, index)
+        metrics[f'{name}_unique_videos'] = len(index.unique_ids)
+        metrics[f'{name}_also_browsed'] = len(browsed.intersect(index))
+        metrics[f'{name}_after_browsed'] = len(after)
+        metrics[f'{name}_per_browsed_video'] = len(after) / max(len(browsed.unique_ids), 1)
+    if 'share_history' in indexes:
+        within = acted_within(browsed, indexes['share_history'], share_window_minutes)
+        metrics[f'shares_within_{share_window_minutes}min_of_view'] = int(within.sum())
+    return metrics
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute video funnel metrics from processed TikTok data.')
+    parser.add_argument('--share-window', type=int, default=10,
+                        help='Minutes between viewing and sharing a video to count as a funnel step')
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='Storage format of the processed tables')
+    args = parser.parse_args()
+
+    processed_dir = 'data/processed'
+    tiktok_data = {}
+    for name in VIDEO_ACTIVITY_TYPES:
+        path = os.path.join(processed_dir, name)
+        if not os.path.exists(table_path(path, args.format)):
+            continue
+        df = load_table(path, args.format, ACTIVITY_SCHEMA)
+        if 'video_id' not in df.columns and 'link' in df.columns:
+            # Tables processed before video IDs were parsed still have the links
+            df = add_video_ids(df, ACTIVITY_TYPES[name])
+        if 'video_id' not in df.columns:
+            print(f"Skipping {name}: no video IDs, please re-run parse_tiktok_data.py")
+            continue
+        tiktok_data[name] = df[['timestamp', 'video_id']]
+
+    if 'browsing_history' not in tiktok_data:
+        print("Please run parse_tiktok_data.py first to generate browsing history")
+        return
+
+    metrics = funnel_metrics(build_indexes(tiktok_data), args.share_window)
+
+    output_dir = 'data/analysis_results'
+    os.makedirs(output_dir, exist_ok=True)
+    pd.Series(metrics, name='value').to_csv(f"{output_dir}/video_funnel.csv", index_label='metric')
+    for key, value in metrics.items():
+        print(f"{key}: {value:,.3f}" if isinstance(value, float) else f"{key}: {value:,}")
+
+if __name__ == "__main__":
+    main()
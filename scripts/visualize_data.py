@@ -1,39 +1,142 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
+import argparse
+import hashlib
+import inspect
+import json
 import os
+import re
+import sys
+import time
 from calendar import month_name
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from aggregation_cube import AggregationCube, load_cube
+from storage import FORMATS, MERGED_SCHEMA, load_table
+
+# matplotlib and seaborn are imported by the plots that use them (see
+# `TikTokWeatherVisualizer.pyplot`), so rendering a few plots skips the
+# imports the others would need.
+
+# Written next to the plots, one entry per plot job
+MANIFEST_FILE = 'render_manifest.json'
+
+# Output profiles: file format, resolution, whether to crop to the drawn
+# area (an extra layout pass per figure) and the style. The preview style is
+# matplotlib's copy of the seaborn look, so it does not import seaborn.
+PROFILES = {
+    'preview': {'format': 'png', 'dpi': 72, 'tight': False, 'theme': 'seaborn-v0_8-darkgrid'},
+    'publication': {'format': 'png', 'dpi': 300, 'tight': True, 'theme': 'seaborn'},
+    'svg': {'format': 'svg', 'dpi': 300, 'tight': False, 'theme': 'seaborn'},
+    'pdf': {'format': 'pdf', 'dpi': 300, 'tight': False, 'theme': 'seaborn'}
+}
+
+# Time bins of the weather/time heatmap, finest first, and the rows per inch
+# of figure height it allows before moving to a coarser bin
+TIME_BINS = [('D', 'Date'), ('W', 'Week Starting'), ('M', 'Month')]
+TIME_ROWS_PER_INCH = 20
+# Above this many rows the heatmap is drawn as one image rather than seaborn cells
+RASTER_ROWS = 100
+
+# Weather and time features of the correlation heatmap
+CORRELATION_FEATURES = ['temperature', 'precipitation', 'weather_code', 'is_weekend', 'hour']
+
+# Style applied in this process, set on first use
+_theme = None
 
 class TikTokWeatherVisualizer:
-    def __init__(self, data_path='data/merged_data/merged_data.csv'):
-        self.df = pd.read_csv(data_path)
-        self.df['timestamp'] = pd.to_datetime(self.df['timestamp'])
-        self.df['month'] = self.df['timestamp'].dt.month
-        self.df['month_name'] = self.df['timestamp'].dt.month.map(lambda x: month_name[x])
-        self.output_dir = 'visualizations'
+    def __init__(self, data_path='data/merged_data/merged_data.csv', data_format='csv', df=None, cube=None,
+                 output_dir=None, profile='publication'):
+        # A DataFrame (and cube) passed in memory, e.g. by pipeline.py, replaces loading from disk.
+        # The shallow copy shares the column data; only the added month columns are new.
+        self.data_path = data_path
+        self.data_format = data_format
+        self._df = None if df is None else self._add_months(df.copy(deep=False))
+        if cube is None and df is None:
+            cube = load_cube(data_path, data_format)
+        self.cube = cube if cube is not None else AggregationCube.from_frame(self.df)
+        self.profile = profile
+        self._correlations = None
+        self._lagged = None
+        # Publication plots go to visualizations/, the other profiles to a subdirectory each
+        self.output_dir = output_dir or ('visualizations' if profile == 'publication'
+                                         else f'visualizations/{profile}')
         os.makedirs(self.output_dir, exist_ok=True)
-        
-        plt.style.use('default')
-        sns.set_theme()
+
+    @staticmethod
+    def _add_months(df):
+        df['month'] = df['timestamp'].dt.month
+        df['month_name'] = df['timestamp'].dt.month.map(lambda x: month_name[x])
+        return df
+
+    @property
+    def df(self):
+        """Merged data, loaded on first use: plots drawn from the cube do not need it."""
+        if self._df is None:
+            self._df = self._add_months(load_table(self.data_path, self.data_format, MERGED_SCHEMA))
+        return self._df
+
+    @property
+    def activity_cols(self):
+        return [measure for measure in self.cube.measures if measure.endswith('_count')]
+
+    def correlations(self):
+        """Correlation table of the activities and the heatmap features, computed by the analyzer."""
+        if self._correlations is None:
+            from analyze_data import TikTokWeatherAnalyzer
+            analyzer = TikTokWeatherAnalyzer(df=self.df, cube=self.cube)
+            self._correlations = analyzer.correlation_matrix(self.activity_cols, CORRELATION_FEATURES)
+        return self._correlations
+
+    def lagged_correlations(self):
+        """Lagged weather/activity correlations and their peaks, computed by the analyzer."""
+        if self._lagged is None:
+            from analyze_data import TikTokWeatherAnalyzer
+            self._lagged = TikTokWeatherAnalyzer(df=self.df, cube=self.cube).lagged_correlations()
+        return self._lagged
+
+    def pyplot(self):
+        """matplotlib.pyplot with the profile's style applied once per process."""
+        global _theme
+        import matplotlib.pyplot as plt
+        theme = PROFILES[self.profile]['theme']
+        if _theme != theme:
+            plt.style.use('default')
+            if theme == 'seaborn':
+                import seaborn as sns
+                sns.set_theme()
+            else:
+                plt.style.use(theme)
+            _theme = theme
+        return plt
+
+    def seaborn(self):
+        self.pyplot()
+        import seaborn as sns
+        return sns
+
+    def save_figure(self, fig, name):
+        """Save a figure as `name` in the profile's format and resolution."""
+        profile = PROFILES[self.profile]
+        fig.savefig(os.path.join(self.output_dir, f"{name}.{profile['format']}"), dpi=profile['dpi'],
+                    bbox_inches='tight' if profile['tight'] else None)
     
     def plot_correlation_heatmap(self):
         """Create a heatmap of correlations between activities and weather conditions."""
-        # Select activity columns
-        activity_cols = [col for col in self.df.columns if col.endswith('_count')]
-        
-        # Select weather-related columns
-        weather_cols = ['temperature', 'precipitation', 'weather_code', 'is_weekend', 'hour']
-        
-        # Calculate correlation matrix between activities and weather
-        correlation_matrix = pd.DataFrame(
-            np.corrcoef(
-                self.df[activity_cols].T,
-                self.df[weather_cols].T
-            )[:len(activity_cols), len(activity_cols):],
-            index=[col.replace('_count', '').replace('_', ' ').title() for col in activity_cols],
-            columns=[col.replace('_', ' ').title() for col in weather_cols]
-        )
+        plt = self.pyplot()
+        sns = self.seaborn()
+        correlations = self.correlations()
+        correlation_matrix = correlations.pivot(index='activity', columns='feature', values='pearson_r')
+        q_values = correlations.pivot(index='activity', columns='feature', values='pearson_q')
+        correlation_matrix = correlation_matrix.loc[self.activity_cols, CORRELATION_FEATURES]
+        q_values = q_values.loc[self.activity_cols, CORRELATION_FEATURES]
+        # Coefficients that stay significant after the multiple-testing correction are starred
+        labels = np.char.add(np.vectorize('{:.2f}'.format)(correlation_matrix.to_numpy()),
+                             np.where(q_values.to_numpy() < 0.05, '*', ''))
+        correlation_matrix.index = [col.replace('_count', '').replace('_', ' ').title()
+                                    for col in correlation_matrix.index]
+        correlation_matrix.columns = [col.replace('_', ' ').title() for col in correlation_matrix.columns]
         
         # Create figure
         fig, ax = plt.subplots(figsize=(12, 8))
@@ -41,10 +144,10 @@ class TikTokWeatherVisualizer:
         # Create heatmap
         sns.heatmap(
             correlation_matrix,
-            annot=True,
+            annot=labels,
             cmap='cool',
             center=0,
-            fmt='.2f',
+            fmt='',
             ax=ax,
             vmin=-1,
             vmax=1,
@@ -52,7 +155,7 @@ class TikTokWeatherVisualizer:
         )
         
         # Customize the plot
-        ax.set_title('Correlation between Activities and Weather Conditions')
+        ax.set_title('Correlation between Activities and Weather Conditions (* q < 0.05)')
         
         # Rotate labels for better readability
         plt.xticks(rotation=45, ha='right')
@@ -60,15 +163,13 @@ class TikTokWeatherVisualizer:
         plt.tight_layout()
         
         # Save the plot
-        plt.savefig(
-            f"{self.output_dir}/correlation_heatmap.png",
-            dpi=300,
-            bbox_inches='tight'
-        )
+        self.save_figure(fig, 'correlation_heatmap')
         plt.close(fig)
 
     def plot_activity_distributions(self):
         """Create distribution plots for different types of activities, split into two groups."""
+        plt = self.pyplot()
+        sns = self.seaborn()
         activity_cols = [col for col in self.df.columns if col.endswith('_count')]
         colors = plt.cm.cool(np.linspace(0, 1, len(activity_cols)))
         
@@ -83,7 +184,7 @@ class TikTokWeatherVisualizer:
             axes1[i].set_title(f'Distribution of {col.replace("_count", "").replace("_", " ").title()}')
         
         plt.tight_layout()
-        plt.savefig(f"{self.output_dir}/activity_distributions_1.png", dpi=300, bbox_inches='tight')
+        self.save_figure(fig1, 'activity_distributions_1')
         plt.close(fig1)
         
         # Second group of distributions
@@ -93,12 +194,16 @@ class TikTokWeatherVisualizer:
             axes2[i].set_title(f'Distribution of {col.replace("_count", "").replace("_", " ").title()}')
         
         plt.tight_layout()
-        plt.savefig(f"{self.output_dir}/activity_distributions_2.png", dpi=300, bbox_inches='tight')
+        self.save_figure(fig2, 'activity_distributions_2')
         plt.close(fig2)
 
     def plot_monthly_patterns(self):
         """Create a plot showing monthly patterns in activity."""
-        monthly_activity = self.df.groupby('month_name')['total_activity'].agg(['mean', 'std'])
+        plt = self.pyplot()
+        monthly_activity = (self.cube.aggregate('month', ['total_activity'])
+                           [['total_activity_mean', 'total_activity_std']]
+                           .set_axis(['mean', 'std'], axis=1))
+        monthly_activity.index = [month_name[month] for month in monthly_activity.index]
         
         fig, ax = plt.subplots(figsize=(12, 6))
         monthly_activity['mean'].plot(kind='bar', 
@@ -112,11 +217,13 @@ class TikTokWeatherVisualizer:
         ax.set_ylabel('Average Activity (with std dev)')
         plt.xticks(rotation=45)
         plt.tight_layout()
-        plt.savefig(f"{self.output_dir}/monthly_patterns.png", dpi=300, bbox_inches='tight')
+        self.save_figure(fig, 'monthly_patterns')
         plt.close(fig)
 
     def plot_weather_activity_boxplot(self):
         """Create boxplots showing activity distribution for each weather condition."""
+        plt = self.pyplot()
+        sns = self.seaborn()
         fig, ax = plt.subplots(figsize=(14, 8))
         
         # Get number of weather conditions for color mapping
@@ -129,16 +236,16 @@ class TikTokWeatherVisualizer:
         plt.xticks(rotation=45, ha='right')
         ax.set_title('Activity Distribution by Weather Condition')
         plt.tight_layout()
-        plt.savefig(f"{self.output_dir}/weather_activity_boxplot.png", dpi=300, bbox_inches='tight')
+        self.save_figure(fig, 'weather_activity_boxplot')
         plt.close(fig)
 
     def plot_hourly_heatmap(self):
         """Create a heatmap showing activity patterns by hour and day of week."""
-        pivot_table = pd.pivot_table(self.df, 
-                                   values='total_activity',
-                                   index='hour',
-                                   columns='day_of_week',
-                                   aggfunc='mean')
+        plt = self.pyplot()
+        sns = self.seaborn()
+        pivot_table = (self.cube.aggregate(['hour', 'day_of_week'], ['total_activity'])
+                       ['total_activity_mean']
+                       .unstack('day_of_week'))
         
         # Reorder columns for correct day order
         days_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 
@@ -153,11 +260,12 @@ class TikTokWeatherVisualizer:
                    ax=ax)
         ax.set_title('Average Activity by Hour and Day of Week')
         plt.tight_layout()
-        plt.savefig(f"{self.output_dir}/hourly_heatmap.png", dpi=300, bbox_inches='tight')
+        self.save_figure(fig, 'hourly_heatmap')
         plt.close(fig)
 
     def plot_temperature_activity_hexbin(self):
         """Create a hexbin plot of temperature vs activity."""
+        plt = self.pyplot()
         fig, ax = plt.subplots(figsize=(12, 8))
         plt.hexbin(self.df['temperature'], self.df['total_activity'], 
                   gridsize=20, cmap='cool')
@@ -166,13 +274,15 @@ class TikTokWeatherVisualizer:
         ax.set_xlabel('Temperature (°C)')
         ax.set_ylabel('Activity Count')
         plt.tight_layout()
-        plt.savefig(f"{self.output_dir}/temperature_activity_hexbin.png", dpi=300, bbox_inches='tight')
+        self.save_figure(fig, 'temperature_activity_hexbin')
         plt.close(fig)
 
     def plot_activity_type_comparison(self):
         """Create a comparison of different activity types."""
-        activity_cols = [col for col in self.df.columns if col.endswith('_count')]
-        activity_means = self.df[activity_cols].mean()
+        plt = self.pyplot()
+        activity_cols = self.activity_cols
+        overall = self.cube.aggregate(measures=activity_cols).iloc[0]
+        activity_means = pd.Series([overall[f'{col}_mean'] for col in activity_cols], index=activity_cols)
         
         fig, ax = plt.subplots(figsize=(10, 6))
         colors = plt.cm.tab20b(np.linspace(0, 1, len(activity_cols)))
@@ -180,25 +290,28 @@ class TikTokWeatherVisualizer:
         
         ax.set_title('Distribution of Activity Types')
         plt.tight_layout()
-        plt.savefig(f"{self.output_dir}/activity_type_comparison.png", dpi=300, bbox_inches='tight')
+        self.save_figure(fig, 'activity_type_comparison')
         plt.close(fig)
 
     def plot_activity_by_weather(self):
         """Create a bar plot of average activity by weather condition."""
+        plt = self.pyplot()
         fig, ax = plt.subplots(figsize=(12, 6))
-        weather_activity = (self.df.groupby('weather_description')['total_activity']
-                          .mean()
+        weather_activity = (self.cube.aggregate('weather_description', ['total_activity'])
+                          ['total_activity_mean']
                           .sort_values(ascending=True))
         
         weather_activity.plot(kind='barh', color='blueviolet', ax=ax)
         ax.set_title('Average TikTok Activity by Weather Condition')
         ax.set_xlabel('Average Activity')
         plt.tight_layout()
-        plt.savefig(f"{self.output_dir}/activity_by_weather.png", dpi=300, bbox_inches='tight')
+        self.save_figure(fig, 'activity_by_weather')
         plt.close(fig)
     
     def plot_temperature_correlation(self):
         """Create a scatter plot of temperature vs activity."""
+        plt = self.pyplot()
+        sns = self.seaborn()
         fig, ax = plt.subplots(figsize=(10, 6))
         sns.scatterplot(data=self.df, x='temperature', y='total_activity', alpha=0.5, ax=ax)
         sns.regplot(data=self.df, x='temperature', y='total_activity', 
@@ -207,13 +320,14 @@ class TikTokWeatherVisualizer:
         ax.set_xlabel('Temperature (°C)')
         ax.set_ylabel('Activity Count')
         plt.tight_layout()
-        plt.savefig(f"{self.output_dir}/temperature_correlation.png", dpi=300, bbox_inches='tight')
+        self.save_figure(fig, 'temperature_correlation')
         plt.close(fig)
     
     def plot_hourly_patterns(self):
         """Create a line plot of average activity by hour."""
+        plt = self.pyplot()
         fig, ax = plt.subplots(figsize=(12, 6))
-        hourly_avg = self.df.groupby('hour')['total_activity'].mean()
+        hourly_avg = self.cube.aggregate('hour', ['total_activity'])['total_activity_mean']
         
         plt.plot(hourly_avg.index, hourly_avg.values, 
                 color=plt.cm.cool(0.6),
@@ -226,15 +340,16 @@ class TikTokWeatherVisualizer:
         ax.set_xticks(range(0, 24))
         ax.grid(True, alpha=0.3)
         plt.tight_layout()
-        plt.savefig(f"{self.output_dir}/hourly_patterns.png", dpi=300, bbox_inches='tight')
+        self.save_figure(fig, 'hourly_patterns')
         plt.close(fig)
     
     def plot_weekly_patterns(self):
         """Create a bar plot of average activity by day of week."""
+        plt = self.pyplot()
         fig, ax = plt.subplots(figsize=(12, 6))
         days_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        weekly_avg = (self.df.groupby('day_of_week')['total_activity']
-                     .mean()
+        weekly_avg = (self.cube.aggregate('day_of_week', ['total_activity'])
+                     ['total_activity_mean']
                      .reindex(days_order))
         
         weekly_avg.plot(kind='bar', ax=ax, color='blueviolet')
@@ -243,21 +358,20 @@ class TikTokWeatherVisualizer:
         ax.set_ylabel('Average Activity')
         plt.xticks(rotation=45)
         plt.tight_layout()
-        plt.savefig(f"{self.output_dir}/weekly_patterns.png", dpi=300, bbox_inches='tight')
+        self.save_figure(fig, 'weekly_patterns')
         plt.close(fig)
     
-    def plot_weather_activity_heatmaps(self):
+    def plot_weather_activity_heatmaps(self, activity_cols=None):
         """Create detailed heatmaps for weather conditions vs different activities."""
-        activity_cols = [col for col in self.df.columns if col.endswith('_count')]
+        plt = self.pyplot()
+        sns = self.seaborn()
+        if activity_cols is None:
+            activity_cols = self.activity_cols
+        # One cube slice serves the heatmaps of all activity types
+        hourly_weather = self.cube.aggregate(['hour', 'weather_description'], activity_cols)
         
         for activity_col in activity_cols:
-            pivot_data = pd.pivot_table(
-                self.df,
-                values=activity_col,
-                index='hour',
-                columns='weather_description',
-                aggfunc='mean'
-            )
+            pivot_data = hourly_weather[f'{activity_col}_mean'].unstack('weather_description')
             
             fig, ax = plt.subplots(figsize=(15, 8))
             sns.heatmap(
@@ -276,11 +390,13 @@ class TikTokWeatherVisualizer:
             
             plt.xticks(rotation=45, ha='right')
             plt.tight_layout()
-            plt.savefig(f"{self.output_dir}/heatmap_{activity_col}.png", dpi=300, bbox_inches='tight')
+            self.save_figure(fig, f'heatmap_{activity_col}')
             plt.close(fig)
 
     def plot_activity_correlation_heatmap(self):
         """Create a heatmap showing correlations between different types of activities."""
+        plt = self.pyplot()
+        sns = self.seaborn()
         # Get all activity columns
         activity_cols = [col for col in self.df.columns if col.endswith('_count')]
         
@@ -310,91 +426,357 @@ class TikTokWeatherVisualizer:
         plt.tight_layout()
         
         # Save the plot
-        plt.savefig(
-            f"{self.output_dir}/activity_correlation_heatmap.png",
-            dpi=300,
-            bbox_inches='tight'
-        )
+        self.save_figure(fig, 'activity_correlation_heatmap')
         plt.close(fig)
 
+    def weather_activity_time_matrix(self, max_rows):
+        """Total activity per (time bin x weather condition), binned by day, week or month.
+
+        The finest bin giving at most `max_rows` rows over the data's span is
+        used. Rows are every bin of the span, and cells without any hours of
+        that weather are NaN. Returns the matrix and the bin label.
+        """
+        timestamps = self.df['timestamp']
+        for freq, label in TIME_BINS:
+            first, last = timestamps.min().to_period(freq), timestamps.max().to_period(freq)
+            if last.ordinal - first.ordinal + 1 <= max_rows:
+                break
+        # Period ordinals count bins, so row positions come from one subtraction
+        rows = timestamps.dt.to_period(freq).array.asi8 - first.ordinal
+        weather = self.df['weather_description'].astype('category')
+        columns = weather.cat.codes.to_numpy().astype(np.int64)
+        known = columns >= 0
+        n_rows, n_columns = last.ordinal - first.ordinal + 1, len(weather.cat.categories)
+        cells = rows[known] * n_columns + columns[known]
+        size = n_rows * n_columns
+        totals = np.bincount(cells, weights=self.df['total_activity'].to_numpy(dtype=np.float64)[known],
+                             minlength=size).reshape(n_rows, n_columns)
+        hours = np.bincount(cells, minlength=size).reshape(n_rows, n_columns)
+        starts = pd.period_range(first, last, freq=freq).start_time
+        index = starts.strftime('%Y-%m' if freq == 'M' else '%Y-%m-%d')
+        matrix = pd.DataFrame(np.where(hours > 0, totals, np.nan), index=index,
+                              columns=list(weather.cat.categories))
+        return matrix, label
+
     def plot_weather_activity_time_heatmap(self):
         """Create a heatmap showing activity patterns across weather conditions and time."""
-        # Create pivot table for total activity
-        pivot_data = pd.pivot_table(
-            self.df,
-            values='total_activity',
-            index=[self.df['timestamp'].dt.date, 'weather_description'],
-            aggfunc='sum'
-        ).reset_index()
-        
-        # Create a matrix form of the data
-        matrix_data = pivot_data.pivot(
-            index='timestamp',
-            columns='weather_description',
-            values='total_activity'
-        )
+        plt = self.pyplot()
+        figsize = (15, 10)
+        # Bin the history so every row is still a few pixels high
+        matrix_data, bin_label = self.weather_activity_time_matrix(int(figsize[1] * TIME_ROWS_PER_INCH))
         
         # Create figure
-        fig, ax = plt.subplots(figsize=(15, 10))
-        
-        # Create heatmap
-        sns.heatmap(
-            matrix_data,
-            cmap='cool',
-            ax=ax,
-            cbar_kws={'label': 'Total Activity Count'}
-        )
+        fig, ax = plt.subplots(figsize=figsize)
+        
+        if len(matrix_data) > RASTER_ROWS:
+            # One image instead of a patch per cell keeps drawing time flat as history grows
+            image = ax.imshow(matrix_data.to_numpy(), aspect='auto', interpolation='nearest', cmap='cool')
+            fig.colorbar(image, ax=ax, label='Total Activity Count')
+            ax.set_xticks(range(len(matrix_data.columns)), matrix_data.columns)
+            ticks = np.linspace(0, len(matrix_data) - 1, min(len(matrix_data), 30)).round().astype(int)
+            ax.set_yticks(ticks, matrix_data.index[ticks])
+            ax.grid(False)
+        else:
+            sns = self.seaborn()
+            sns.heatmap(
+                matrix_data,
+                cmap='cool',
+                ax=ax,
+                cbar_kws={'label': 'Total Activity Count'}
+            )
         
         # Customize the plot
         ax.set_title('Activity Patterns Across Weather Conditions Over Time')
         ax.set_xlabel('Weather Condition')
-        ax.set_ylabel('Date')
+        ax.set_ylabel(bin_label)
         
         # Rotate x-axis labels for better readability
         plt.xticks(rotation=45, ha='right')
         plt.tight_layout()
         
         # Save the plot
-        plt.savefig(
-            f"{self.output_dir}/weather_activity_time_heatmap.png",
-            dpi=300,
-            bbox_inches='tight'
-        )
+        self.save_figure(fig, 'weather_activity_time_heatmap')
         plt.close(fig)
 
-    def create_all_visualizations(self):
-        """Generate all visualizations."""
-        print("Generating visualizations...")
+    def plot_lagged_correlations(self):
+        """Create line plots of how each weather variable correlates with activity in the following hours."""
+        plt = self.pyplot()
+        lagged = self.lagged_correlations()
+        correlations, peaks = lagged['correlations'], lagged['peaks']
+        weather_vars = list(pd.unique(correlations['weather']))
+        activity_cols = list(pd.unique(correlations['activity']))
+        colors = plt.cm.cool(np.linspace(0, 1, len(activity_cols)))
         
-        visualization_methods = [
-            self.plot_correlation_heatmap,
-            self.plot_activity_distributions,
-            self.plot_monthly_patterns,
-            self.plot_weather_activity_boxplot,
-            self.plot_hourly_heatmap,
-            self.plot_temperature_activity_hexbin,
-            self.plot_activity_type_comparison,
-            self.plot_activity_by_weather,
-            self.plot_temperature_correlation,
-            self.plot_hourly_patterns,
-            self.plot_weekly_patterns,
-            self.plot_weather_activity_heatmaps,
-            self.plot_activity_correlation_heatmap,
-            self.plot_weather_activity_time_heatmap
-        ]
-        
-        for method in visualization_methods:
-            try:
-                print(f"- Generating {method.__name__}")
-                method()
-            except Exception as e:
-                print(f"Error in {method.__name__}: {str(e)}")
+        fig, axes = plt.subplots(len(weather_vars), 1, figsize=(12, 4 * len(weather_vars)),
+                                 sharex=True, squeeze=False)
+        for ax, weather in zip(axes[:, 0], weather_vars):
+            subset = correlations[correlations['weather'] == weather]
+            # The band differs slightly per activity; the widest one is shaded
+            band = subset.groupby('lag')['band'].max()
+            ax.fill_between(band.index, -band, band, color='grey', alpha=0.2, label='95% null band')
+            for color, activity in zip(colors, activity_cols):
+                line = subset[subset['activity'] == activity]
+                ax.plot(line['lag'], line['r'], color=color, linewidth=1.5,
+                        label=activity.replace('_count', '').replace('_', ' ').title())
+                peak = peaks[(peaks['weather'] == weather) & (peaks['activity'] == activity)]
+                ax.scatter(peak['lag'], peak['r'], color=color, marker='o', zorder=3)
+            ax.axhline(0, color='black', linewidth=0.8)
+            ax.set_title(f'{weather.replace("_", " ").title()} Now vs. Activity Later')
+            ax.set_ylabel('Correlation')
+        axes[-1, 0].set_xlabel('Lag (hours)')
+        axes[0, 0].legend(loc='upper right', fontsize='small', ncol=2)
+        plt.tight_layout()
+        self.save_figure(fig, 'lagged_correlations')
+        plt.close(fig)
+
+    def plot_jobs(self):
+        """Every plot as a (method name, arguments) job; the per-activity heatmaps are separate jobs."""
+        jobs = [(name, ()) for name in [
+            'plot_correlation_heatmap',
+            'plot_activity_distributions',
+            'plot_monthly_patterns',
+            'plot_weather_activity_boxplot',
+            'plot_hourly_heatmap',
+            'plot_temperature_activity_hexbin',
+            'plot_activity_type_comparison',
+            'plot_activity_by_weather',
+            'plot_temperature_correlation',
+            'plot_hourly_patterns',
+            'plot_weekly_patterns'
+        ]]
+        jobs += [('plot_weather_activity_heatmaps', ([col],)) for col in self.activity_cols]
+        jobs += [('plot_activity_correlation_heatmap', ()), ('plot_weather_activity_time_heatmap', ()),
+                 ('plot_lagged_correlations', ())]
+        return jobs
+
+    def job_inputs(self, name, job_args):
+        """Names of the files a plot job writes and the data it is drawn from: raw columns or the cube slice it plots."""
+        activity_cols = self.activity_cols
+        if name == 'plot_weather_activity_heatmaps':
+            col = job_args[0][0]
+            return ([f'heatmap_{col}'],
+                    self.cube.aggregate(['hour', 'weather_description'], [col])[f'{col}_mean'])
+        specs = {
+            'plot_correlation_heatmap': (['correlation_heatmap'], self.correlations),
+            'plot_activity_distributions': (['activity_distributions_1', 'activity_distributions_2'],
+                                            lambda: self.df[activity_cols]),
+            'plot_monthly_patterns': (['monthly_patterns'], lambda: self.cube.aggregate(
+                'month', ['total_activity'])[['total_activity_mean', 'total_activity_std']]),
+            'plot_weather_activity_boxplot': (['weather_activity_boxplot'],
+                                              lambda: self.df[['weather_description', 'total_activity']]),
+            'plot_hourly_heatmap': (['hourly_heatmap'], lambda: self.cube.aggregate(
+                ['hour', 'day_of_week'], ['total_activity'])['total_activity_mean']),
+            'plot_temperature_activity_hexbin': (['temperature_activity_hexbin'],
+                                                 lambda: self.df[['temperature', 'total_activity']]),
+            'plot_activity_type_comparison': (['activity_type_comparison'], lambda: self.cube.aggregate(
+                measures=activity_cols)[[f'{col}_mean' for col in activity_cols]]),
+            'plot_activity_by_weather': (['activity_by_weather'], lambda: self.cube.aggregate(
+                'weather_description', ['total_activity'])['total_activity_mean']),
+            'plot_temperature_correlation': (['temperature_correlation'],
+                                             lambda: self.df[['temperature', 'total_activity']]),
+            'plot_hourly_patterns': (['hourly_patterns'], lambda: self.cube.aggregate(
+                'hour', ['total_activity'])['total_activity_mean']),
+            'plot_weekly_patterns': (['weekly_patterns'], lambda: self.cube.aggregate(
+                'day_of_week', ['total_activity'])['total_activity_mean']),
+            'plot_activity_correlation_heatmap': (['activity_correlation_heatmap'],
+                                                  lambda: self.df[activity_cols]),
+            'plot_weather_activity_time_heatmap': (['weather_activity_time_heatmap'], lambda: self.df[
+                ['timestamp', 'weather_description', 'total_activity']]),
+            'plot_lagged_correlations': (['lagged_correlations'],
+                                         lambda: self.lagged_correlations()['correlations'])
+        }
+        files, data = specs[name]
+        return files, data()
+
+    def render_key(self, name, job_args):
+        """Cache key of a plot job: its input data, rendering parameters and the source of its method."""
+        names, data = self.job_inputs(name, job_args)
+        profile = PROFILES[self.profile]
+        description = {
+            'plot': name,
+            'args': job_args,
+            'params': profile,
+            'code': code_version(type(self), name),
+            'data': data_digest(data)
+        }
+        files = [f"{file_name}.{profile['format']}" for file_name in names]
+        return files, hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def create_all_visualizations(self, workers=1, use_cache=True, only=None):
+        """Generate all visualizations, optionally rendering them in a pool of worker processes.
+
+        Plots whose cache key matches the render manifest and whose files
+        still exist are skipped unless `use_cache` is False. `only` limits
+        the run to plots named without their `plot_` prefix.
+        """
+        print("Generating visualizations...")
         
+        manifest_path = os.path.join(self.output_dir, MANIFEST_FILE)
+        manifest = {}
+        if use_cache and os.path.exists(manifest_path):
+            with open(manifest_path) as file:
+                manifest = json.load(file)
+        
+        jobs, keys, entries = [], {}, {}
+        for name, job_args in self.plot_jobs():
+            if only and name[len('plot_'):] not in only:
+                continue
+            label = job_label(name, job_args)
+            files, keys[label] = self.render_key(name, job_args)
+            cached = manifest.get(label)
+            if cached and cached['key'] == keys[label] and \
+                    all(os.path.exists(os.path.join(self.output_dir, file)) for file in files):
+                entries[label] = dict(cached, status='hit')
+            else:
+                jobs.append((name, job_args))
+                entries[label] = {'key': keys[label], 'files': files}
+        
+        if workers > 1 and len(jobs) > 1:
+            results = render_parallel(self, jobs, workers)
+        else:
+            results = [render_job(self, name, job_args) for name, job_args in jobs]
+        
+        for name, job_args, error, elapsed in results:
+            label = job_label(name, job_args)
+            entries[label].update(status='error' if error else 'miss', seconds=round(elapsed, 3))
+            if error:
+                print(f"Error in {name}: {error}")
+        
+        for label, entry in entries.items():
+            detail = f"{entry['seconds']:.2f}s" if entry['status'] != 'hit' else 'cached'
+            print(f"- {entry['status']:<5} {label} ({detail})")
+        
+        # Failed plots are left out of the manifest so the next run retries them
+        with open(manifest_path, 'w') as file:
+            json.dump({label: entry for label, entry in entries.items() if entry['status'] != 'error'},
+                      file, indent=2)
+        
+        hits = sum(entry['status'] == 'hit' for entry in entries.values())
+        rendered = sum(entry.get('seconds', 0) for entry in entries.values() if entry['status'] != 'hit')
+        print(f"{hits} cached, {len(jobs)} rendered in {rendered:.2f}s")
         print(f"All visualizations saved in {self.output_dir}/")
 
+def job_label(name, job_args):
+    return f"{name}({job_args[0][0]})" if job_args else name
+
+def code_version(cls, name):
+    """Hash of a method's source, the `self.` methods it calls and the module constants it reads."""
+    digest = hashlib.sha256()
+    pending, seen = [name], set()
+    while pending:
+        method = pending.pop()
+        if method in seen or not callable(getattr(cls, method, None)):
+            continue
+        seen.add(method)
+        source = inspect.getsource(getattr(cls, method))
+        digest.update(source.encode())
+        pending += re.findall(r'self\.(\w+)\(', source)
+        for constant in sorted(set(re.findall(r'\b[A-Z][A-Z_]+\b', source))):
+            if constant in globals():
+                digest.update(f'{constant}={globals()[constant]!r}'.encode())
+    return digest.hexdigest()
+
+def data_digest(data):
+    """Hash of the values, index and column names of a DataFrame or Series."""
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    columns = data.columns if isinstance(data, pd.DataFrame) else [data.name]
+    digest.update(json.dumps([str(col) for col in columns]).encode())
+    return digest.hexdigest()
+
+def render_job(visualizer, name, job_args):
+    """Render one plot, isolating its failure; returns (name, args, error or None, seconds)."""
+    begin = time.perf_counter()
+    try:
+        getattr(visualizer, name)(*job_args)
+        error = None
+    except Exception as e:
+        error = str(e)
+    finally:
+        # Only close figures if the plot got as far as importing pyplot
+        if 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].close('all')
+    return name, job_args, error, time.perf_counter() - begin
+
+# Visualizer of a worker process, built once from the shared DataFrame
+_worker_block = None
+_worker_visualizer = None
+
+def _share_frame(df):
+    """Copy a DataFrame into a shared memory block as an Arrow IPC stream; returns the block."""
+    import pyarrow as pa
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    buffer = sink.getvalue()
+    block = shared_memory.SharedMemory(create=True, size=max(buffer.size, 1))
+    block.buf[:buffer.size] = memoryview(buffer).cast('B')
+    return block
+
+def _init_worker(block_name, cube, output_dir, profile):
+    """Attach to the shared DataFrame and build this worker's visualizer with a headless backend."""
+    global _worker_block, _worker_visualizer
+    import matplotlib
+    import pyarrow as pa
+    matplotlib.use('Agg')
+    # Numeric columns without nulls become read-only views of the block, so it stays attached
+    # while the worker lives; nullable, boolean and categorical columns are converted to copies
+    _worker_block = shared_memory.SharedMemory(name=block_name)
+    table = pa.ipc.open_stream(pa.py_buffer(_worker_block.buf)).read_all()
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    del table
+    _worker_visualizer = TikTokWeatherVisualizer(df=df, cube=cube, output_dir=output_dir, profile=profile)
+
+def _render_in_worker(job):
+    return render_job(_worker_visualizer, *job)
+
+def render_parallel(visualizer, jobs, workers):
+    """Render plot jobs in a process pool that shares the visualizer's DataFrame through shared memory."""
+    columns = [col for col in visualizer.df.columns if col not in ('month', 'month_name')]
+    block = _share_frame(visualizer.df[columns])
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(block.name, visualizer.cube, visualizer.output_dir,
+                                           visualizer.profile)) as executor:
+            futures = [executor.submit(_render_in_worker, job) for job in jobs]
+            results = []
+            for (name, job_args), future in zip(jobs, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    # A crashed worker only loses its own plots
+                    results.append((name, job_args, f"worker failed: {e}", 0.0))
+            return results
+    finally:
+        block.close()
+        block.unlink()
+
 def main():
-    visualizer = TikTokWeatherVisualizer()
-    visualizer.create_all_visualizations()
+    parser = argparse.ArgumentParser(description='Generate visualizations of the merged data.')
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='Storage format of the merged data')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Render plots in this many worker processes')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Render every plot even if its inputs are unchanged')
+    parser.add_argument('--profile', choices=list(PROFILES), default='publication',
+                        help='preview: 72 dpi PNG, publication: 300 dpi PNG, svg/pdf: vector output')
+    parser.add_argument('--only', default='',
+                        help='Comma-separated plots to render, e.g. hourly_heatmap,weekly_patterns')
+    args = parser.parse_args()
+
+    begin = time.perf_counter()
+    only = [name for name in args.only.split(',') if name]
+    available = [name[len('plot_'):] for name in dir(TikTokWeatherVisualizer)
+                 if name.startswith('plot_') and name != 'plot_jobs']
+    unknown = sorted(set(only) - set(available))
+    if unknown:
+        parser.error(f"unknown plots {', '.join(unknown)}; choose from {', '.join(sorted(available))}")
+
+    visualizer = TikTokWeatherVisualizer(data_format=args.format, profile=args.profile)
+    visualizer.create_all_visualizations(args.workers, use_cache=not args.no_cache, only=only)
+    print(f"Finished in {time.perf_counter() - begin:.2f}s")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,75 @@
+import pandas as pd
+import numpy as np
+
+def parse_windows(spec):
+    """Parse a comma-separated list of look-back windows such as '3h,24h' into {label: Timedelta}."""
+    labels = [label.strip() for label in spec.split(',') if label.strip()] if spec else []
+    return {label: pd.Timedelta(label if label[0].isdigit() else f'1{label}') for label in labels}
+
+def _rolling_features(timestamps, precipitation, temperature, windows, tolerance):
+    """Look-back features of one sorted weather series, one searchsorted per window.
+
+    Precipitation is accumulated from a single cumulative sum over the
+    series; the temperature delta compares each hour with the latest hour at
+    or before the start of its window, if that hour is within `tolerance`.
+    """
+    cumulative = np.concatenate([[0.0], np.cumsum(np.nan_to_num(precipitation))])
+    positions = np.arange(len(timestamps))
+    features = {}
+    for label, window in windows.items():
+        window_start = timestamps - window.value
+        # First hour inside (t - window, t]; the hour before it is the as-of match for t - window
+        first = np.searchsorted(timestamps, window_start, side='right')
+        features[f'precipitation_sum_{label}'] = cumulative[positions + 1] - cumulative[first]
+
+        previous = first - 1
+        found = (previous >= 0) & (timestamps[np.clip(previous, 0, None)] >= window_start - tolerance.value)
+        delta = np.full(len(timestamps), np.nan)
+        delta[found] = temperature[found] - temperature[previous[found]]
+        features[f'temperature_delta_{label}'] = delta
+    return features
+
+def add_rolling_features(weather, windows, tolerance='1h'):
+    """Add accumulated precipitation and temperature delta columns for every look-back window.
+
+    `windows` maps column suffixes to window lengths (see `parse_windows`).
+    Weather partitioned by location is handled one location at a time.
+    """
+    if not windows:
+        return weather
+    tolerance = pd.Timedelta(tolerance)
+    sort_keys = ['location', 'timestamp'] if 'location' in weather.columns else ['timestamp']
+    weather = weather.sort_values(sort_keys, kind='stable').reset_index(drop=True)
+
+    groups = weather.groupby('location', observed=True).indices.values() if 'location' in weather.columns \
+        else [np.arange(len(weather))]
+    columns = {}
+    for rows in groups:
+        features = _rolling_features(weather['timestamp'].to_numpy(dtype='datetime64[ns]')[rows].astype(np.int64),
+                                     weather['precipitation'].to_numpy(dtype=np.float64)[rows],
+                                     weather['temperature'].to_numpy(dtype=np.float64)[rows],
+                                     windows, tolerance)
+        for name, values in features.items():
+            columns.setdefault(name, np.full(len(weather), np.nan))[rows] = values
+    # Inputs carry one decimal, so rounding removes float32 noise from the sums and differences
+    return weather.assign(**{name: np.round(values, 2).astype(np.float32) for name, values in columns.items()})
+
+def asof_join(activity, weather, tolerance='1h', by=None):
+    """Join every activity bucket to the latest weather at or before its start.
+
+    Weather older than `tolerance` does not match, and those buckets are
+    dropped, so a missing weather hour is bridged by the previous one instead
+    of losing the bucket. Returns the joined rows sorted by time and the
+    number of buckets dropped.
+    """
+    weather = weather.assign(_weather_time=weather['timestamp'])
+    joined = pd.merge_asof(
+        activity.sort_values('timestamp', kind='stable'),
+        weather.sort_values('timestamp', kind='stable'),
+        on='timestamp',
+        by=by,
+        direction='backward',
+        tolerance=pd.Timedelta(tolerance)
+    )
+    matched = joined['_weather_time'].notna()
+    return joined[matched].drop(columns='_weather_time').reset_index(drop=True), int((~matched).sum())